@@ -1,14 +1,26 @@
 import json
-import urlfetch
 import base64
 import re
-import pytz
+import time
+import threading
+import http.client
 import argparse
-import pandas as pd
-from dateutil import parser
-from matplotlib.ticker import FuncFormatter
-import matplotlib.pyplot as plt
-import seaborn as sns
+import os
+from datetime import datetime, timezone
+import sys
+from urllib.parse import urlsplit, quote
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "local_plotting"))
+from metrics_cache import MetricsCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES
+from records import NUMERIC_METRICS, NUMERIC_PATHS, DecodeReport, decode_record, not_json
+import profiling
+
+# pandas, matplotlib, seaborn, pytz, and dateutil are imported where they are used, so that --help and
+# invalid arguments do not wait for them
+
+API_URL = "https://api.github.com"
+api_url = API_URL
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Retrieve native image size from last GitHub commit using setup-graalvm action.")
@@ -17,49 +29,418 @@ def parse_args():
     parser.add_argument("branch", help="Name of the branch")
     parser.add_argument("token", help="Your personal access token")
     parser.add_argument("n", nargs="?", default="10", help="Last n commits (default is 10)") 
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of GraphQL queries or REST chains in flight at the same time (default is 8)")
+    parser.add_argument("--api-url", default=API_URL, help="Base URL of the GitHub REST API, e.g. a local stand-in server (default is " + API_URL + ")")
+    parser.add_argument("--compare-serial", action="store_true", help="Additionally fetch the metrics with the same --fetch method one request after another, without the cache, and report the speedup of --concurrency")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Path of the decoded metrics cache (default is " + DEFAULT_CACHE_PATH + ")")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 1e6, help="Maximum size of the metrics cache in MB (default is {:.0f})".format(DEFAULT_MAX_BYTES / 1e6))
+    parser.add_argument("--no-cache", action="store_true", help="Download every metrics blob again instead of using the cache")
+    parser.add_argument("--discovery", choices=["refs", "events"], default="refs", help="Find builds by listing the graalvm-metrics refs and the branch's commits, or from the push events of the last 90 days (default is refs)")
+    parser.add_argument("--fetch", choices=["graphql", "rest"], default="graphql", help="Read the metrics blobs with batched GraphQL queries, or with one ref -> tree -> blob chain of REST requests per commit (default is graphql)")
+    parser.add_argument("--graphql-batch", type=int, default=50, help="Commits resolved per GraphQL query, halved automatically when a query exceeds GitHub's limits (default is 50)")
+    parser.add_argument("--graphql-url", help="URL of the GitHub GraphQL API (default is <api-url>/graphql)")
+    parser.add_argument("--rollup", choices=["day", "week"], help="Plot the median, range, and 95th percentile of the sizes per day or week instead of every commit")
+    parser.add_argument("--warehouse", help="Query the builds from a metrics warehouse of a local clone (see local_plotting/ingest.py) instead of the GitHub API")
+    parser.add_argument("--profile", nargs="?", const="", metavar="PATH", help="Record the time, requests, bytes, and peak memory of every stage and write them to PATH (default is profile_remote_{time}.json next to output_plot.png)")
+    parser.add_argument("--profile-format", choices=profiling.TRACE_FORMATS, default="json", help="Write the profile as JSON or as Chrome trace events for chrome://tracing (default is json)")
 
     return parser.parse_args()
 
-def check_response(response):
-    if response.status != 200:
-        data = json.loads(response.content)
-        message = data.get("message")
+class GitHubClient:
+    '''Thread-safe GitHub REST client. Each worker thread keeps its own keep-alive connection, and all threads share
+    one rate-limit window so that an exhausted X-RateLimit-Remaining or a Retry-After header pauses the whole pool.'''
+
+    def __init__(self, token, base_url=API_URL, max_retries=5):
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.token = token
+        self.max_retries = max_retries
+        self.requests = 0
+        self.bytes_received = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if self.scheme == "https":
+                connection = http.client.HTTPSConnection(self.host, timeout=30)
+            else:
+                connection = http.client.HTTPConnection(self.host, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def _reset_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _wait_for_rate_limit(self):
+        with self._lock:
+            delay = self._resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _pause_all(self, delay):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.time() + delay)
+
+    def pause_until(self, timestamp):
+        '''Holds back all requests of the pool until the given epoch seconds, e.g. when a rate limit resets.'''
+
+        self._pause_all(timestamp - time.time())
+
+    def _backoff(self, response, attempt):
+        '''Returns the seconds to wait before retrying a rate limited or failed response, or None if it should not be retried.'''
+
+        retry_after = response.getheader("Retry-After")
+        remaining = response.getheader("X-RateLimit-Remaining")
+        reset = response.getheader("X-RateLimit-Reset")
+        if retry_after is not None:
+            return max(float(retry_after), 1)
+        if response.status in (403, 429) and remaining == "0" and reset is not None:
+            return max(float(reset) - time.time(), 1)
+        if response.status == 429 or response.status >= 500:
+            return 2 ** attempt
+        return None
+
+    def request(self, method, path, body=None, max_retries=None):
+        '''Sends a request to the API and returns status, response headers, and raw content. Accepts paths relative to
+        the base URL as well as absolute URLs on the same host (e.g. pagination links).'''
+
+        max_retries = self.max_retries if max_retries is None else max_retries
+        if path.startswith("http://") or path.startswith("https://"):
+            url = urlsplit(path)
+            path = url.path + ("?" + url.query if url.query else "")
+        else:
+            path = self.base_path + path
+        headers = {"Authorization": "Bearer " + self.token, "Accept": "application/vnd.github+json", "User-Agent": "build-tracking"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(max_retries + 1):
+            self._wait_for_rate_limit()
+            try:
+                connection = self._connection()
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (http.client.HTTPException, ConnectionError, TimeoutError):
+                # The server may close an idle keep-alive connection at any time, retry on a fresh one
+                self._reset_connection()
+                if attempt == max_retries:
+                    raise
+                continue
+
+            with self._lock:
+                self.requests += 1
+                self.bytes_received += len(content)
+            profiling.count("http_requests")
+            profiling.count("http_bytes", len(content))
+
+            if response.status == 200:
+                if response.getheader("X-RateLimit-Remaining") == "0" and response.getheader("X-RateLimit-Reset") is not None:
+                    self._pause_all(float(response.getheader("X-RateLimit-Reset")) - time.time())
+                return response.status, response, content
+
+            delay = self._backoff(response, attempt)
+            if delay is None or attempt == max_retries:
+                return response.status, response, content
+            print("Rate limited or server error (" + str(response.status) + "), retrying in {:.1f}s".format(delay))
+            profiling.count("http_retries")
+            self._pause_all(delay)
+
+    def get_json(self, path):
+        '''Returns the parsed JSON response of a GET request, or None if the request failed.'''
+
+        status, _, content = self.request("GET", path)
+        if status != 200:
+            message = json.loads(content).get("message") if content else str(status)
+            print("An error ocurred. The server responded with the following message: " + message)
+            return None
+        return json.loads(content)
+
+# Positions of the total, code area, and image heap size among the numeric metrics, with their scale to MB
+IMAGE_SIZE_METRICS = [(NUMERIC_PATHS.index(path), scale) for _, path, scale in NUMERIC_METRICS["image_details"]]
+
+def parse_image_data(record, problem=None):
+    '''Returns total, code area, and image heap size in MB of a parsed metrics record, and its problem as validated by
+    records.decode_record, combined with the problem of reading it. Sizes that are missing or not numbers are NaN, so
+    that the commit keeps its place in the plots. record is None if the metrics could not be read.'''
+
+    values, _, problem = decode_record(record, problem)
+    return [values[index] * scale for index, scale in IMAGE_SIZE_METRICS], problem
+
+def decode_image_data(content):
+    '''Returns the parsed metrics record of a blob, its sizes, and its problem. The record is None if it is not JSON.'''
+
+    try:
+        record, problem = json.loads(content), None
+    except ValueError as e:
+        record, problem = None, not_json(e)
+    sizes, problem = parse_image_data(record, problem)
+    return record, sizes, problem
+
+def resolve_image_data(client, commit_sha, cache=None, tree_sha=None):
+    '''Resolves the ref -> tree -> blob chain of one commit through the given client. Commits whose metrics are in the
+    cache cost no requests at all, and a known tree sha (e.g. from listing the refs) saves the ref request. Returns the
+    sizes and the problem of the commit's metrics as parse_image_data does.'''
+
+    if cache is not None:
+        record = cache.get_by_commit(commit_sha)
+        if record is not None:
+            profiling.count("records_from_cache")
+            return parse_image_data(record)
+    repo_url = '/repos/' + owner + '/' + repo_path
+    if tree_sha is None:
+        data = client.get_json(repo_url + '/git/ref/graalvm-metrics/' + commit_sha)
+        if data is None:
+            return parse_image_data(None, ("skipped", "the metrics ref could not be read"))
+        tree_sha = data.get("object").get("sha")
+    data = client.get_json(repo_url + '/git/trees/' + tree_sha)
+    if data is None or not data.get("tree"):
+        return parse_image_data(None, ("skipped", "the metrics tree could not be read or is empty"))
+    blob_sha = data.get("tree")[0].get("sha")
+    data = client.get_json(repo_url + '/git/blobs/' + blob_sha)
+    if data is None:
+        return parse_image_data(None, ("skipped", "the metrics blob could not be read"))
+    content = base64.b64decode(data.get("content"))
+    record, sizes, problem = decode_image_data(content)
+    profiling.count("blobs_decoded")
+    profiling.count("blob_bytes", len(content))
+    if cache is not None and record is not None:
+        cache.put(blob_sha, record, len(content), commit_sha)
+    return sizes, problem
+
+def resolve_all_image_data(client, shas, concurrency, cache=None, tree_shas=None):
+    '''Resolves the image data of all commits with at most `concurrency` ref -> tree -> blob chains in flight. Returns
+    the sizes and problem of every commit in the order of shas.'''
+
+    tree_shas = tree_shas or [None] * len(shas)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(lambda sha, tree_sha: resolve_image_data(client, sha, cache, tree_sha), shas, tree_shas))
+
+def fetch_image_data(client, shas, concurrency, report, cache=None, tree_shas=None):
+    '''Fetches the image data of all commits with at most `concurrency` ref -> tree -> blob chains in flight. Keeps the
+    order of shas. The problem of every commit is added to report, a records.DecodeReport.'''
+
+    results = resolve_all_image_data(client, shas, concurrency, cache, tree_shas)
+    for sha, (_, problem) in zip(shas, results):
+        report.add(sha, problem)
+    return [sizes for sizes, _ in results]
+
+# Failures of a whole GraphQL query that a smaller query may avoid
+GRAPHQL_LIMIT_ERRORS = {"MAX_NODE_LIMIT_EXCEEDED", "RESOURCE_LIMITS_EXCEEDED", "TIMEOUT"}
+
+GRAPHQL_METRICS_FIELD = '''c{index}: ref(qualifiedName: "refs/graalvm-metrics/{sha}") {{
+      target {{ ... on Tree {{ entries {{ object {{ ... on Blob {{ oid byteSize isTruncated text }} }} }} }} }}
+    }}'''
+
+def plan_rate_limit(client, rate_limit, queries):
+    '''Pauses all requests of the client until the GraphQL rate limit resets if its remaining points do not cover the
+    given number of further queries at the cost of the last one.'''
+
+    if not rate_limit or rate_limit.get("resetAt") is None:
+        return
+    profiling.count("graphql_cost", rate_limit.get("cost", 0))
+    if rate_limit.get("remaining", 0) < rate_limit.get("cost", 1) * queries:
+        reset = datetime.fromisoformat(rate_limit["resetAt"].replace("Z", "+00:00")).timestamp()
+        print("GraphQL rate limit has {} points left, pausing for {:.0f}s until it resets".format(rate_limit.get("remaining"), max(reset - time.time(), 0)))
+        client.pause_until(reset)
+
+def query_metrics_blobs(client, graphql_url, shas, queries_ahead=1):
+    '''Resolves the metrics blobs of several commits with one GraphQL query, one aliased ref lookup per commit.
+    Returns a dict of commit sha -> (blob sha, blob text, blob size) for the blobs that could be read, or None if the
+    query exceeded GitHub's limits and should be split. If the rate limit reported with the result cannot pay for
+    queries_ahead more queries like it, later requests wait for its reset.'''
+
+    fields = "\n    ".join(GRAPHQL_METRICS_FIELD.format(index=index, sha=sha) for index, sha in enumerate(shas))
+    query = "query {\n  rateLimit { cost remaining resetAt }\n  repository(owner: %s, name: %s) {\n    %s\n  }\n}" % (
+        json.dumps(owner), json.dumps(repo_path), fields)
+    status, _, content = client.request("POST", graphql_url, json.dumps({"query": query}).encode(), max_retries=1)
+    if status in (502, 504):
+        return None
+    data = json.loads(content) if content else {}
+    errors = data.get("errors") or []
+    if any(error.get("type") in GRAPHQL_LIMIT_ERRORS for error in errors) and not data.get("data"):
+        return None
+    if status != 200 or not data.get("data"):
+        message = errors[0].get("message") if errors else data.get("message", str(status))
+        print("GraphQL query failed: " + message)
+        return {}
+
+    plan_rate_limit(client, data["data"].get("rateLimit"), queries_ahead)
+    repository = data["data"].get("repository") or {}
+    blobs = {}
+    for index, sha in enumerate(shas):
+        try:
+            blob = repository["c" + str(index)]["target"]["entries"][0]["object"]
+        except (KeyError, IndexError, TypeError):
+            continue
+        # Binary or truncated blobs have no (complete) text, the REST fallback reads them
+        if blob and blob.get("text") is not None and not blob.get("isTruncated"):
+            blobs[sha] = (blob["oid"], blob["text"], blob.get("byteSize", len(blob["text"])))
+    return blobs
+
+def fetch_image_data_graphql(client, graphql_url, shas, batch_size, concurrency, report, cache=None, tree_shas=None):
+    '''Fetches the image data of all commits in batches of GraphQL queries, with at most `concurrency` queries in
+    flight. Batches exceeding GitHub's query limits are retried at half the size, and commits that still cannot be read
+    are fetched through REST. Keeps the order of shas. The problem of every commit is added to report, a
+    records.DecodeReport.'''
+
+    image_data = [None] * len(shas)
+    problems = {}
+    pending = []
+    for index, sha in enumerate(shas):
+        record = cache.get_by_commit(sha) if cache is not None else None
+        if record is not None:
+            profiling.count("records_from_cache")
+            image_data[index], problems[sha] = parse_image_data(record)
+        else:
+            pending.append(index)
+
+    queries = 0
+    failed = []
+    position = 0
+    concurrency = max(1, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while position < len(pending):
+            # One round of up to `concurrency` batches, the batch size only changes between rounds
+            batches = [pending[start:start + batch_size] for start in range(position, min(position + concurrency * batch_size, len(pending)), batch_size)]
+            # Each result checks that the rate limit covers a full next round
+            results = list(pool.map(lambda batch: query_metrics_blobs(client, graphql_url, [shas[index] for index in batch], concurrency), batches))
+            queries += len(batches)
+            profiling.count("graphql_queries", len(batches))
+            for batch, blobs in zip(batches, results):
+                if blobs is None and batch_size > 1:
+                    # This batch and all after it are queried again in smaller batches
+                    batch_size = max(1, batch_size // 2)
+                    print("GraphQL query too large, continuing with batches of {} commits".format(batch_size))
+                    break
+                for index in batch:
+                    blob = (blobs or {}).get(shas[index])
+                    if blob is None:
+                        failed.append(index)
+                        continue
+                    blob_sha, text, size = blob
+                    record, image_data[index], problems[shas[index]] = decode_image_data(text)
+                    profiling.count("blobs_decoded")
+                    profiling.count("blob_bytes", size)
+                    if cache is not None and record is not None:
+                        cache.put(blob_sha, record, size, shas[index])
+                position += len(batch)
+
+    if failed:
+        fallback_trees = [tree_shas[index] for index in failed] if tree_shas else None
+        with profiling.stage("rest fallback"):
+            for index, (sizes, problem) in zip(failed, resolve_all_image_data(client, [shas[index] for index in failed], concurrency, cache, fallback_trees)):
+                image_data[index], problems[shas[index]] = sizes, problem
+    for sha in shas:
+        report.add(sha, problems.get(sha))
+    print("Issued {} GraphQL queries (final batch size {}), {} commits fell back to REST".format(queries, batch_size, len(failed)))
+    return image_data
+
+def get_push_events(client, n):
+    '''Returns the timestamps and head commit shas of the last n pushes to the branch, newest first.'''
+
+    timestamps, shas = [], []
+    path = '/repos/' + owner + '/' + repo_path + '/events'
+    while path is not None and len(shas) < n:
+        data, path = get_page(client, path)
+        for event in data or []:
+            if event["type"] == "PushEvent" and event["payload"]["ref"] == ("refs/heads/" + branch):
+                timestamps.append(event.get("created_at"))
+                shas.append(event.get("payload").get("commits")[-1].get("sha"))
+                if len(shas) >= n:
+                    break
+    return timestamps, shas
+
+def get_page(client, path):
+    '''Returns the parsed JSON of one page of a list and the URL of the next page, or None for both if the request failed.'''
+
+    status, response, content = client.request("GET", path)
+    if status != 200:
+        message = json.loads(content).get("message") if content else str(status)
         print("An error ocurred. The server responded with the following message: " + message)
-        return False
-    return True
-
-def get_response(url, token):
-    response = urlfetch.get(url, headers={
-            "Authorization": "Bearer " + token
-        })
-    if check_response(response):
-        return json.loads(response.content)
-    return None
-
-def get_image_data(commit_sha):
-    data = get_response('https://api.github.com/repos/' + owner + '/' + repo_path + '/git/ref/graalvm-metrics/' + commit_sha, token)
-    if data != None:
-        ref_sha = data.get("object").get("sha")
-    else:
-        return [0, 0, 0]
+        return None, None
+    next_page_match = re.search(r'<([^>]+)>;\s*rel="next"', response.getheader("Link") or "")
+    return json.loads(content), next_page_match.group(1) if next_page_match else None
+
+def list_metrics_refs(client):
+    '''Returns a dict of commit sha -> metrics tree sha of all graalvm-metrics refs of the repository.'''
+
+    refs = {}
+    path = '/repos/' + owner + '/' + repo_path + '/git/matching-refs/graalvm-metrics/'
+    while path is not None:
+        data, path = get_page(client, path)
+        for ref in data or []:
+            refs[ref.get("ref").rsplit("/", 1)[-1]] = ref.get("object").get("sha")
+    return refs
+
+def get_builds(client, n):
+    '''Returns the commit dates, shas, and metrics tree shas of the last n commits of the branch that have a build,
+    newest first. Lists the metrics refs once and joins them with the commits of the branch, 100 per request.'''
+
+    metrics_refs = list_metrics_refs(client)
+    timestamps, shas, tree_shas = [], [], []
+    path = '/repos/' + owner + '/' + repo_path + '/commits?sha=' + quote(branch, safe="") + '&per_page=100'
+    while path is not None and len(shas) < n and len(shas) < len(metrics_refs):
+        data, path = get_page(client, path)
+        for commit in data or []:
+            if commit.get("sha") in metrics_refs:
+                timestamps.append(commit.get("commit").get("committer").get("date"))
+                shas.append(commit.get("sha"))
+                tree_shas.append(metrics_refs[commit.get("sha")])
+                if len(shas) >= n:
+                    break
+    return timestamps, shas, tree_shas
+
+def fetch_commits(client, shas, timestamps, n, args, report, tree_shas=None):
+    '''Fetches the image data of the given commits concurrently and returns it with the formatted commit dates. The
+    problems of their metrics are added to report, a records.DecodeReport.'''
+
+    # Extract data for plotting
+    commit_dates = [format_date(timestamp, n) for timestamp in timestamps]
+    requests = client.requests
+    bytes_received = client.bytes_received
+    cache = None if args.no_cache else MetricsCache(args.cache, int(args.cache_size * 1e6))
+    graphql_url = args.graphql_url or client.scheme + "://" + client.host + client.base_path + "/graphql"
+
+    def fetch(concurrency, report, cache):
+        if args.fetch == "graphql":
+            return fetch_image_data_graphql(client, graphql_url, shas, max(1, args.graphql_batch), concurrency, report, cache, tree_shas)
+        return fetch_image_data(client, shas, concurrency, report, cache, tree_shas)
+
+    start = time.perf_counter()
+    image_data = fetch(args.concurrency, report, cache)
+    concurrent_secs = time.perf_counter() - start
+    requests = client.requests - requests
+    bytes_received = client.bytes_received - bytes_received
+    builds = max(len(shas), 1)
+    print("Fetched metrics of {} commits in {:.2f}s ({} requests, {:.2f} MB, {:.2f} requests and {:.1f} KB per build)".format(
+        len(shas), concurrent_secs, requests, bytes_received / 1e6, requests / builds, bytes_received / 1e3 / builds))
+    if cache is not None:
+        cache.close()
+        print(cache.summary())
+
+    if args.compare_serial:
+        # The same requests one at a time and without the cache, so that only the concurrency differs
+        start = time.perf_counter()
+        with profiling.stage("serial fetch"):
+            fetch(1, DecodeReport(), None)
+        serial_secs = time.perf_counter() - start
+        transport = "GraphQL batches" if args.fetch == "graphql" else "REST chains"
+        print("Serial {} (1 in flight, no cache) took {:.2f}s, {} in flight were {:.1f}x faster".format(
+            transport, serial_secs, args.concurrency, serial_secs / max(concurrent_secs, 1e-9)))
+    return image_data, commit_dates
 
-    data = get_response('https://api.github.com/repos/' + owner + '/' + repo_path + '/git/trees/' + ref_sha, token)
-    if data != None:
-        blob_sha = data.get("tree")[0].get("sha")
-    else:
-        return [0, 0, 0]
-
-    data = get_response('https://api.github.com/repos/' + owner + '/' + repo_path + '/git/blobs/' + blob_sha, token)
-    if data != None:
-        content = base64.b64decode(data.get("content"))
-        data = json.loads(content)
-        return [data.get("image_details").get("total_bytes") / 1e6, 
-                data.get("image_details").get("code_area").get("bytes") / 1e6,
-                data.get("image_details").get("image_heap").get("bytes") / 1e6]
-    else:
-        return [0, 0, 0]
-    
 def format_date(date, n):
+    import pytz
+    from dateutil import parser
     # Parse the timestamp and convert it to the desired timezone
     commit_time = parser.isoparse(date)
     commit_time_utc = commit_time.replace(tzinfo=pytz.utc)
@@ -70,6 +451,102 @@ def format_date(date, n):
     else: 
         return commit_time_local.strftime('%d.%m.%Y \n %H:%M')
 
+def rollup_image_sizes(image_data, timestamps, period):
+    '''Returns the minimum, median, maximum, and 95th percentile of the total, code area, and image heap sizes per day or
+    week (starting on Monday, in the time zone of format_date) as data frame with one row per bucket, oldest first, and
+    a column per statistic and size, plus the number of builds per bucket as column builds. Commits without metrics are
+    left out, missing sizes are ignored.'''
+
+    import pandas as pd
+
+    sizes = pd.DataFrame(image_data, columns=["Image Size", "Code Area Size", "Image Heap Size"],
+                         index=pd.to_datetime(timestamps, utc=True).tz_convert('Europe/Berlin').tz_localize(None))
+    sizes = sizes.dropna(how="all")
+    buckets = sizes.index.floor('D')
+    if period == "week":
+        buckets = buckets - pd.to_timedelta(buckets.dayofweek, unit='D')
+    grouped = sizes.groupby(buckets)
+    rollup = pd.concat({"min": grouped.min(), "median": grouped.median(), "max": grouped.max(), "p95": grouped.quantile(0.95)}, axis=1)
+    rollup["builds"] = grouped.size()
+    return rollup
+
+def plot_image_size_rollup(rollup, period):
+    '''Plots the median of the sizes per bucket with their range from minimum to maximum and their 95th percentile to
+    output_plot.png.'''
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.ticker import FuncFormatter
+
+    sns.set_theme(style="whitegrid")
+    fig, ax = plt.subplots(figsize=(15, 11))
+    for size_type, color in zip(["Image Size", "Code Area Size", "Image Heap Size"], sns.color_palette(n_colors=3)):
+        ax.fill_between(rollup.index, rollup["min"][size_type], rollup["max"][size_type], color=color, alpha=0.15, linewidth=0)
+        ax.plot(rollup.index, rollup["p95"][size_type], color=color, linestyle=":", linewidth=1)
+        ax.plot(rollup.index, rollup["median"][size_type], color=color, marker="o", markersize=3, label=size_type)
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f"{x:.0f} MB"))
+    ax.set_xlabel("Commit Dates ({})".format("days" if period == "day" else "weeks"))
+    ax.set_ylabel("Size in MB")
+    ax.set_title("Development of Native Image Sizes: {} builds, median per {} with min to max range and p95".format(
+        int(rollup["builds"].sum()), period))
+    ax.legend(title="Size Type")
+    fig.autofmt_xdate()
+    fig.savefig("output_plot.png")
+
+def plot_image_sizes(image_data, commit_dates, n):
+    '''Plots the total, code area, and image heap sizes of the commits, newest first, to output_plot.png. Every commit
+    keeps its date on the x axis, sizes that are missing (NaN) are left out.'''
+
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.ticker import FuncFormatter
+
+    image_sizes = [entry[0] for entry in image_data]
+    code_area_sizes = [entry[1] for entry in image_data]
+    image_heap_sizes = [entry[2] for entry in image_data]
+
+    # Create a DataFrame for Seaborn
+    image_data = pd.DataFrame({ "Commit Dates": list(reversed(commit_dates)), 
+                                "Image Size": list(reversed(image_sizes)), 
+                                "Code Area Size": list(reversed(code_area_sizes)),
+                                "Image Heap Size": list(reversed(image_heap_sizes))})
+
+    # Formatting Y-axis tick labels to display in MB
+    def format_mb(x, _):
+        return f"{x:.0f} MB"
+    plt.gca().yaxis.set_major_formatter(FuncFormatter(format_mb))
+
+    # Set the size of the figure
+    plt.figure(figsize=(15, 11))  
+
+    sns.set_theme(style="whitegrid")
+
+    # Rotate x-axis labels for better readability
+    if n > 10:
+        plt.xticks(rotation=45)
+    if n > 30:
+        plt.xticks(rotation=90)
+
+    # Melt the DataFrame to use 'hue' for Seaborn
+    image_data_melted = pd.melt(image_data, id_vars=["Commit Dates"], var_name="Size Type", value_name="Size (MB)")
+
+    # Create a Seaborn point plot
+    sns.pointplot(x="Commit Dates", y="Size (MB)", hue="Size Type", data=image_data_melted)
+    plt.xlabel("Commit Dates")
+    plt.ylabel("Size in MB")
+    plt.title("Development of Native Image Sizes")
+
+    # Add vertical grid lines
+    sns.despine(left=True, bottom=True)
+    plt.grid(axis='x', linestyle='--', alpha=1)
+
+    # Add a legend
+    plt.legend(title="Size Type")
+
+    # Save the plot as a .png file
+    plt.savefig("output_plot.png")
+
 if __name__ == "__main__":
     args = parse_args()
     
@@ -78,6 +555,7 @@ if __name__ == "__main__":
     branch = args.branch
     n = args.n
     token = args.token
+    api_url = args.api_url.rstrip("/")
 
     if not n.isnumeric():
         print("Wrong use: n should be a number")
@@ -85,108 +563,58 @@ if __name__ == "__main__":
     else:
         n = int(n)
 
-    try:  
-
-        response = urlfetch.get('https://api.github.com/repos/' + owner + '/' + repo_path + '/events', headers={
-            "Authorization": "Bearer " + token
-        })
-        link_header = response.headers.get("link")
-        response_json = json.loads(response.content)
-        commits_left = n
-        push_events = []
-
-        for event in response_json:
-            if commits_left <= 0:
-                break
-            if event["type"] == "PushEvent" and event["payload"]["ref"] == ("refs/heads/" + branch):
-                push_events.append(event)
-                commits_left = commits_left-1
-
-        # Check for pagination
-            link_header = response.headers.get("link")
-            next_page_match = re.search(r'<([^>]+)>;\s*rel="next"', link_header)
+    if args.profile is not None:
+        profiling.start()
 
-        while link_header and "rel=\"next\"" in link_header and commits_left > 0:
-            # Extract the URL for the next page
-            next_page_url = next_page_match.group(1)
-
-            # Make the request for the next page
-            response = urlfetch.fetch(next_page_url, headers={
-                "Authorization": "Bearer " + token
-            })
-            response_json = json.loads(response.content)
-
-            for event in response_json:
-                if commits_left <= 0:
-                    break
-                if event["type"] == "PushEvent" and event["payload"]["ref"] == ("refs/heads/" + branch):
-                    push_events.append(event)
-                    commits_left = commits_left-1
-
-            # Update the next_page_match for the next iteration
-            link_header = response.headers.get("link")
-            next_page_match = re.search(r'<([^>]+)>;\s*rel="next"', link_header)
-
-        # Prepare data
-        timestamps = []
-        shas = []
-        for push_event in push_events:
-            timestamps.append(push_event.get("created_at"))
-            shas.append(push_event.get("payload").get("commits")[-1].get("sha"))
-
-        # Extract data for plotting
-        commit_dates = [format_date(timestamp, n) for timestamp in timestamps]
-        image_data = [get_image_data(sha) for sha in shas]
-        image_sizes = [entry[0] for entry in image_data if entry != 0]
-        code_area_sizes = [entry[1] for entry in image_data if entry != 0]
-        image_heap_sizes = [entry[2] for entry in image_data if entry != 0]
-
-        # Create a DataFrame for Seaborn
-        image_data = pd.DataFrame({ "Commit Dates": list(reversed(commit_dates)), 
-                                    "Image Size": list(reversed(image_sizes)), 
-                                    "Code Area Size": list(reversed(code_area_sizes)),
-                                    "Image Heap Size": list(reversed(image_heap_sizes))})
-
-        # Formatting Y-axis tick labels to display in MB
-        def format_mb(x, _):
-            return f"{x:.0f} MB"
-        plt.gca().yaxis.set_major_formatter(FuncFormatter(format_mb))
-
-        # Set the size of the figure
-        plt.figure(figsize=(15, 11))  
-
-        sns.set_theme(style="whitegrid")
-
-        # Rotate x-axis labels for better readability
-        if n > 10:
-            plt.xticks(rotation=45)
-        if n > 30:
-            plt.xticks(rotation=90)
-
-        # Melt the DataFrame to use 'hue' for Seaborn
-        image_data_melted = pd.melt(image_data, id_vars=["Commit Dates"], var_name="Size Type", value_name="Size (MB)")
-
-        # Create a Seaborn point plot
-        sns.pointplot(x="Commit Dates", y="Size (MB)", hue="Size Type", data=image_data_melted)
-        plt.xlabel("Commit Dates")
-        plt.ylabel("Size in MB")
-        plt.title("Development of Native Image Sizes")
-
-        # Add vertical grid lines
-        sns.despine(left=True, bottom=True)
-        plt.grid(axis='x', linestyle='--', alpha=1)
-
-        # Add a legend
-        plt.legend(title="Size Type")
-
-        # Save the plot as a .png file
-        plt.savefig("output_plot.png")
+    report = DecodeReport()
+    try:  
 
+        if args.warehouse is not None:
+            from warehouse import Warehouse
+            # Builds of a local clone ingested by local_plotting/ingest.py, no requests needed
+            with profiling.stage("query warehouse"), Warehouse(args.warehouse) as warehouse:
+                builds = list(reversed(warehouse.last_builds(branch, n)))
+            timestamps = [datetime.fromtimestamp(build["author_time"], timezone.utc).isoformat() for build in builds]
+            commit_dates = [format_date(timestamp, n) for timestamp in timestamps]
+            image_data = []
+            for build in builds:
+                sizes, problem = parse_image_data(build["record"])
+                report.add(build["commit_sha"], problem)
+                image_data.append(sizes)
+            print("Queried metrics of {} commits from {}".format(len(builds), args.warehouse))
+        else:
+            client = GitHubClient(token, api_url)
+            tree_shas = None
+            with profiling.stage("find builds"):
+                if args.discovery == "refs":
+                    timestamps, shas, tree_shas = get_builds(client, n)
+                    print("Found {} builds with {} requests".format(len(shas), client.requests))
+                else:
+                    timestamps, shas = get_push_events(client, n)
+                    print("Found {} builds with {} requests".format(len(shas), client.requests))
+            with profiling.stage("fetch metrics"):
+                image_data, commit_dates = fetch_commits(client, shas, timestamps, n, args, report, tree_shas)
+            print("Issued {} API requests in total".format(client.requests))
+        print(report.summary())
+
+        with profiling.stage("plot"):
+            if args.rollup is not None:
+                plot_image_size_rollup(rollup_image_sizes(image_data, timestamps, args.rollup), args.rollup)
+            else:
+                plot_image_sizes(image_data, commit_dates, n)
 
     except Exception as e: 
         print("The following exception returned: ", e)
         raise
 
+    finally:
+        profiler = profiling.stop()
+        if profiler is not None:
+            profile_path = args.profile or profiling.default_path(".", "remote", args.profile_format)
+            profiler.write(profile_path, args.profile_format)
+            print(profiler.summary())
+            print("Profile written to " + profile_path)
+
 
 
 
@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "local_plotting"))
+sys.path.insert(0, ROOT)
+
+'''
+End-to-end benchmark of local and remote build tracking on synthetic repositories (see synthetic.py).
+
+For every history size (commits on main, about a tenth of them without a build), a fresh process times the stages of
+creating the reports of all builds and records the peak RSS after each of them:
+
+    load     opening the repository, indexing the metrics refs, and finding the builds of main
+    parse    reading and decoding the metrics blobs
+    frames   extracting the columns and building the data frames of all metrics types
+    render   writing the headless reports of all metrics types
+    remote   finding and fetching the builds through RemoteBuildTracking.py from a fake GitHub server serving the same
+             repository (only up to --remote-max builds)
+
+Each stage is appended as one JSON line with the git revision to the results file, and compared with the last
+recorded result of another revision, so that the effect of a change can be read directly from the output.
+
+Usage: python3 benchmarks/end_to_end.py [--sizes 100,10000,100000] [--work-dir DIR] [--results PATH]
+
+Example: python3 benchmarks/end_to_end.py --sizes 100,10000
+            -> Revision 846f975
+               10000 commits: repository ready in 11.1s
+                 load        0.21s  peak RSS     140 MB  (8505 builds)
+                 ...
+'''
+
+DEFAULT_SIZES = [100, 10000, 100000]
+DEFAULT_RESULTS = os.path.join(ROOT, "benchmarks", "results", "end_to_end.jsonl")
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def revision():
+    '''Returns the short sha of HEAD, marked as dirty if tracked files were changed.'''
+
+    sha = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    dirty = subprocess.run(["git", "-C", ROOT, "diff", "--quiet", "HEAD"]).returncode != 0
+    return (sha or "unknown") + ("-dirty" if dirty else "")
+
+def run_stages(repo_path, commits, remote_max):
+    '''Runs all stages on all builds of one repository in this process and yields (stage, seconds, peak RSS in MB,
+    number of builds).'''
+
+    import pygit2
+    from data_prep import index_metrics_refs, find_build_commits, get_record, format_commit_date, extract_columns, create_data_frames
+    from plot import plot_data
+
+    start = time.perf_counter()
+    repo = pygit2.Repository(repo_path)
+    metrics_index = index_metrics_refs(repo)
+    build_ids = find_build_commits(repo, repo.branches["main"], commits, metrics_index)
+    build_ids.reverse()
+    builds = len(build_ids)
+    build_commits = [repo[sha] for sha in build_ids]
+    yield "load", time.perf_counter() - start, peak_rss_mb(), builds
+
+    start = time.perf_counter()
+    records = [get_record(repo.references[metrics_index[sha]]) for sha in build_ids]
+    yield "parse", time.perf_counter() - start, peak_rss_mb(), builds
+
+    start = time.perf_counter()
+    frames = create_data_frames(extract_columns(records), [format_commit_date(commit.author.time, commit.author.offset) for commit in build_commits],
+                                build_ids, [commit.message.strip() for commit in build_commits])
+    yield "frames", time.perf_counter() - start, peak_rss_mb(), builds
+    del records
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as output_dir:
+        for metrics_type in ["image_details", "analysis_results", "resource_usage"]:
+            plot_data(frames[metrics_type], "main", metrics_type, show=False, output_dir=output_dir, headless=True)
+    yield "render", time.perf_counter() - start, peak_rss_mb(), builds
+
+    if builds > remote_max:
+        return
+    import RemoteBuildTracking as remote
+    from fake_github import load_dataset, serve_in_background
+
+    server = serve_in_background(load_dataset(repo_path), graphql_max_refs=100)
+    remote.owner, remote.repo_path, remote.branch = "owner", "repo", "main"
+    client = remote.GitHubClient("token", "http://127.0.0.1:{}".format(server.server_port))
+    start = time.perf_counter()
+    _, shas, tree_shas = remote.get_builds(client, builds)
+    remote.fetch_image_data_graphql(client, "http://127.0.0.1:{}/graphql".format(server.server_port), shas, 100, 8, remote.DecodeReport(), None, tree_shas)
+    yield "remote", time.perf_counter() - start, peak_rss_mb(), len(shas)
+    server.shutdown()
+
+def previous_results(path, current_revision):
+    '''Returns the last result of another revision per (commits, stage) from the results file.'''
+
+    previous = {}
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                result = json.loads(line)
+                if result["revision"] != current_revision:
+                    previous[(result["commits"], result["stage"])] = result
+    return previous
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark local and remote build tracking end to end on synthetic repositories.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="Comma separated numbers of commits (default is 100,10000,100000)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "build-tracking-benchmark"), help="Where the synthetic repositories are created and reused")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSON lines file the results are appended to (default is benchmarks/results/end_to_end.jsonl)")
+    parser.add_argument("--remote-max", type=int, default=10000, help="Largest number of builds that is also fetched from the fake GitHub server (default is 10000)")
+    parser.add_argument("--run", nargs=2, metavar=("REPO", "COMMITS"), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.run is not None:
+        # Child process measuring one size, prints one JSON line per stage
+        for stage, secs, rss, builds in run_stages(args.run[0], int(args.run[1]), args.remote_max):
+            print(json.dumps({"stage": stage, "secs": secs, "peak_rss_mb": rss, "builds": builds}), flush=True)
+        sys.exit(0)
+
+    from synthetic import make_repo
+
+    current_revision = revision()
+    previous = previous_results(args.results, current_revision)
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    print("Revision " + current_revision)
+    for size in [int(size) for size in args.sizes.split(",")]:
+        repo_path = os.path.join(args.work_dir, "commits-{}".format(size))
+        start = time.perf_counter()
+        make_repo(repo_path, size)
+        print("{} commits: repository ready in {:.1f}s".format(size, time.perf_counter() - start))
+
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", repo_path, str(size), "--remote-max", str(args.remote_max)],
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr)
+            sys.exit(1)
+        with open(args.results, "a") as results_file:
+            for line in child.stdout.splitlines():
+                if not line.startswith("{"):
+                    continue
+                result = dict(json.loads(line), commits=size, revision=current_revision, recorded_at=datetime.now(timezone.utc).isoformat())
+                results_file.write(json.dumps(result) + "\n")
+                before = previous.get((size, result["stage"]))
+                comparison = ""
+                if before is not None:
+                    comparison = " ({:+.0f}% time, {:+.0f}% RSS vs {})".format(100 * (result["secs"] / max(before["secs"], 1e-9) - 1),
+                                                                             100 * (result["peak_rss_mb"] / before["peak_rss_mb"] - 1), before["revision"])
+                print("  {:<7} {:8.2f}s  peak RSS {:7.0f} MB  ({} builds){}".format(result["stage"], result["secs"], result["peak_rss_mb"], result["builds"], comparison))
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local_plotting"))
+from export import export
+from synthetic import make_repo
+
+'''
+Throughput benchmark of the streaming export in local_plotting/export.py.
+
+Creates a synthetic repository with one build per commit (see synthetic.py), exports its branch in every format to
+/dev/null, and reports builds/second. The peak traced Python memory of a tenth and of the whole history shows that
+memory does not grow with the number of builds.
+
+Usage: python3 benchmarks/export_metrics.py [--builds N] [--repo PATH]
+'''
+
+def measure(repo_path, output_format, n=None, trace=False):
+    '''Returns the builds exported, the seconds it took, and the peak traced memory in bytes (0 unless trace).'''
+
+    mode = "wb" if output_format == "arrow" else "w"
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, mode) as output:
+        count = export(repo_path, "main", output, output_format, n)
+    secs = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return count, secs, peak
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming export of build metrics.")
+    parser.add_argument("--builds", type=int, default=50000, help="Number of builds of the synthetic repository (default is 50000)")
+    parser.add_argument("--repo", help="Where to create (or reuse) the synthetic repository (default is a temporary directory)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    repo_path = args.repo or tempfile.mkdtemp(prefix="export-benchmark-")
+    start = time.perf_counter()
+    make_repo(repo_path, args.builds, missing_rate=0)
+    print("Synthetic repository with {} builds at {} ({:.1f}s)".format(args.builds, repo_path, time.perf_counter() - start))
+
+    for output_format in ["ndjson", "csv", "arrow"]:
+        try:
+            count, secs, _ = measure(repo_path, output_format)
+        except ValueError as e:
+            print("{:<8} skipped: {}".format(output_format, e))
+            continue
+        print("{:<8} {} builds in {:.2f}s ({:.0f} builds/s)".format(output_format, count, secs, count / secs))
+
+    for n in [args.builds // 10, args.builds]:
+        count, _, peak = measure(repo_path, "ndjson", n, trace=True)
+        print("Peak traced memory exporting {} builds: {:.2f} MB".format(count, peak / 1e6))
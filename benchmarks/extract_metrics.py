@@ -0,0 +1,132 @@
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local_plotting"))
+from data_prep import extract_columns, create_data_frames
+
+'''
+Micro-benchmark of the metrics extraction in local_plotting/data_prep.py.
+
+Compares the single-pass columnar extractor with the previous per-field list comprehensions on synthetic blobs shaped
+like OUTPUT.json. Both paths start from the raw blob bytes and build the data frames of all three plotted metrics types.
+
+Usage: python3 benchmarks/extract_metrics.py [--blobs N] [--repeat R]
+'''
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OUTPUT.json")
+
+def make_blobs(count, seed=0):
+    '''Returns count encoded metrics blobs based on OUTPUT.json with slightly drifting values.'''
+
+    with open(TEMPLATE_PATH) as template_file:
+        template = json.load(template_file)
+    rng = random.Random(seed)
+    blobs = []
+    for i in range(count):
+        record = copy.deepcopy(template)
+        record["image_details"]["total_bytes"] += i * 64 + rng.randint(0, 4096)
+        record["image_details"]["code_area"]["bytes"] += i * 32
+        record["resource_usage"]["memory"]["peak_rss_bytes"] += rng.randint(-2 ** 20, 2 ** 20)
+        record["analysis_results"]["methods"]["reachable"] += i // 10
+        blobs.append(json.dumps(record).encode())
+    return blobs
+
+# The extraction as it was before the columnar extractor, kept for comparison
+
+def legacy_get_metrics(blob_data_entry, metrics_type):
+    blob_data_entry = blob_data_entry.decode()
+    blob_data_entry = "[" + blob_data_entry + "]"
+    metrics_data = json.loads(blob_data_entry)
+    return metrics_data[0].get(metrics_type)
+
+def legacy_image_details(blob_data, commit_dates, commit_shas, commit_messages):
+    raw_image_data = [legacy_get_metrics(entry, "image_details") for entry in blob_data]
+    image_sizes = [entry.get("total_bytes") / 1000000 for entry in raw_image_data if entry != 0]
+    code_area_sizes = [entry.get("code_area").get("bytes") / 1000000 for entry in raw_image_data if entry != 0]
+    image_heap_sizes = [entry.get("image_heap").get("bytes") / 1000000 for entry in raw_image_data if entry != 0]
+    other = []
+    for i in range (0, len(image_sizes)):
+        other.append(float(image_sizes[i])-float(code_area_sizes[i])-float(image_heap_sizes[i]))
+    return pd.DataFrame({"Commit Date": commit_dates, "Image Size": image_sizes, "Code Area Size": code_area_sizes,
+                         "Image Heap Size": image_heap_sizes, "Other": other, "Commit Sha": commit_shas, "Commit Message": commit_messages})
+
+def legacy_single_ar(analysis_results, aspect, commit_dates, commit_shas, commit_messages):
+    aspect_container = [entry.get(aspect) for entry in analysis_results]
+    total = [entry.get("total") for entry in aspect_container if entry != 0]
+    reflection = [entry.get("reflection") for entry in aspect_container if entry != 0]
+    jni = [entry.get("jni") for entry in aspect_container if entry != 0]
+    reachable = [entry.get("reachable") for entry in aspect_container if entry != 0]
+    return pd.DataFrame({"Commit Date": commit_dates, "Total": total, "Reflection": reflection, "JNI": jni,
+                         "Reachable": reachable, "Commit Sha": commit_shas, "Commit Message": commit_messages})
+
+def legacy_analysis_results(blob_data, commit_dates, commit_shas, commit_messages):
+    raw_analysis_results = [legacy_get_metrics(entry, "analysis_results") for entry in blob_data]
+    return [legacy_single_ar(raw_analysis_results, aspect, commit_dates, commit_shas, commit_messages)
+            for aspect in ["types", "methods", "classes", "fields"]]
+
+def legacy_resources(blob_data, commit_dates, commit_shas, commit_messages):
+    raw_resources_data = [legacy_get_metrics(entry, "resource_usage") for entry in blob_data]
+    memory = [entry.get("memory") for entry in raw_resources_data if entry != 0]
+    peak_rss_bytes = [entry.get("peak_rss_bytes") / 1000000 for entry in memory if entry != 0]
+    gc = [entry.get("garbage_collection") for entry in raw_resources_data if entry != 0]
+    gc_time = [entry.get("total_secs") for entry in gc if entry != 0]
+    gc_count = [entry.get("count") for entry in gc if entry != 0]
+    cpu = [entry.get("cpu") for entry in raw_resources_data if entry != 0]
+    load = [entry.get("load") for entry in cpu if entry != 0]
+    total_cores = [entry.get("total_cores") for entry in cpu if entry != 0]
+    return pd.DataFrame({"Commit Date": commit_dates, "GC Time": gc_time, "GC Count": gc_count, "Peak RSS": peak_rss_bytes,
+                         "CPU Load": load, "Total Cores": total_cores, "Commit Sha": commit_shas, "Commit Message": commit_messages})
+
+def run_legacy(blobs, commit_dates, commit_shas, commit_messages):
+    return [legacy_image_details(blobs, commit_dates, commit_shas, commit_messages),
+            legacy_analysis_results(blobs, commit_dates, commit_shas, commit_messages),
+            legacy_resources(blobs, commit_dates, commit_shas, commit_messages)]
+
+def run_columnar(blobs, commit_dates, commit_shas, commit_messages):
+    records = (json.loads(blob) for blob in blobs)
+    return create_data_frames(extract_columns(records, len(blobs)), commit_dates, commit_shas, commit_messages)
+
+def measure(function, repeat, *args):
+    '''Returns the best wall time of repeat runs and the peak traced memory of one extra run.'''
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the columnar metrics extraction with the previous per-field extraction.")
+    parser.add_argument("--blobs", type=int, default=10000, help="Number of synthetic metrics blobs (default is 10000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per implementation, the best is reported (default is 3)")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    blobs = make_blobs(args.blobs)
+    commit_dates = ["01.01.24, 00:00"] * args.blobs
+    commit_shas = ["{:040x}".format(i) for i in range(args.blobs)]
+    commit_messages = ["Commit {}".format(i) for i in range(args.blobs)]
+
+    legacy_secs, legacy_peak = measure(run_legacy, args.repeat, blobs, commit_dates, commit_shas, commit_messages)
+    columnar_secs, columnar_peak = measure(run_columnar, args.repeat, blobs, commit_dates, commit_shas, commit_messages)
+
+    print("{} blobs".format(args.blobs))
+    print("{:<12}{:>10}{:>16}".format("", "time (s)", "peak (MB)"))
+    print("{:<12}{:>10.3f}{:>16.1f}".format("per-field", legacy_secs, legacy_peak / 1e6))
+    print("{:<12}{:>10.3f}{:>16.1f}".format("columnar", columnar_secs, columnar_peak / 1e6))
+    print("Speedup {:.1f}x, peak memory {:.1f}x lower".format(legacy_secs / columnar_secs, legacy_peak / max(columnar_peak, 1)))
@@ -0,0 +1,240 @@
+import argparse
+import base64
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+Local stand-in for the GitHub API endpoints used by RemoteBuildTracking.py: events, commits, matching-refs, the git
+ref, tree, and blob endpoints, and GraphQL queries of graalvm-metrics refs.
+
+Usage: python3 benchmarks/fake_github.py [--commits N | --repo PATH] [--latency SECONDS] [--port PORT]
+
+Example: python3 benchmarks/fake_github.py --commits 100 --latency 0.05
+         python3 RemoteBuildTracking.py owner repo main token 100 --api-url http://127.0.0.1:8765 --compare-serial
+Example: python3 benchmarks/synthetic.py /tmp/synthetic --commits 10000
+         python3 benchmarks/fake_github.py --repo /tmp/synthetic
+            -> serves the same builds that local_plotting reads from /tmp/synthetic
+'''
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OUTPUT.json")
+EVENTS_PER_PAGE = 30
+COMMITS_PER_PAGE = 30
+GRAPHQL_REF_FIELD = re.compile(r'(\w+):\s*ref\(qualifiedName:\s*"refs/graalvm-metrics/([0-9a-f]+)"\)')
+
+def sha_of(*parts):
+    return hashlib.sha1("/".join(str(part) for part in parts).encode()).hexdigest()
+
+def make_dataset(commits, branch="main"):
+    '''Creates commits with metrics blobs based on OUTPUT.json, newest first, plus the push events announcing them.'''
+
+    with open(TEMPLATE_PATH) as template_file:
+        template = json.load(template_file)
+
+    refs, trees, blobs, events, commit_list = {}, {}, {}, [], []
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(commits):
+        commit_sha = sha_of("commit", i)
+        record = copy.deepcopy(template)
+        record["image_details"]["total_bytes"] += i * 1024
+        record["image_details"]["code_area"]["bytes"] += i * 512
+        blob = json.dumps(record).encode()
+        blob_sha = sha_of("blob", i)
+        tree_sha = sha_of("tree", i)
+        refs[commit_sha] = tree_sha
+        trees[tree_sha] = blob_sha
+        blobs[blob_sha] = blob
+        date = (start + timedelta(minutes=10 * i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        events.append({
+            "type": "PushEvent",
+            "created_at": date,
+            "payload": {"ref": "refs/heads/" + branch, "commits": [{"sha": commit_sha}]}
+        })
+        commit_list.append({"sha": commit_sha, "commit": {"message": "Commit {}".format(i), "author": {"date": date}, "committer": {"date": date}}})
+    events.reverse()
+    commit_list.reverse()
+    return {"refs": refs, "trees": trees, "blobs": blobs, "events": events, "commits": commit_list}
+
+def load_dataset(repo_path, branch="main"):
+    '''Creates the data set from the commits and graalvm-metrics refs of a local repository, e.g. one generated by
+    synthetic.py, so that remote and local tracking can be compared on the same builds.'''
+
+    import pygit2
+
+    repo = pygit2.Repository(repo_path)
+    prefix = "refs/graalvm-metrics/"
+    refs, trees, blobs, events, commit_list = {}, {}, {}, [], []
+    for name in repo.references:
+        if name.startswith(prefix):
+            tree = repo.references[name].resolve().peel()
+            refs[name[len(prefix):]] = str(tree.id)
+            trees[str(tree.id)] = str(tree[0].id)
+            blobs[str(tree[0].id)] = tree[0].data
+    for commit in repo.walk(repo.branches[branch].target, pygit2.GIT_SORT_TIME):
+        sha = str(commit.id)
+        date = datetime.fromtimestamp(commit.commit_time, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        commit_list.append({"sha": sha, "commit": {"message": commit.message, "author": {"date": date}, "committer": {"date": date}}})
+        if sha in refs:
+            events.append({"type": "PushEvent", "created_at": date, "payload": {"ref": "refs/heads/" + branch, "commits": [{"sha": sha}]}})
+    return {"refs": refs, "trees": trees, "blobs": blobs, "events": events, "commits": commit_list}
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    '''Serves the data set of the owning server. Speaks HTTP/1.1 so that clients can keep connections alive.'''
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_page(self, items, path, params, per_page, headers):
+        '''Sends one page of a list with a GitHub style Link header.'''
+
+        page = int(params.get("page", 1))
+        start = (page - 1) * per_page
+        query = "&".join(key + "=" + value for key, value in params.items() if key != "page")
+        links = []
+        if start + per_page < len(items):
+            links.append('<http://{}{}?{}page={}>; rel="next"'.format(self.headers.get("Host"), path, query + "&" if query else "", page + 1))
+        links.append('<http://{}{}?{}page=1>; rel="first"'.format(self.headers.get("Host"), path, query + "&" if query else ""))
+        headers["Link"] = ", ".join(links)
+        self.send_json(200, items[start:start + per_page], headers)
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        limited, headers = server.take_request()
+        if limited:
+            self.send_json(403, {"message": "API rate limit exceeded"}, headers)
+            return
+
+        path, _, query = self.path.partition("?")
+        parts = path.strip("/").split("/")
+        data = server.dataset
+
+        params = dict(item.split("=", 1) for item in query.split("&") if "=" in item)
+        if len(parts) == 4 and parts[3] == "events":
+            self.send_page(data["events"], path, params, EVENTS_PER_PAGE, headers)
+        elif len(parts) == 4 and parts[3] == "commits":
+            self.send_page(data["commits"], path, params, min(int(params.get("per_page", COMMITS_PER_PAGE)), 100), headers)
+        elif len(parts) == 6 and parts[3:6] == ["git", "matching-refs", "graalvm-metrics"]:
+            self.send_json(200, [{"ref": "refs/graalvm-metrics/" + commit_sha, "object": {"sha": tree_sha, "type": "tree"}}
+                                 for commit_sha, tree_sha in data["refs"].items()], headers)
+        elif len(parts) == 7 and parts[3:6] == ["git", "ref", "graalvm-metrics"] and parts[6] in data["refs"]:
+            self.send_json(200, {"ref": "refs/graalvm-metrics/" + parts[6], "object": {"sha": data["refs"][parts[6]], "type": "tree"}}, headers)
+        elif len(parts) == 6 and parts[3:5] == ["git", "trees"] and parts[5] in data["trees"]:
+            self.send_json(200, {"sha": parts[5], "tree": [{"path": "metrics.json", "type": "blob", "sha": data["trees"][parts[5]]}]}, headers)
+        elif len(parts) == 6 and parts[3:5] == ["git", "blobs"] and parts[5] in data["blobs"]:
+            content = data["blobs"][parts[5]]
+            self.send_json(200, {"sha": parts[5], "size": len(content), "encoding": "base64", "content": base64.b64encode(content).decode()}, headers)
+        else:
+            self.send_json(404, {"message": "Not Found"}, headers)
+
+    def do_POST(self):
+        server = self.server
+        time.sleep(server.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        limited, headers = server.take_request()
+        if limited:
+            self.send_json(403, {"message": "API rate limit exceeded"}, headers)
+            return
+        if self.path.rstrip("/") != "/graphql":
+            self.send_json(404, {"message": "Not Found"}, headers)
+            return
+
+        # Only understands the aliased ref lookups sent by RemoteBuildTracking.py
+        fields = GRAPHQL_REF_FIELD.findall(json.loads(body).get("query", ""))
+        if len(fields) > server.graphql_max_refs:
+            self.send_json(200, {"errors": [{"type": "MAX_NODE_LIMIT_EXCEEDED",
+                                             "message": "Query would return more than {} refs".format(server.graphql_max_refs)}]}, headers)
+            return
+        data = server.dataset
+        repository = {}
+        for alias, commit_sha in fields:
+            tree_sha = data["refs"].get(commit_sha)
+            if tree_sha is None:
+                repository[alias] = None
+                continue
+            blob_sha = data["trees"][tree_sha]
+            content = data["blobs"][blob_sha]
+            repository[alias] = {"target": {"entries": [{"object": {"oid": blob_sha, "byteSize": len(content), "isTruncated": False, "text": content.decode()}}]}}
+        reset_at = datetime.fromtimestamp(int(headers.get("X-RateLimit-Reset", time.time() + 3600)), timezone.utc)
+        rate_limit = {"cost": 1, "remaining": int(headers.get("X-RateLimit-Remaining", 4999)), "resetAt": reset_at.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        self.send_json(200, {"data": {"rateLimit": rate_limit, "repository": repository}}, headers)
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    '''Threaded HTTP server holding the data set and a simple fixed-window rate limit.'''
+
+    daemon_threads = True
+
+    def __init__(self, address, dataset, latency=0.0, rate_limit=None, rate_window=60, graphql_max_refs=100):
+        super().__init__(address, FakeGitHubHandler)
+        self.dataset = dataset
+        self.graphql_max_refs = graphql_max_refs
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_requests = 0
+
+    def take_request(self):
+        '''Counts a request and returns whether it exceeds the rate limit together with the X-RateLimit-* headers.'''
+
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return False, {}
+            now = time.time()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_requests = 0
+            self._window_requests += 1
+            remaining = max(self.rate_limit - self._window_requests, 0)
+            headers = {"X-RateLimit-Limit": str(self.rate_limit),
+                       "X-RateLimit-Remaining": str(remaining),
+                       "X-RateLimit-Reset": str(int(self._window_start + self.rate_window) + 1)}
+            return self._window_requests > self.rate_limit, headers
+
+def serve_in_background(dataset, latency=0.0, rate_limit=None, rate_window=60, port=0, graphql_max_refs=100):
+    '''Starts a server on localhost in a daemon thread and returns it. Its base URL is http://127.0.0.1:<server.server_port>.'''
+
+    server = FakeGitHubServer(("127.0.0.1", port), dataset, latency, rate_limit, rate_window, graphql_max_refs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve synthetic native image metrics through GitHub's git data endpoints.")
+    parser.add_argument("--commits", type=int, default=100, help="Number of commits with metrics (default is 100)")
+    parser.add_argument("--repo", help="Serve the builds of a local repository (e.g. from synthetic.py) instead of generated ones")
+    parser.add_argument("--branch", default="main", help="Branch the push events refer to (default is main)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds of delay added to every response (default is 0.05)")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Requests allowed per rate limit window (default is unlimited)")
+    parser.add_argument("--rate-window", type=int, default=60, help="Length of the rate limit window in seconds (default is 60)")
+    parser.add_argument("--graphql-max-refs", type=int, default=100, help="Refs allowed per GraphQL query before it fails with a node limit error (default is 100)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default is 8765)")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    dataset = load_dataset(args.repo, args.branch) if args.repo else make_dataset(args.commits, args.branch)
+    server = FakeGitHubServer(("127.0.0.1", args.port), dataset, args.latency, args.rate_limit, args.rate_window, args.graphql_max_refs)
+    print("Serving {} commits with {} builds on http://127.0.0.1:{}".format(len(dataset["commits"]), len(dataset["refs"]), args.port))
+    server.serve_forever()
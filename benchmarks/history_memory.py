@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "local_plotting"))
+
+'''
+Memory benchmark of the build history models of local_plotting on a synthetic repository with one build per commit
+(see synthetic.py).
+
+A fresh process per model loads all builds of main and optionally renders the large history report of every metrics
+type from them:
+
+    frames     the data frames of all metrics types, filled from one parsed record per build as the loader did before
+               the compact history (load_frames_per_build). data_prep.load_data_frames now converts a history instead.
+    history    the compact BuildHistory (history.load_history), which the reports are plotted from directly
+
+Each process records its peak RSS after importing pandas and pygit2, after loading, and after rendering, for which it
+imports plotly. The comparison is of the peak RSS of the whole process.
+
+Usage: python3 benchmarks/history_memory.py [--builds N] [--repo PATH] [--render]
+
+Example: python3 benchmarks/history_memory.py --builds 100000 --render
+            -> frames    100000 builds loaded in  10.7s  peak RSS   662 MB  (119 MB after imports)
+                         rendered in   4.0s  peak RSS   662 MB
+               history   100000 builds loaded in  12.9s  peak RSS   225 MB  (118 MB after imports, 29.1 MB of arrays)
+                         rendered in   1.0s  peak RSS   225 MB
+               The history has a 2.9x lower peak RSS than the frames, short of the target of 5x
+
+The target of a 5x lower peak RSS is not met. Importing pandas alone takes about 80 MB, and finding the builds of main
+(the ref index and the history walk) about 75 MB more, which the history cannot avoid. Loading the history is slower
+than filling the frames, since every build is decoded into its rows one at a time.
+'''
+
+MODELS = ["frames", "history"]
+METRICS_TYPES = ["image_details", "analysis_results", "resource_usage"]
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+def load_frames_per_build(repo_path, n, branch_name):
+    '''Creates the data frames of all metrics types the way data_prep.load_data_frames did before it was built from
+    the compact history: the columns are extracted from one parsed record per build and turned into data frames.'''
+
+    import pygit2
+    from data_prep import create_data_frames, extract_columns, find_build_commits, format_commit_date, get_record, index_metrics_refs
+
+    repo = pygit2.Repository(repo_path)
+    metrics_index = index_metrics_refs(repo)
+    build_ids = find_build_commits(repo, repo.branches[branch_name], n, metrics_index)
+    build_ids.reverse()
+    metrics_commits = [repo[commit_id] for commit_id in build_ids]
+    metrics_refs = [repo.references[metrics_index[commit_id]] for commit_id in build_ids]
+    commit_dates = [format_commit_date(commit.author.time, commit.author.offset) for commit in metrics_commits]
+    commit_messages = [commit.message.strip() for commit in metrics_commits]
+    commit_shas = [str(commit.id) for commit in metrics_commits]
+    columns = extract_columns((get_record(ref) for ref in metrics_refs), len(metrics_refs))
+    return create_data_frames(columns, commit_dates, commit_shas, commit_messages)
+
+def run_model(model, repo_path, builds, render):
+    '''Loads (and renders) all builds with one model in this process and returns its measurements.'''
+
+    import pandas
+    import pygit2
+    from history import load_history
+
+    result = {"model": model, "imports_mb": peak_rss_mb()}
+    start = time.perf_counter()
+    if model == "frames":
+        build_data = load_frames_per_build(repo_path, builds, "main")
+        result["builds"] = len(build_data["image_details"])
+    else:
+        build_data = load_history(repo_path, builds, "main")
+        result["builds"] = len(build_data)
+        result["model_mb"] = build_data.nbytes / 1e6
+    result["load_secs"] = time.perf_counter() - start
+    result["load_mb"] = peak_rss_mb()
+
+    if render:
+        # Only rendering needs plotly
+        from plot import plot_data
+
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as output_dir:
+            for metrics_type in METRICS_TYPES:
+                plot_data(build_data[metrics_type] if model == "frames" else build_data, "main", metrics_type, show=False,
+                          output_dir=output_dir, headless=True, large_history=True)
+        result["render_secs"] = time.perf_counter() - start
+        result["render_mb"] = peak_rss_mb()
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the peak memory of the data frames and the compact build history.")
+    parser.add_argument("--builds", type=int, default=100000, help="Number of builds of the synthetic repository (default is 100000)")
+    parser.add_argument("--repo", help="Where to create (or reuse) the synthetic repository (default is in the temporary directory)")
+    parser.add_argument("--render", action="store_true", help="Also render the large history reports of all metrics types")
+    parser.add_argument("--run", metavar="MODEL", choices=MODELS, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    repo_path = args.repo or os.path.join(tempfile.gettempdir(), "build-tracking-benchmark", "builds-{}".format(args.builds))
+    if args.run is not None:
+        # Child process measuring one model, prints one JSON line
+        print(json.dumps(run_model(args.run, repo_path, args.builds, args.render)), flush=True)
+        sys.exit(0)
+
+    from synthetic import make_repo
+
+    start = time.perf_counter()
+    make_repo(repo_path, args.builds, missing_rate=0)
+    print("Synthetic repository with {} builds at {} ({:.1f}s)".format(args.builds, repo_path, time.perf_counter() - start))
+
+    results = {}
+    for model in MODELS:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", model, "--repo", repo_path, "--builds", str(args.builds)] + (["--render"] if args.render else []),
+                               capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr)
+            sys.exit(1)
+        result = results[model] = json.loads(child.stdout.strip().splitlines()[-1])
+        print("{:<9} {} builds loaded in {:5.1f}s  peak RSS {:5.0f} MB  ({:.0f} MB after imports{})".format(
+            model, result["builds"], result["load_secs"], result["load_mb"], result["imports_mb"],
+            ", {:.1f} MB of arrays".format(result["model_mb"]) if "model_mb" in result else ""))
+        if args.render:
+            print("{:<9} rendered in {:5.1f}s  peak RSS {:5.0f} MB".format("", result["render_secs"], result["render_mb"]))
+
+    frames, history = results["frames"], results["history"]
+    ratio = max(frames["load_mb"], frames.get("render_mb", 0)) / max(history["load_mb"], history.get("render_mb", 0))
+    print("The history has a {:.1f}x lower peak RSS than the frames, {} the target of 5x".format(ratio, "meeting" if ratio >= 5 else "short of"))
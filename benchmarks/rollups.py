@@ -0,0 +1,117 @@
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "local_plotting"))
+
+'''
+Benchmark of plotting a year of builds from rollups (see local_plotting/rollups.py) on a synthetic repository with one
+build per commit (see synthetic.py), compared with plotting the newest 50 builds one by one.
+
+All steps run in one process after the libraries were imported, with a metrics cache in a temporary directory, and
+load the builds of a branch and write its headless image_details report:
+
+    50 builds        the newest 50 builds of main, every build plotted (fastest of 3 runs with a warm cache)
+    year, builds     the builds of the last year of main, every build plotted
+    rollup, cold     the same builds rolled up per day without a stored rollup, i.e. all of them read
+    rollup, new      the same after --new-builds more builds landed on the branch, only the changed days are decoded
+    rollup, warm     the same once more without new builds
+
+Usage: python3 benchmarks/rollups.py [--builds N] [--repo PATH] [--period day|week] [--new-builds K]
+
+Example: python3 benchmarks/rollups.py
+            -> 50 builds            0.60s
+               year, builds         2.65s  (2542 builds)
+               rollup, cold         0.97s  (192 buckets)
+               rollup, new          0.68s  (189 of 191 buckets unchanged)
+               rollup, warm         0.60s  (191 of 191 buckets unchanged)
+'''
+
+BRANCH = "rollup-benchmark"
+
+def timed(function):
+    start = time.perf_counter()
+    # Without the messages of every report written
+    with redirect_stdout(io.StringIO()):
+        result = function()
+    return time.perf_counter() - start, result
+
+def year_builds(repo, tip):
+    '''Returns the number of builds on the first-parent history of tip committed within a year before it.'''
+
+    from data_prep import metrics_commit_shas
+
+    metrics_index = metrics_commit_shas(repo)
+    commit = repo[tip]
+    since = commit.commit_time - 365 * 24 * 60 * 60
+    builds = 0
+    while commit.commit_time >= since:
+        builds += str(commit.id) in metrics_index
+        if not commit.parent_ids:
+            break
+        commit = repo[commit.parent_ids[0]]
+    return builds
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare plotting a year of builds from rollups with plotting 50 builds.")
+    parser.add_argument("--builds", type=int, default=100000, help="Number of builds of the synthetic repository (default is 100000)")
+    parser.add_argument("--repo", help="Where to create (or reuse) the synthetic repository (default is in the temporary directory)")
+    parser.add_argument("--period", choices=["day", "week"], default="day", help="Buckets of the rollups (default is day)")
+    parser.add_argument("--new-builds", type=int, default=20, help="Builds landing between the cold and the incremental rollup (default is 20)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    repo_path = args.repo or os.path.join(tempfile.gettempdir(), "build-tracking-benchmark", "builds-{}".format(args.builds))
+
+    from synthetic import make_repo
+    make_repo(repo_path, args.builds, missing_rate=0)
+
+    import pygit2
+    from history import load_history
+    from metrics_cache import MetricsCache
+    from plot import plot_data
+    from rollups import load_rollup
+
+    repo = pygit2.Repository(repo_path)
+    tip = repo.branches["main"].target
+    builds = year_builds(repo, tip)
+    # The branch starts new_builds commits behind main, so that they can land on it later
+    behind = repo[tip]
+    for _ in range(args.new_builds):
+        behind = repo[behind.parent_ids[0]]
+
+    with tempfile.TemporaryDirectory() as work_dir, MetricsCache(os.path.join(work_dir, "metrics.sqlite")) as cache:
+        output_dir = os.path.join(work_dir, "output")
+
+        def plot_builds(n, branch="main"):
+            plot_data(load_history(repo_path, n, branch, cache), branch, "image_details", show=False, output_dir=output_dir, headless=True)
+
+        def plot_rollup(branch):
+            rollup = load_rollup(repo_path, builds, branch, args.period, cache)
+            plot_data(rollup, branch, "image_details", show=False, output_dir=output_dir, headless=True)
+            return rollup
+
+        def report(step, secs, detail=""):
+            print("{:<18} {:6.2f}s  {}".format(step, secs, detail))
+
+        repo.branches.local.create(BRANCH, behind, force=True)
+        try:
+            report("50 builds", min(timed(lambda: plot_builds(50))[0] for _ in range(3)))
+            secs, _ = timed(lambda: plot_builds(builds, BRANCH))
+            report("year, builds", secs, "({} builds)".format(builds))
+            cache.flush()
+            secs, rollup = timed(lambda: plot_rollup(BRANCH))
+            report("rollup, cold", secs, "({} buckets)".format(len(rollup)))
+            repo.branches.local.create(BRANCH, repo[tip], force=True)
+            secs, rollup = timed(lambda: plot_rollup(BRANCH))
+            report("rollup, new", secs, "({} of {} buckets unchanged)".format(rollup.reused, len(rollup)))
+            secs, rollup = timed(lambda: plot_rollup(BRANCH))
+            report("rollup, warm", secs, "({} of {} buckets unchanged)".format(rollup.reused, len(rollup)))
+        finally:
+            repo.branches.local.delete(BRANCH)
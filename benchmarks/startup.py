@@ -0,0 +1,79 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+'''
+Startup benchmark of the command line entry points.
+
+Runs each entry point with arguments that return before any work is done (--help, an unknown metrics type) under
+python -X importtime and reports the wall time and the import time of every invocation together with its most
+expensive top-level imports. Exits with code 1 if any import time exceeds the budget, so that CI notices when a heavy
+library is imported at module load again.
+
+Usage: python3 benchmarks/startup.py [--budget-ms MS] [--repeat R]
+'''
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MAIN = os.path.join(ROOT, "local_plotting", "main.py")
+REMOTE = os.path.join(ROOT, "RemoteBuildTracking.py")
+
+SCENARIOS = [
+    ("main.py --help", [MAIN, "--help"]),
+    ("main.py unknown metrics type", [MAIN, ".", "main", "10", "unknown"]),
+    ("main.py --batch without manifest", [MAIN, "--batch"]),
+    ("RemoteBuildTracking.py --help", [REMOTE, "--help"]),
+    ("RemoteBuildTracking.py invalid n", [REMOTE, "owner", "repo", "main", "token", "ten"]),
+]
+
+def parse_importtime(stderr):
+    '''Returns the total import time in microseconds and a list of (cumulative microseconds, module) of the top-level
+    imports from the -X importtime output.'''
+
+    total = 0
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if not name[1:].startswith(" "):
+            cumulative = int(cumulative_us)
+            total += cumulative
+            top_level.append((cumulative, name.strip()))
+    top_level.sort(reverse=True)
+    return total, top_level
+
+def measure(arguments, repeat):
+    '''Returns the fastest wall time in seconds, its import time in microseconds, and its heaviest top-level imports.'''
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime"] + arguments, capture_output=True, text=True)
+        wall = time.perf_counter() - start
+        total, top_level = parse_importtime(result.stderr)
+        if best is None or wall < best[0]:
+            best = (wall, total, top_level)
+    return best
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the command line entry points.")
+    parser.add_argument("--budget-ms", type=float, default=150, help="Maximum import time of an invocation in milliseconds (default is 150)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per invocation, the fastest one is reported (default is 3)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    over_budget = []
+    for name, arguments in SCENARIOS:
+        wall, total, top_level = measure(arguments, max(1, args.repeat))
+        heaviest = ", ".join("{} {:.0f}ms".format(module, cumulative / 1e3) for cumulative, module in top_level[:3])
+        print("{:<40} {:7.0f}ms wall, {:6.0f}ms imports ({})".format(name, wall * 1e3, total / 1e3, heaviest))
+        if total / 1e3 > args.budget_ms:
+            over_budget.append(name)
+
+    if over_budget:
+        print("Over the import budget of {:.0f}ms: {}".format(args.budget_ms, ", ".join(over_budget)))
+        sys.exit(1)
+    print("All entry points within the import budget of {:.0f}ms".format(args.budget_ms))
@@ -0,0 +1,174 @@
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import pygit2
+
+'''
+Generator of synthetic repositories with native image builds, for benchmarks and manual testing.
+
+Every commit on main gets a refs/graalvm-metrics/<sha> ref to a tree with one metrics blob based on OUTPUT.json, except
+for commits whose build is missing: single commits at missing_rate and occasional CI outages of many commits in a row
+(none at all with a missing_rate of 0). The metrics drift like in a real project: the image grows slowly with noise and
+occasional step changes, analysis counts increase, resource usage is noisy, and older builds lack fields that were
+added to the report later. Commits are minutes to hours apart, with gaps of days in between. Optionally, feature branches fork off the newest fifth of main and
+add a few commits that change the image size by a few percent.
+
+The history is deterministic for a given number of commits and seed, and the repository is packed like a fresh clone.
+
+Usage: python3 benchmarks/synthetic.py [path] [--commits N] [--branches B] [--seed S] [--missing-rate R]
+'''
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OUTPUT.json")
+START_TIME = 1672531200  # 2023-01-01
+# Written into the .git directory so that a repository is only generated again when its parameters change
+PARAMETERS_FILE = "synthetic.json"
+
+def make_records(commits, seed=0, missing_rate=0.1):
+    '''Yields (commit time, metrics record or None for a missing build) for each commit, oldest first.'''
+
+    with open(TEMPLATE_PATH) as template_file:
+        template = json.load(template_file)
+    rng = random.Random(seed)
+    commit_time = START_TIME
+    total = template["image_details"]["total_bytes"]
+    heap_share = template["image_details"]["image_heap"]["bytes"] / total
+    code_share = template["image_details"]["code_area"]["bytes"] / total
+    reachable = {aspect: template["analysis_results"][aspect]["reachable"] for aspect in ["types", "methods", "classes", "fields"]}
+    outage = 0
+
+    for i in range(commits):
+        commit_time += rng.randint(5, 180) * 60
+        if rng.random() < 0.01:
+            commit_time += rng.randint(1, 14) * 86400
+        # Slow growth with noise and occasional step changes, e.g. a new dependency
+        total += int(rng.gauss(2048, 8192))
+        if rng.random() < 0.003:
+            total = int(total * rng.uniform(1.01, 1.05))
+        for aspect in reachable:
+            reachable[aspect] += max(0, int(rng.gauss(0.5, 2)))
+
+        if outage == 0 and missing_rate > 0 and rng.random() < 0.002:
+            outage = rng.randint(5, 50)
+        if outage > 0 or rng.random() < missing_rate:
+            outage = max(0, outage - 1)
+            yield commit_time, None
+            continue
+
+        record = copy.deepcopy(template)
+        details = record["image_details"]
+        details["total_bytes"] = total
+        details["code_area"]["bytes"] = int(total * code_share * rng.uniform(0.995, 1.005))
+        details["image_heap"]["bytes"] = int(total * heap_share * rng.uniform(0.995, 1.005))
+        for aspect, count in reachable.items():
+            results = record["analysis_results"][aspect]
+            results["reachable"] = count
+            results["total"] = max(results["total"], count) + count // 10
+        usage = record["resource_usage"]
+        usage["garbage_collection"]["total_secs"] *= rng.uniform(0.8, 1.25)
+        usage["garbage_collection"]["count"] = int(usage["garbage_collection"]["count"] * rng.uniform(0.9, 1.1))
+        usage["memory"]["peak_rss_bytes"] = int(usage["memory"]["peak_rss_bytes"] * rng.uniform(0.95, 1.05))
+        usage["cpu"]["load"] *= rng.uniform(0.7, 1.1)
+        usage["total_secs"] *= rng.uniform(0.9, 1.2)
+        # Fields that later versions of the report added
+        if i < commits // 5:
+            del details["image_heap"]["resources"]
+            del record["analysis_results"]["methods"]["foreign_downcalls"]
+        yield commit_time, record
+
+def make_repo(path, commits, seed=0, missing_rate=0.1, branches=0):
+    '''Creates a repository with the given number of commits on main and feature/<i> branches, and returns the number
+    of builds. An existing repository generated with the same parameters is reused, one generated with other parameters
+    is replaced. Raises ValueError if path is any other directory that is not empty, e.g. a real repository.'''
+
+    parameters = {"commits": commits, "seed": seed, "missing_rate": missing_rate, "branches": branches}
+    parameters_path = os.path.join(path, ".git", PARAMETERS_FILE)
+    if os.path.exists(parameters_path):
+        with open(parameters_path) as parameters_file:
+            stored = json.load(parameters_file)
+        if {key: stored.get(key) for key in parameters} == parameters and "builds" in stored:
+            return stored["builds"]
+        shutil.rmtree(path)
+    elif os.path.isdir(path) and os.listdir(path):
+        raise ValueError(path + " is not empty and was not generated by synthetic.py, refusing to write into it")
+
+    repo = pygit2.init_repository(path)
+    # Written again with the number of builds when done, so that an interrupted generation is started over
+    with open(parameters_path, "w") as parameters_file:
+        json.dump(parameters, parameters_file)
+    empty_tree = repo.TreeBuilder().write()
+    def add_build(commit, record):
+        tree = repo.TreeBuilder()
+        tree.insert("metrics.json", repo.create_blob(json.dumps(record).encode()), pygit2.GIT_FILEMODE_BLOB)
+        repo.references.create("refs/graalvm-metrics/" + str(commit), tree.write())
+
+    parents = []
+    builds = 0
+    main_commits = []
+    for i, (commit_time, record) in enumerate(make_records(commits, seed, missing_rate)):
+        signature = pygit2.Signature("Build Bot", "bot@example.com", commit_time, 60)
+        commit = repo.create_commit(None, signature, signature, "Commit {}\n\nSynthetic change {}.".format(i, i), empty_tree, parents)
+        if record is not None:
+            add_build(commit, record)
+            builds += 1
+        parents = [commit]
+        main_commits.append(commit)
+    repo.references.create("refs/heads/main", parents[0], force=True)
+    repo.set_head("refs/heads/main")
+
+    rng = random.Random(seed + 1)
+    for branch in range(branches):
+        parent = repo[main_commits[rng.randint(len(main_commits) * 4 // 5, len(main_commits) - 1)]]
+        # Continue from the newest build at the fork point
+        base_ref = next((repo.references["refs/graalvm-metrics/" + str(commit.id)] for commit in repo.walk(parent.id, pygit2.GIT_SORT_TIME)
+                         if "refs/graalvm-metrics/" + str(commit.id) in repo.references), None)
+        if base_ref is not None:
+            record = json.loads(base_ref.resolve().peel()[0].data)
+        else:
+            with open(TEMPLATE_PATH) as template_file:
+                record = json.load(template_file)
+        change = rng.uniform(-0.02, 0.05)
+        commit_time = parent.commit_time
+        for i in range(rng.randint(1, 8)):
+            commit_time += rng.randint(5, 180) * 60
+            signature = pygit2.Signature("Build Bot", "bot@example.com", commit_time, 60)
+            commit = repo.create_commit(None, signature, signature, "Feature {} commit {}".format(branch, i), empty_tree, [parent.id])
+            record["image_details"]["total_bytes"] = int(record["image_details"]["total_bytes"] * (1 + change / 4))
+            record["image_details"]["code_area"]["bytes"] = int(record["image_details"]["code_area"]["bytes"] * (1 + change / 4))
+            if rng.random() >= missing_rate:
+                add_build(commit, record)
+                builds += 1
+            parent = repo[commit]
+        repo.references.create("refs/heads/feature/{}".format(branch), parent.id)
+    repo.compress_references()
+    if shutil.which("git") is not None:
+        subprocess.run(["git", "-C", path, "repack", "-a", "-d", "-q"], check=False)
+
+    with open(parameters_path, "w") as parameters_file:
+        json.dump(dict(parameters, builds=builds), parameters_file)
+    return builds
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a git repository with synthetic native image build metrics.")
+    parser.add_argument("path", help="Directory of the repository")
+    parser.add_argument("--commits", type=int, default=1000, help="Number of commits on main (default is 1000)")
+    parser.add_argument("--branches", type=int, default=0, help="Number of feature branches forked off main (default is 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated history (default is 0)")
+    parser.add_argument("--missing-rate", type=float, default=0.1, help="Share of commits without a build, on top of CI outages (default is 0.1)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    try:
+        builds = make_repo(args.path, args.commits, args.seed, args.missing_rate, args.branches)
+    except ValueError as e:
+        sys.exit(str(e))
+    print("Repository with {} commits on main, {} feature branches, and {} builds at {} ({:.1f}s)".format(
+        args.commits, args.branches, builds, args.path, time.perf_counter() - start))
@@ -0,0 +1,168 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pygit2
+from data_prep import find_build_commits, index_metrics_refs
+from decoding import read_record
+from history import load_history
+from plot import plot_data
+from metrics_cache import MetricsCache
+from defaults import METRICS_TYPES
+
+'''
+Batch mode of main.py: creates the reports of many repositories, branches and metrics types in one run.
+
+The manifest is a JSON list of jobs, each naming a repository, one branch (or a list of branches), the number of
+builds, and the metrics types to plot:
+
+[
+    {"repo": ".", "branches": ["main", "release"], "n": 50, "metrics_types": ["image_details", "resource_usage"]},
+    {"repo": "../other", "branch": "main", "n": 15, "metrics_types": ["analysis_results"]}
+]
+
+Branches of a repository usually share most of their builds. For a repository with several jobs, the union of their
+builds is first decoded into the metrics cache, split across the pool, so that every shared build is decoded once. Then
+all jobs run in parallel and find their records in the cache file, which is shared by all processes.
+'''
+
+# Per-process state of the pool workers, so that every process opens each repository and the cache only once
+_repositories = {}
+_cache = None
+
+def read_manifest(path):
+    '''Returns the jobs of a manifest with one branch per job. Raises ValueError for incomplete or unknown entries.'''
+
+    with open(path) as manifest_file:
+        entries = json.load(manifest_file)
+
+    jobs = []
+    for entry in entries:
+        branches = entry.get("branches") or [entry.get("branch")]
+        metrics_types = entry.get("metrics_types") or METRICS_TYPES
+        if entry.get("repo") is None or None in branches:
+            raise ValueError("Manifest entries need a 'repo' and a 'branch' or 'branches': " + json.dumps(entry))
+        unknown = [metrics_type for metrics_type in metrics_types if metrics_type not in METRICS_TYPES]
+        if unknown:
+            raise ValueError("Metrics type unknown: " + ", ".join(unknown))
+        repo_path = os.path.join(os.path.dirname(os.path.abspath(path)), entry["repo"])
+        for branch in branches:
+            jobs.append({"repo": os.path.normpath(repo_path), "branch": branch, "n": int(entry.get("n", 10)), "metrics_types": metrics_types})
+    return jobs
+
+def init_worker(cache_path, cache_size):
+    global _cache
+    _cache = MetricsCache(cache_path, cache_size)
+
+def open_repository(repo_path):
+    '''Returns the repository and its metrics ref index, opening each repository once per process.'''
+
+    if repo_path not in _repositories:
+        repo = pygit2.Repository(repo_path)
+        _repositories[repo_path] = (repo, index_metrics_refs(repo))
+    return _repositories[repo_path]
+
+def decode_into_cache(repo_path, shas):
+    '''Decodes the records of the given builds of a repository into the cache of the worker. Returns its cache hits and
+    misses meanwhile.'''
+
+    repo, _ = open_repository(repo_path)
+    hits, misses = _cache.hits, _cache.misses
+    for sha in shas:
+        read_record(repo, sha, _cache)
+    _cache.flush()
+    return _cache.hits - hits, _cache.misses - misses
+
+def shared_builds(repository_jobs, cache):
+    '''Returns the builds of all jobs of a repository, each once. Jobs whose branch cannot be loaded are left out, they
+    fail when they run.'''
+
+    repo, metrics_index = open_repository(repository_jobs[0]["repo"])
+    builds = {}
+    for job in repository_jobs:
+        branch = repo.branches.get(job["branch"])
+        if branch is not None:
+            builds.update(dict.fromkeys(find_build_commits(repo, branch, job["n"], metrics_index, cache)))
+    return list(builds)
+
+def prime_cache(pool, repositories, workers, cache_path, cache_size):
+    '''Decodes the builds shared by the jobs of every repository with several jobs into the cache file, split across
+    the pool. Returns a dict of repository -> number of builds decoded.'''
+
+    if cache_path == ":memory:":
+        # The workers cannot share an in-memory cache
+        return {}
+    cache = MetricsCache(cache_path, cache_size)
+    shares = {repo_path: shared_builds(repository_jobs, cache) for repo_path, repository_jobs in repositories.items() if len(repository_jobs) > 1}
+    # The scans of the branches are resumed by the jobs
+    cache.flush()
+    futures = {}
+    for repo_path, builds in shares.items():
+        size = -(-len(builds) // workers)
+        for start in range(0, len(builds), size):
+            futures[pool.submit(decode_into_cache, repo_path, builds[start:start + size])] = repo_path
+    decoded = {repo_path: 0 for repo_path in shares}
+    for future in as_completed(futures):
+        decoded[futures[future]] += future.result()[1]
+    return decoded
+
+def run_job(job, output_dir, image_format=None):
+    '''Loads one branch and writes its reports. Returns the job with its timings, report paths, cache statistics, and
+    numbers of builds with incomplete, without, or with malformed metrics.'''
+
+    start = time.perf_counter()
+    repo, metrics_index = open_repository(job["repo"])
+    hits, misses = _cache.hits, _cache.misses
+    history = load_history(job["repo"], job["n"], job["branch"], _cache, repo, metrics_index)
+    load_secs = time.perf_counter() - start
+
+    repo_output_dir = os.path.join(output_dir, os.path.basename(job["repo"]))
+    reports = [plot_data(history, job["branch"], metrics_type, output_dir=repo_output_dir, headless=True, image_format=image_format)
+               for metrics_type in job["metrics_types"]]
+    _cache.flush()
+    return dict(job, reports=reports, load_secs=load_secs, total_secs=time.perf_counter() - start,
+                hits=_cache.hits - hits, misses=_cache.misses - misses, incomplete=history.report.incomplete,
+                skipped=history.report.skipped, malformed=history.report.malformed)
+
+def job_result(future, job):
+    '''Returns the result of a job as returned by run_job, or the job with the error it failed with.'''
+
+    try:
+        return future.result()
+    except Exception as e:
+        return dict(job, error=str(e))
+
+def run_batch(manifest_path, output_dir, workers, cache_path, cache_size, image_format=None):
+    '''Runs all jobs of the manifest on a process pool and prints per-job timings and the total throughput. Returns the
+    result of every job, see job_result.'''
+
+    jobs = read_manifest(manifest_path)
+    repositories = {}
+    for job in jobs:
+        repositories.setdefault(job["repo"], []).append(job)
+    start = time.perf_counter()
+    reports = 0
+    failed = 0
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_path, cache_size)) as pool:
+        for repo_path, decoded in prime_cache(pool, repositories, workers, cache_path, cache_size).items():
+            print("{:<40} decoded {} builds shared by {} branches".format(os.path.basename(repo_path), decoded, len(repositories[repo_path])))
+        futures = {pool.submit(run_job, job, output_dir, image_format): job for job in jobs}
+        for result in (job_result(future, futures[future]) for future in as_completed(futures)):
+            results.append(result)
+            name = os.path.basename(result["repo"]) + ":" + result["branch"]
+            if "error" in result:
+                failed += 1
+                print("{:<40} failed: {}".format(name, result["error"]))
+                continue
+            reports += len(result["reports"])
+            print("{:<40} {} reports in {:.2f}s (loading {:.2f}s, {} cache hits, {} misses{})".format(
+                name, len(result["reports"]), result["total_secs"], result["load_secs"], result["hits"], result["misses"],
+                ", {} builds incomplete, {} skipped, {} malformed".format(result["incomplete"], result["skipped"], result["malformed"])
+                if result["incomplete"] or result["skipped"] or result["malformed"] else ""))
+
+    total_secs = time.perf_counter() - start
+    print("Created {} reports for {} jobs in {:.2f}s ({:.2f} reports/s, {} failed)".format(
+        reports, len(jobs), total_secs, reports / max(total_secs, 1e-9), failed))
+    return results
@@ -0,0 +1,202 @@
+import argparse
+import fnmatch
+import json
+import sys
+import time
+
+'''
+Compares feature branches with a base branch, e.g. the builds of pull requests with main.
+Fetch graalvm-metrics refs first: git fetch origin 'refs/graalvm-metrics/*:refs/graalvm-metrics/*'
+
+The history of the base is walked once for the newest n builds. For every branch, only the commits it does not share
+with the base are walked, and its newest build is compared with the build at its merge base, i.e. the change the
+branch introduces. Every metrics blob is decoded at most once, however many branches contain it.
+
+Usage: python3 compare.py [repo_path] [base] [branch ...] [--match PATTERN] [-n N] [--report PATH] [--metric COLUMN]
+
+Example: python3 compare.py . main feature/faster-startup --report diff.json
+            -> prints the changes of feature/faster-startup since it branched off main and writes them to diff.json
+            -> creates comparison_main_{time}.html overlaying the image size of both branches
+Example: python3 compare.py . main --match 'pr/*' --metric 'methods Reachable' --headless
+            -> compares all local branches starting with pr/ with main in one pass
+'''
+
+# Metrics printed for every branch, the report contains all of them
+SUMMARY_COLUMNS = ["Image Size", "Code Area Size", "Image Heap Size", "methods Reachable", "GC Time", "Peak RSS"]
+
+def mainline_build(repo, commit, metrics_index):
+    '''Returns the sha of the build of commit or of its closest first-parent ancestor with one, or None. Following
+    first parents needs no history walk, which would have to prepare the whole history first.'''
+
+    commit = repo[commit]
+    while str(commit.id) not in metrics_index:
+        if not commit.parent_ids:
+            return None
+        commit = repo[commit.parent_ids[0]]
+    return str(commit.id)
+
+def count_builds_since(repo, tip, commits, metrics_index):
+    '''Returns the number of builds newer than each of the given commits in one walk from tip.'''
+
+    import pygit2
+
+    remaining = set(commits)
+    counts = {}
+    builds = 0
+    for commit in repo.walk(tip, pygit2.GIT_SORT_TIME):
+        sha = str(commit.id)
+        if sha in remaining:
+            counts[sha] = builds
+            remaining.discard(sha)
+            if not remaining:
+                break
+        if sha in metrics_index:
+            builds += 1
+    return counts
+
+def compare_branches(repo, base_name, branch_names, n, cache=None):
+    '''Compares every branch with base. Returns the builds of the base (newest n, chronological) and one comparison per
+    branch with its merge base, the build there (baseline), its own builds since then (chronological), the number of
+    builds the base got since then, and the metrics of its newest build compared with the baseline. Also returns the
+    decoded records of all these builds by sha.'''
+
+    from data_prep import index_metrics_refs, scan_builds, walk_builds
+    from decoding import read_record
+
+    metrics_index = index_metrics_refs(repo)
+    base = repo.branches.get(base_name)
+    if base is None:
+        raise ValueError(f"Branch " + base_name + " not found.")
+
+    records = {}
+    def record_of(sha):
+        if sha not in records:
+            # A build without readable metrics compares as missing all of them
+            records[sha] = read_record(repo, sha, cache)[0]
+        return records[sha]
+
+    base_builds, _ = scan_builds(repo, base.target, n, metrics_index)
+    base_builds.reverse()
+    for sha in base_builds:
+        record_of(sha)
+
+    comparisons = []
+    for branch_name in branch_names:
+        branch = repo.branches.get(branch_name)
+        if branch is None:
+            raise ValueError(f"Branch " + branch_name + " not found.")
+        merge_base = repo.merge_base(base.target, branch.target)
+        comparison = {"branch": branch_name, "merge_base": str(merge_base) if merge_base is not None else None,
+                      "baseline_build": None, "builds": [], "base_builds_since": 0, "metrics": {}}
+        comparisons.append(comparison)
+        if merge_base is None:
+            continue
+
+        # Everything reachable from the merge base is shared with the base, so only the branch's own commits are walked
+        comparison["builds"] = [str(build.id) for build in walk_builds(repo, branch.target, metrics_index, hide=merge_base)][::-1]
+        comparison["baseline_build"] = mainline_build(repo, merge_base, metrics_index)
+        if comparison["baseline_build"] is not None and comparison["builds"]:
+            comparison["metrics"] = diff_metrics(record_of(comparison["baseline_build"]), record_of(comparison["builds"][-1]))
+        for sha in comparison["builds"]:
+            record_of(sha)
+
+    # The divergent side of the base is walked once for all branches
+    counts = count_builds_since(repo, base.target, [comparison["merge_base"] for comparison in comparisons if comparison["merge_base"]], metrics_index)
+    for comparison in comparisons:
+        comparison["base_builds_since"] = counts.get(comparison["merge_base"], 0)
+    return base_builds, comparisons, records
+
+def diff_metrics(baseline, head):
+    '''Returns the numeric metrics of two records as dict of metrics type -> column -> baseline, head, delta, and
+    percent. Missing values are None.'''
+
+    from data_prep import NUMERIC_METRICS, extract_columns
+
+    columns = extract_columns([baseline, head])
+    diff = {}
+    for metrics_type, family in NUMERIC_METRICS.items():
+        diff[metrics_type] = {}
+        for column, _, _ in family:
+            before, after = (None if value != value else float(value) for value in columns[column])
+            delta = after - before if before is not None and after is not None else None
+            percent = 100 * delta / abs(before) if delta is not None and before else None
+            diff[metrics_type][column] = {"baseline": before, "head": after, "delta": delta, "percent": percent}
+    return diff
+
+def print_comparisons(comparisons):
+    for comparison in comparisons:
+        if not comparison["metrics"]:
+            reason = "unrelated history" if comparison["merge_base"] is None else "no builds since the merge base" if not comparison["builds"] else "no build at the merge base"
+            print("{}: nothing to compare ({})".format(comparison["branch"], reason))
+            continue
+        changes = {column: values for family in comparison["metrics"].values() for column, values in family.items()}
+        summary = ", ".join("{} {:+.2f}%".format(column, changes[column]["percent"]) for column in SUMMARY_COLUMNS
+                            if changes[column]["percent"] is not None)
+        print("{}: {} builds since {} ({} on the base): {}".format(comparison["branch"], len(comparison["builds"]),
+              comparison["merge_base"][:10], comparison["base_builds_since"], summary))
+
+def write_report(path, base_name, base_builds, comparisons):
+    '''Writes the comparisons as JSON report.'''
+
+    with open(path, "w") as report_file:
+        json.dump({"base": base_name, "base_build": base_builds[-1] if base_builds else None, "branches": comparisons}, report_file, indent=2)
+
+def metric_series(repo, shas, records, column):
+    '''Returns the commit times, values of one column, and shas of the given builds.'''
+
+    from data_prep import extract_columns
+
+    times = [repo[sha].commit_time for sha in shas]
+    values = extract_columns([records[sha] for sha in shas])[column] if shas else []
+    return times, values, shas
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the native image builds of branches with a base branch.")
+    parser.add_argument("repo_path", help="Path to your GitHub repository")
+    parser.add_argument("base", help="Name of the base branch, e.g. main")
+    parser.add_argument("branches", nargs="*", help="Names of the branches to compare with the base")
+    parser.add_argument("--match", help="Additionally compare all local branches matching this glob pattern, e.g. 'pr/*'")
+    parser.add_argument("-n", type=int, default=50, help="Builds of the base shown in the figure (default is 50)")
+    parser.add_argument("--report", help="Write all metric changes of every branch to this JSON file")
+    parser.add_argument("--metric", default="Image Size", help="Column overlaid in the figure (default is 'Image Size')")
+    parser.add_argument("--no-plot", action="store_true", help="Do not create the figure")
+    parser.add_argument("--headless", action="store_true", help="Do not open the figure in a browser")
+    parser.add_argument("--image", choices=["png", "svg"], help="Additionally export the figure as static image (requires the kaleido package)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    import pygit2
+    from data_prep import NUMERIC_METRICS
+
+    if args.metric not in [column for family in NUMERIC_METRICS.values() for column, _, _ in family]:
+        print("Metric unknown. Valid options are the numeric columns of records.NUMERIC_METRICS, e.g. 'Image Size'")
+        sys.exit(1)
+    repo = pygit2.Repository(args.repo_path)
+    branch_names = list(args.branches)
+    if args.match:
+        branch_names += sorted(name for name in repo.branches.local if fnmatch.fnmatch(name, args.match) and name not in branch_names and name != args.base)
+    if not branch_names:
+        print("No branches to compare")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    base_builds, comparisons, records = compare_branches(repo, args.base, branch_names, args.n)
+    print("Compared {} branches with {} in {:.2f}s ({} builds decoded)".format(len(comparisons), args.base, time.perf_counter() - start, len(records)))
+    print_comparisons(comparisons)
+    if args.report is not None:
+        write_report(args.report, args.base, base_builds, comparisons)
+
+    if not args.no_plot:
+        from plot import plot_comparison
+        branch_series = {}
+        for comparison in comparisons:
+            if comparison["builds"]:
+                shas = ([comparison["baseline_build"]] if comparison["baseline_build"] else []) + comparison["builds"]
+                branch_series[comparison["branch"]] = metric_series(repo, shas, records, args.metric)
+        plot_comparison(metric_series(repo, base_builds, records, args.metric), branch_series, args.base, args.metric,
+                        headless=args.headless, image_format=args.image)
+
+if __name__ == "__main__":
+    main()
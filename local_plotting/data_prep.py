@@ -1,143 +1,228 @@
 import pygit2
+import numpy as np
 import pandas as pd
 import json
+import profiling
 from datetime import datetime, timezone, timedelta
-
-def get_blob_data(n):
-    return n.resolve().peel()[0].data
-
-def get_metrics(blob_data_entry, metrics_type):
-    '''Returns the correct metrics part of the blob data entry.'''
-
-    blob_data_entry = blob_data_entry.decode()
-    blob_data_entry = "[" + blob_data_entry + "]"
-    metrics_data = json.loads(blob_data_entry) 
-    return metrics_data[0].get(metrics_type)
-
-def load_data(repo_path, n, branch_name, metrics_type):
-    '''Creates pandas data frames for visualization with plotly. Requires user's arguments.'''
-
-    repo = pygit2.Repository(repo_path)
-    branch = repo.branches.get(branch_name)
-    if branch is None:
-        raise ValueError(f"Branch " + branch_name + " not found.")
-
-    # Iterate through the commit history of the branch
-    walker = repo.walk(branch.target, pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE)
-    commits = list(walker)
-    
-    # reverse commits list to filter for the newest n commits
-    commits.reverse()
-    metrics_refs = []
-    metrics_commits = []
-    i = n
-    for commit in commits:
-        try:
-            metrics_refs.insert(0, repo.lookup_reference('refs/graalvm-metrics/' + str(commit.id)))
-            metrics_commits.insert(0, commit)
-            i = i-1
-            if i <= 0:
-                break
-        except KeyError as e:
-            #skip as no build was created
-            continue
-    
-    blob_data = map(get_blob_data, metrics_refs)
-
-    # Extract commit dates, messages, and shas for plotting
-    commit_dates = []
-    commit_messages = []
-    commit_shas = []
-    for commit in metrics_commits:
-        tzinfo  = timezone( timedelta(minutes=commit.author.offset) )
-        dt = datetime.fromtimestamp(float(commit.author.time), tzinfo)
-        commit_dates.append(dt.strftime('%d.%m.%y, %H:%M'))
-        commit_messages.append(commit.message.strip())
-        commit_shas.append(str(commit.id))
-   
-    data_frame = None
-
-    if metrics_type == "image_details":
-        data_frame = create_image_details_data_frame(blob_data, commit_dates, commit_shas, commit_messages)
-    elif metrics_type == "analysis_results":
-        data_frame = create_analysis_results_data_frames(blob_data, commit_dates, commit_shas, commit_messages)
-    elif metrics_type == "resource_usage":
-        data_frame = create_resources_data_frame(blob_data, commit_dates, commit_shas, commit_messages)
-
-    return data_frame
-
-def create_image_details_data_frame(blob_data, commit_dates, commit_shas, commit_messages):
+# The known metrics and their validation, imported from here by most modules
+from records import ANALYSIS_RESULTS_ASPECTS, NUMERIC_METRICS, TEXT_METRICS, NUMERIC_PATHS, TEXT_PATHS, find_metric, record_values
+
+class MissingMetrics(LookupError):
+    '''Raised when a graalvm-metrics reference does not lead to a metrics blob.'''
+
+def get_record(metrics_ref, cache=None):
+    '''Returns the parsed metrics record of a graalvm-metrics reference. Blobs are immutable, so the record is looked up
+    in and added to the cache by blob id if one is given. Raises MissingMetrics if the reference does not point to a
+    tree with a blob, and ValueError if the blob is not JSON.'''
+
+    tree = metrics_ref.resolve().peel()
+    if not isinstance(tree, pygit2.Tree) or len(tree) == 0 or not isinstance(tree[0], pygit2.Blob):
+        raise MissingMetrics(metrics_ref.name + " does not point to a tree with a metrics blob")
+    entry = tree[0]
+    if cache is not None:
+        record = cache.get_by_blob(entry.id)
+        if record is not None:
+            profiling.count("records_from_cache")
+            return record
+    data = entry.data
+    record = json.loads(data.decode())
+    profiling.count("blobs_decoded")
+    profiling.count("blob_bytes", len(data))
+    if cache is not None:
+        cache.put(entry.id, record, len(data))
+    return record
+
+METRICS_REF_PREFIX = "refs/graalvm-metrics/"
+
+def index_metrics_refs(repo):
+    '''Returns a dict of commit sha -> graalvm-metrics reference name, built from one pass over the refs namespace.'''
+
+    with profiling.stage("index refs"):
+        index = {name[len(METRICS_REF_PREFIX):]: name for name in repo.references if name.startswith(METRICS_REF_PREFIX)}
+    profiling.count("metrics_refs", len(index))
+    return index
+
+def metrics_commit_shas(repo):
+    '''Returns the set of commit shas that have a graalvm-metrics reference. Takes less memory than index_metrics_refs
+    where the names of the references are not needed.'''
+
+    with profiling.stage("index refs"):
+        shas = {name[len(METRICS_REF_PREFIX):] for name in repo.references if name.startswith(METRICS_REF_PREFIX)}
+    profiling.count("metrics_refs", len(shas))
+    return shas
+
+def walk_builds(repo, tip, metrics_index, hide=None):
+    '''Yields the commits reachable from tip that have a build, newest first, without materializing the history.
+    Commits reachable from hide are not visited.'''
+
+    walker = repo.walk(tip, pygit2.GIT_SORT_TIME)
+    if hide is not None:
+        walker.hide(hide)
+    visited = 0
+    try:
+        for commit in walker:
+            visited += 1
+            if str(commit.id) in metrics_index:
+                yield commit
+    finally:
+        profiling.count("commits_walked", visited)
+
+def scan_builds(repo, tip, n, metrics_index, hide=None):
+    '''Returns the shas of up to n commits reachable from tip that have a build, newest first, and whether the history
+    was exhausted. Commits reachable from hide are not visited.'''
+
+    builds = []
+    for commit in walk_builds(repo, tip, metrics_index, hide):
+        builds.append(str(commit.id))
+        if len(builds) >= n:
+            return builds, False
+    return builds, True
+
+def is_ancestor(repo, ancestor, commit):
+    '''Returns whether ancestor is commit itself or reachable from it. Commits that no longer exist, e.g. the old tip
+    of a force-pushed branch, are never ancestors.'''
+
+    try:
+        return str(ancestor) == str(commit) or repo.descendant_of(commit, ancestor)
+    except (KeyError, ValueError, pygit2.GitError):
+        return False
+
+def find_build_commits(repo, branch, n, metrics_index, cache=None):
+    '''Returns the shas of the newest n commits of the branch that have a build, newest first. With a cache, the scan of
+    the previous run is resumed so that only commits added since its tip are visited.'''
+
+    tip = branch.target
+    scan = cache.get_scan(repo.path, branch.branch_name) if cache is not None else None
+    generation, generations = cache.sync_refs(repo.path, metrics_index) if cache is not None else (None, None)
+    builds = None
+
+    if scan is not None and "refs_generation" in scan and is_ancestor(repo, scan["tip"], tip):
+        new_builds, _ = scan_builds(repo, tip, float("inf"), metrics_index, hide=scan["tip"])
+        builds = new_builds + [sha for sha in scan["builds"] if sha in metrics_index]
+        exhausted = scan["exhausted"]
+        # A build that finished after the last scan may belong to a commit that it already visited, i.e. one reachable
+        # from its tip and not older than the last build it stored. Only the refs added since then are checked
+        known = set(new_builds)
+        oldest = repo[scan["builds"][-1]].commit_time if scan["builds"] and not exhausted else None
+        late = any(sha not in known and is_ancestor(repo, sha, scan["tip"]) and (oldest is None or repo[sha].commit_time >= oldest)
+                   for sha, first in generations.items() if first > scan["refs_generation"])
+        # Removed builds leave a gap that only a rescan fills
+        if late or (len(builds) < n and not exhausted):
+            builds = None
+
+    if builds is None:
+        builds, exhausted = scan_builds(repo, tip, n, metrics_index)
+
+    if cache is not None:
+        cache.put_scan(repo.path, branch.branch_name, str(tip), builds[:n], exhausted and len(builds) <= n, generation)
+    return builds[:n]
+
+def format_commit_date(author_time, author_offset):
+    '''Formats a commit's author time in the author's time zone.'''
+
+    tzinfo  = timezone( timedelta(minutes=author_offset) )
+    dt = datetime.fromtimestamp(float(author_time), tzinfo)
+    return dt.strftime('%d.%m.%y, %H:%M')
+
+def load_data_frames(repo_path, n, branch_name, cache=None, repo=None, metrics_index=None, warehouse=None):
+    '''Creates the pandas data frames of all metrics types from one scan of the branch. Returns a dict of metrics type -> data frame(s).
+    An already opened repository and its metrics ref index can be passed to reuse them for several branches. With a
+    warehouse, the builds are queried from it instead of scanning the repository. history.load_history returns the
+    same builds in far less memory.'''
+
+    from history import load_history
+
+    return load_history(repo_path, n, branch_name, cache, repo, metrics_index, warehouse).to_frames()
+
+def load_data(repo_path, n, branch_name, metrics_type, cache=None, warehouse=None):
+    '''Creates pandas data frames for visualization with plotly. Requires user's arguments and optionally a MetricsCache or a Warehouse.'''
+
+    return load_data_frames(repo_path, n, branch_name, cache, warehouse=warehouse)[metrics_type]
+
+def extract_columns(records, count=None):
+    '''Extracts all metric families from the parsed records in a single pass. Returns a dict of column -> NumPy array
+    with one row per record, where numeric metrics that are missing or invalid (see records.record_values) are NaN. A record
+    may be None for a build without metrics. records may be a generator if count is given, so that every record can be
+    released right after it was extracted.'''
+
+    if count is None:
+        records = list(records)
+        count = len(records)
+    values = np.full((count, len(NUMERIC_PATHS)), np.nan)
+    texts = np.empty((count, len(TEXT_PATHS)), dtype=object)
+
+    row = -1
+    for row, record in enumerate(records):
+        numbers, strings, _, _ = record_values(record)
+        values[row] = numbers
+        texts[row] = strings
+    if row + 1 != count:
+        raise ValueError("Expected {} metrics records but got {}".format(count, row + 1))
+
+    columns = {}
+    for index, (column, _, scale) in enumerate(column for family in NUMERIC_METRICS.values() for column in family):
+        columns[column] = values[:, index] * scale
+    for index, (column, _) in enumerate(column for family in TEXT_METRICS.values() for column in family):
+        columns[column] = texts[:, index].copy()
+    return columns
+
+def create_data_frames(columns, commit_dates, commit_shas, commit_messages):
+    '''Returns a dict of metrics type -> data frame(s) built from the extracted columns.'''
+
+    with profiling.stage("data frames"):
+        return {
+            "image_details": create_image_details_data_frame(columns, commit_dates, commit_shas, commit_messages),
+            "analysis_results": create_analysis_results_data_frames(columns, commit_dates, commit_shas, commit_messages),
+            "resource_usage": create_resources_data_frame(columns, commit_dates, commit_shas, commit_messages),
+            "general_info": create_general_info_data_frame(columns, commit_dates, commit_shas, commit_messages),
+        }
+
+def create_image_details_data_frame(columns, commit_dates, commit_shas, commit_messages):
     '''Creates pandas data frame for native image details.'''
 
-    #Filter for relevant metrics data
-    raw_image_data = [get_metrics(entry, "image_details") for entry in blob_data]
-    image_sizes = [entry.get("total_bytes") / 1000000 for entry in raw_image_data if entry != 0]
-    code_area_sizes = [entry.get("code_area").get("bytes") / 1000000 for entry in raw_image_data if entry != 0]
-    image_heap_sizes = [entry.get("image_heap").get("bytes") / 1000000 for entry in raw_image_data if entry != 0]
-    other = []
-    for i in range (0, len(image_sizes)):
-        other.append(float(image_sizes[i])-float(code_area_sizes[i])-float(image_heap_sizes[i]))
-    
-    #Create and return data frame 
     return pd.DataFrame({ "Commit Date": commit_dates, 
-                                "Image Size": image_sizes, 
-                                "Code Area Size": code_area_sizes,
-                                "Image Heap Size": image_heap_sizes,
-                                "Other": other,
+                                "Image Size": columns["Image Size"], 
+                                "Code Area Size": columns["Code Area Size"],
+                                "Image Heap Size": columns["Image Heap Size"],
+                                "Other": columns["Image Size"] - columns["Code Area Size"] - columns["Image Heap Size"],
                                 "Commit Sha": commit_shas,
                                 "Commit Message": commit_messages
     })
 
-def create_analysis_results_data_frames(blob_data, commit_dates, commit_shas, commit_messages):
+def create_analysis_results_data_frames(columns, commit_dates, commit_shas, commit_messages):
     '''Returns an array of pandas data frames for the visualization of native image build analysis results.'''
 
-    raw_analysis_results = [get_metrics(entry, "analysis_results") for entry in blob_data]
-    types_data = create_single_ar_data_frame(raw_analysis_results, "types", commit_dates, commit_shas, commit_messages,)
-    methods_data = create_single_ar_data_frame(raw_analysis_results, "methods", commit_dates, commit_shas, commit_messages)
-    classes_data = create_single_ar_data_frame(raw_analysis_results, "classes", commit_dates, commit_shas, commit_messages)
-    fields_data = create_single_ar_data_frame(raw_analysis_results, "fields", commit_dates, commit_shas, commit_messages)
-
-    return [types_data, methods_data, classes_data, fields_data]
-
-def create_single_ar_data_frame(analysis_results, aspect, commit_dates, commit_shas, commit_messages):
-    '''Returns a single data frame. Requires the analysis_results json, the name of the aspect (types, classes, methods, fields), and the commit_dates.'''
+    return [create_single_ar_data_frame(columns, aspect, commit_dates, commit_shas, commit_messages) for aspect in ANALYSIS_RESULTS_ASPECTS]
 
-    aspect_container = [entry.get(aspect) for entry in analysis_results]
-    total = [entry.get("total") for entry in aspect_container if entry != 0]
-    reflection = [entry.get("reflection") for entry in aspect_container if entry != 0]
-    jni = [entry.get("jni") for entry in aspect_container if entry != 0]
-    reachable = [entry.get("reachable") for entry in aspect_container if entry != 0]
+def create_single_ar_data_frame(columns, aspect, commit_dates, commit_shas, commit_messages):
+    '''Returns a single data frame. Requires the extracted columns, the name of the aspect (types, classes, methods, fields), and the commit_dates.'''
 
     return pd.DataFrame({ "Commit Date": commit_dates, 
-                            "Total": total, 
-                            "Reflection": reflection,
-                            "JNI": jni,
-                            "Reachable": reachable,
+                            "Total": columns[aspect + " Total"], 
+                            "Reflection": columns[aspect + " Reflection"],
+                            "JNI": columns[aspect + " JNI"],
+                            "Reachable": columns[aspect + " Reachable"],
                             "Commit Sha": commit_shas,
                             "Commit Message": commit_messages
     })
 
-def create_resources_data_frame(blob_data, commit_dates, commit_shas, commit_messages):
-    '''Creates pandas data frame for native image details.'''
-
-    raw_resources_data = [get_metrics(entry, "resource_usage") for entry in blob_data]
-    memory = [entry.get("memory") for entry in raw_resources_data if entry != 0]
-    peak_rss_bytes = [entry.get("peak_rss_bytes") / 1000000 for entry in memory if entry != 0]
-
-    gc = [entry.get("garbage_collection") for entry in raw_resources_data if entry != 0]
-    gc_time = [entry.get("total_secs") for entry in gc if entry != 0]
-    gc_count = [entry.get("count") for entry in gc if entry != 0]
-
-    cpu = [entry.get("cpu") for entry in raw_resources_data if entry != 0]
-    load = [entry.get("load") for entry in cpu if entry != 0]
-    total_cores = [entry.get("total_cores") for entry in cpu if entry != 0]
+def create_resources_data_frame(columns, commit_dates, commit_shas, commit_messages):
+    '''Creates pandas data frame for native image resource usage.'''
 
     return pd.DataFrame({ "Commit Date": commit_dates, 
-                            "GC Time": gc_time, 
-                            "GC Count": gc_count,
-                            "Peak RSS": peak_rss_bytes,
-                            "CPU Load": load,
-                            "Total Cores": total_cores,
+                            "GC Time": columns["GC Time"], 
+                            "GC Count": columns["GC Count"],
+                            "Peak RSS": columns["Peak RSS"],
+                            "CPU Load": columns["CPU Load"],
+                            "Total Cores": columns["Total Cores"],
                             "Commit Sha": commit_shas,
                             "Commit Message": commit_messages
-    })
\ No newline at end of file
+    })
+
+def create_general_info_data_frame(columns, commit_dates, commit_shas, commit_messages):
+    '''Creates pandas data frame for the toolchain and image information of each build.'''
+
+    data = {"Commit Date": commit_dates}
+    data.update({column: columns[column] for column, _ in TEXT_METRICS["general_info"]})
+    data.update({"Commit Sha": commit_shas, "Commit Message": commit_messages})
+    return pd.DataFrame(data)
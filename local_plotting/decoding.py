@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pygit2
+import profiling
+from data_prep import METRICS_REF_PREFIX, NUMERIC_PATHS, MissingMetrics, get_record
+from records import DecodeReport, decode_record, not_json
+from defaults import PARALLEL_DECODE_BUILDS
+from metrics_cache import MetricsCache
+
+'''
+Decoding of the graalvm-metrics blobs of many builds, isolated per build and spread over processes for long histories.
+
+Every record is validated against the known metric families (see records.py). A build whose metrics cannot be read,
+e.g. a ref that does not lead to a blob, is skipped, and malformed or incomplete records are decoded as far as they are
+valid. None of them stops a run: the build keeps its row with NaN for every metric without a valid value, and the
+problem is recorded with its commit sha in a DecodeReport.
+
+With more than one job, chunks of builds are decoded by a pool of processes that open the repository and the metrics
+cache themselves, like the workers of batch.py, and return their rows as arrays, so that only the values of the metrics
+are sent back instead of parsed records. Their cache hits and misses are added to the cache of the caller.
+'''
+
+# Builds decoded per task of a worker
+CHUNK_BUILDS = 2000
+
+# Per-process state of the pool workers
+_repo = None
+_cache = None
+
+def read_record(repo, sha, cache=None):
+    '''Returns the parsed metrics record of the build of a commit and its problem as ("skipped" or "malformed",
+    description), or None. The record is None if the metrics could not be read or parsed.'''
+
+    try:
+        record = get_record(repo.references[METRICS_REF_PREFIX + sha], cache)
+    except KeyError:
+        return None, ("skipped", "there is no reference " + METRICS_REF_PREFIX + sha)
+    except MissingMetrics as e:
+        return None, ("skipped", str(e))
+    except ValueError as e:
+        # Invalid JSON or UTF-8
+        return None, not_json(e)
+    return record, None
+
+def decode_build(repo, sha, cache=None):
+    '''Returns the author time and offset, message, numeric and descriptive values, and problem of one build.'''
+
+    commit = repo[sha]
+    record, problem = read_record(repo, sha, cache)
+    values, texts, problem = decode_record(record, problem)
+    return commit.author.time, commit.author.offset, commit.message.strip(), values, texts, problem
+
+def init_worker(repo_path, cache_path=None, cache_size=None):
+    global _repo, _cache
+    _repo = pygit2.Repository(repo_path)
+    _cache = MetricsCache(cache_path, cache_size) if cache_path is not None else None
+
+def decode_chunk(shas):
+    '''Decodes a chunk of builds in a pool worker. Returns their author times and offsets as arrays, messages, numeric
+    values as one array, descriptive values, problems, and the cache hits, misses, and bytes saved meanwhile.'''
+
+    times = np.empty(len(shas), dtype=np.int64)
+    offsets = np.empty(len(shas), dtype=np.int16)
+    values = np.empty((len(shas), len(NUMERIC_PATHS)))
+    messages, texts, problems = [], [], []
+    statistics = (_cache.hits, _cache.misses, _cache.bytes_saved) if _cache is not None else (0, 0, 0)
+    for row, sha in enumerate(shas):
+        times[row], offsets[row], message, values[row], row_texts, problem = decode_build(_repo, sha, _cache)
+        messages.append(message)
+        texts.append(row_texts)
+        problems.append(problem)
+    if _cache is not None:
+        # Workers are not told when the pool shuts down, so every chunk writes its new records
+        _cache.flush()
+        statistics = (_cache.hits - statistics[0], _cache.misses - statistics[1], _cache.bytes_saved - statistics[2])
+    return times, offsets, messages, values, texts, problems, statistics
+
+def decode_builds(repo, shas, cache=None, jobs=1, report=None):
+    '''Yields (sha, author time, author offset, message, numeric values, descriptive values) of the given builds in their
+    order, as BuildHistory.from_builds takes them. Problems are added to report. With more than one job and at least
+    PARALLEL_DECODE_BUILDS builds, the builds are decoded by a pool of jobs processes.'''
+
+    report = report if report is not None else DecodeReport()
+    if jobs <= 1 or len(shas) < PARALLEL_DECODE_BUILDS:
+        for sha in shas:
+            author_time, author_offset, message, values, texts, problem = decode_build(repo, sha, cache)
+            report.add(sha, problem)
+            yield sha, author_time, author_offset, message, values, texts
+        return
+
+    chunks = [shas[start:start + CHUNK_BUILDS] for start in range(0, len(shas), CHUNK_BUILDS)]
+    # An in-memory cache cannot be shared, the workers go without
+    cache_args = (cache.path, cache.max_bytes) if cache is not None and cache.path != ":memory:" else ()
+    if cache_args:
+        # Records of this process that the workers may look up
+        cache.flush()
+    with ProcessPoolExecutor(max_workers=min(jobs, len(chunks)), initializer=init_worker, initargs=(repo.path,) + cache_args) as pool:
+        # Chunks are returned in order while later ones are still being decoded
+        for chunk, (times, offsets, messages, values, texts, problems, statistics) in zip(chunks, pool.map(decode_chunk, chunks)):
+            if cache_args:
+                cache.hits += statistics[0]
+                cache.misses += statistics[1]
+                cache.bytes_saved += statistics[2]
+            # Counters of the workers are not recorded by their processes
+            profiling.count("records_from_cache", statistics[0])
+            profiling.count("blobs_decoded", len(chunk) - statistics[0] - sum(problem is not None and problem[0] == "skipped" for problem in problems))
+            for row, sha in enumerate(chunk):
+                report.add(sha, problems[row])
+                yield sha, times[row], offsets[row], messages[row], values[row], texts[row]
@@ -0,0 +1,19 @@
+'''
+Defaults shared by the command line and the modules implementing it. Kept free of imports so that main.py can parse
+and validate its arguments before pandas, plotly, or pygit2 are loaded.
+'''
+
+METRICS_TYPES = ["image_details", "analysis_results", "resource_usage"]
+
+# Histories with more builds than this are plotted in large history mode unless it is chosen explicitly
+LARGE_HISTORY_BUILDS = 5000
+DEFAULT_MAX_POINTS = 2000
+
+# Seconds between two checks for new builds in watch mode
+DEFAULT_WATCH_INTERVAL = 0.2
+
+# Buckets of rollups, auto chooses days or weeks so that there are at most max points buckets
+ROLLUP_PERIODS = ["auto", "day", "week", "tag"]
+
+# Histories with at least this many builds are decoded by a pool of processes if more than one job is allowed
+PARALLEL_DECODE_BUILDS = 5000
@@ -0,0 +1,64 @@
+import numpy as np
+
+'''
+Shape-preserving downsampling of metric series for plotting long histories.
+
+Largest-Triangle-Three-Buckets keeps the visual shape of a series with a fixed number of points, and the largest
+jumps of a series are always kept on top of that so that no regression disappears between two sampled points.
+'''
+
+def lttb(x, y, threshold):
+    '''Returns the indices of at most threshold points of (x, y) selected with Largest-Triangle-Three-Buckets. The first
+    and last point are always selected. x must be increasing and both arrays must be free of NaN.'''
+
+    count = len(y)
+    if threshold >= count:
+        return np.arange(count)
+    if threshold < 3:
+        return np.array([0, count - 1])[:max(threshold, 0)]
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    # Points between the first and the last one are split into threshold - 2 buckets, each contributing one point
+    every = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        # Average of the next bucket as the third corner of the triangle
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+def change_points(y, limit, sensitivity=6.0):
+    '''Returns the indices around the at most limit largest jumps of y that stand out from its usual step size,
+    measured as sensitivity median absolute deviations above the median step. Both sides of each jump are returned.'''
+
+    if len(y) < 2 or limit <= 0:
+        return np.array([], dtype=np.int64)
+    steps = np.abs(np.diff(y))
+    median = np.median(steps)
+    deviation = np.median(np.abs(steps - median)) * 1.4826
+    candidates = np.flatnonzero(steps > median + sensitivity * max(deviation, 1e-12))
+    if len(candidates) > limit:
+        candidates = candidates[np.argsort(steps[candidates])[-limit:]]
+    return np.union1d(candidates, candidates + 1)
+
+def downsample(x, y, max_points, change_point_share=0.2):
+    '''Returns the sorted indices of the points of (x, y) to plot: all of them if there are at most max_points, otherwise
+    an LTTB selection plus the largest jumps, which may use up to change_point_share of max_points. NaN values are skipped.'''
+
+    valid = np.flatnonzero(~np.isnan(y))
+    if len(valid) <= max_points:
+        return valid
+    x_valid = x[valid]
+    y_valid = y[valid]
+    jumps = change_points(y_valid, int(max_points * change_point_share) // 2)
+    shape = lttb(x_valid, y_valid, max_points - len(jumps))
+    return valid[np.union1d(shape, jumps)]
@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+'''
+Streams the metrics of the builds of a branch as NDJSON, CSV, or Arrow IPC, one record per build, newest first.
+Fetch graalvm-metrics refs first: git fetch origin 'refs/graalvm-metrics/*:refs/graalvm-metrics/*'
+
+Every build is read from the commit walker, flattened, written, and released before the next one is read, so memory
+stays constant however long the history is. NDJSON keeps every field of a blob. The columns of CSV and Arrow are the
+commit fields, the known metrics (records.NUMERIC_METRICS and TEXT_METRICS), and the other fields of the newest build:
+fields a build lacks are left empty, other fields only older builds have are left out. A build whose metrics cannot be
+read or are not a JSON object is exported with empty metrics and reported on stderr.
+
+Usage: python3 export.py [repo_path] [branch] [--format ndjson|csv|arrow] [--output PATH]
+
+Example: python3 export.py . main --since 2024-01-01 | jq '.["image_details.total_bytes"]'
+            -> prints the total image size of every build since January 2024
+Example: python3 export.py . main --format arrow --output main.arrow
+            -> writes all builds of main as Arrow IPC stream (requires the pyarrow package)
+'''
+
+ARROW_BATCH_ROWS = 4096
+# Fields of every row, followed by the metrics of its blob
+COMMIT_FIELDS = ["commit_sha", "commit_time", "author_time", "message"]
+
+def flatten(record, prefix="", into=None):
+    '''Returns the leaves of a nested metrics record as dict of dotted path -> value. Lists stay values.'''
+
+    flat = {} if into is None else into
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flatten(value, prefix + key + ".", flat)
+        else:
+            flat[prefix + key] = value
+    return flat
+
+def iter_rows(repo_path, branch_name, n=None, since=None):
+    '''Yields one flat dict per build of the branch, newest first: the commit fields followed by the metrics of its blob.
+    Stops after n builds or at the first commit older than since (epoch seconds of the commit time).'''
+
+    import pygit2
+    from data_prep import index_metrics_refs, walk_builds
+    from decoding import read_record
+
+    repo = pygit2.Repository(repo_path)
+    branch = repo.branches.get(branch_name)
+    if branch is None:
+        raise ValueError(f"Branch " + branch_name + " not found.")
+    metrics_index = index_metrics_refs(repo)
+
+    count = 0
+    for commit in walk_builds(repo, branch.target, metrics_index):
+        if (n is not None and count >= n) or (since is not None and commit.commit_time < since):
+            return
+        record, problem = read_record(repo, str(commit.id))
+        if problem is None and not isinstance(record, dict):
+            problem = ("malformed", "the metrics are not a JSON object")
+        row = {"commit_sha": str(commit.id),
+               "commit_time": datetime.fromtimestamp(commit.commit_time, timezone.utc).isoformat(),
+               "author_time": commit.author.time,
+               "message": commit.message.strip().split("\n", 1)[0]}
+        if problem is not None:
+            print("{} {}: {}".format(str(commit.id)[:10], *problem), file=sys.stderr)
+            yield row
+        else:
+            yield flatten(record, into=row)
+        count += 1
+
+def table_columns(first):
+    '''Returns the columns of CSV and Arrow for rows starting with first, see above, and the set of numeric ones.'''
+
+    from data_prep import NUMERIC_PATHS, TEXT_PATHS
+
+    numeric = {".".join(path) for path in NUMERIC_PATHS} | {"author_time"}
+    columns = COMMIT_FIELDS + [".".join(path) for path in NUMERIC_PATHS] + [".".join(path) for path in TEXT_PATHS]
+    known = set(columns)
+    for key, value in first.items():
+        if key not in known:
+            columns.append(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                numeric.add(key)
+    return columns, numeric
+
+def write_ndjson(rows, output):
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, separators=(",", ":")))
+        output.write("\n")
+        count += 1
+    return count
+
+def write_csv(rows, output):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    writer = csv.DictWriter(output, fieldnames=table_columns(first)[0], extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    for row in _chain(first, rows):
+        writer.writerow({key: json.dumps(value) if isinstance(value, list) else value for key, value in row.items()})
+        count += 1
+    return count
+
+def write_arrow(rows, output):
+    '''Writes the rows as Arrow IPC stream in batches of ARROW_BATCH_ROWS rows. Numbers become float64 columns, all
+    other fields (including lists, as JSON) string columns.'''
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("Arrow export requires the pyarrow package")
+
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    columns, numeric = table_columns(first)
+    schema = pa.schema([(key, pa.float64() if key in numeric else pa.string()) for key in columns])
+    sink = output.buffer if hasattr(output, "buffer") else output
+
+    def convert(value, key):
+        if value is None:
+            return None
+        if key in numeric:
+            return float(value) if isinstance(value, (int, float)) else None
+        return json.dumps(value) if isinstance(value, list) else str(value)
+
+    count = 0
+    with pa.ipc.new_stream(sink, schema) as writer:
+        batch = []
+        for row in _chain(first, rows):
+            batch.append(row)
+            if len(batch) == ARROW_BATCH_ROWS:
+                writer.write_batch(pa.record_batch([[convert(row.get(key), key) for row in batch] for key in schema.names], schema=schema))
+                count += len(batch)
+                batch.clear()
+        if batch:
+            writer.write_batch(pa.record_batch([[convert(row.get(key), key) for row in batch] for key in schema.names], schema=schema))
+            count += len(batch)
+    return count
+
+def _chain(first, rows):
+    yield first
+    yield from rows
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv, "arrow": write_arrow}
+
+def export(repo_path, branch_name, output, output_format="ndjson", n=None, since=None):
+    '''Streams the builds of a branch to the open output file in the given format. Returns the number of builds written.'''
+
+    return WRITERS[output_format](iter_rows(repo_path, branch_name, n, since), output)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream native image build metrics of a local repository as NDJSON, CSV, or Arrow IPC.")
+    parser.add_argument("repo_path", help="Path to your GitHub repository")
+    parser.add_argument("branch", help="Name of the branch")
+    parser.add_argument("--format", choices=list(WRITERS), default="ndjson", help="Output format (default is ndjson)")
+    parser.add_argument("--output", default="-", help="File to write to (default is standard output)")
+    parser.add_argument("-n", type=int, help="Export only the last n builds (default is all)")
+    parser.add_argument("--since", help="Export only builds committed on or after this date, e.g. 2024-01-01")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    since = datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc).timestamp() if args.since else None
+
+    start = time.perf_counter()
+    try:
+        if args.output == "-":
+            count = export(args.repo_path, args.branch, sys.stdout, args.format, args.n, since)
+            sys.stdout.flush()
+        else:
+            mode = "wb" if args.format == "arrow" else "w"
+            with open(args.output, mode, **({} if mode == "wb" else {"newline": ""})) as output:
+                count = export(args.repo_path, args.branch, output, args.format, args.n, since)
+    except BrokenPipeError:
+        # The reader stopped early, e.g. head. Python would report the failed flush of stdout at exit otherwise
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    secs = time.perf_counter() - start
+    print("Exported {} builds in {:.2f}s ({:.0f} builds/s)".format(count, secs, count / max(secs, 1e-9)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+
+import numpy as np
+import pygit2
+import profiling
+from data_prep import (NUMERIC_METRICS, TEXT_METRICS, ANALYSIS_RESULTS_ASPECTS, metrics_commit_shas, find_build_commits,
+                       create_data_frames, create_image_details_data_frame, create_analysis_results_data_frames,
+                       create_resources_data_frame, create_general_info_data_frame)
+from decoding import DecodeReport, decode_builds, decode_record
+
+'''
+Memory-compact model of the builds of a branch, the data behind all metrics types.
+
+The numeric metrics of all builds are one float64 matrix with a contiguous column per metric (NaN where a build lacks
+it). Commit times are int64 epoch seconds with the author's offset in minutes and are only formatted when a report is
+rendered. Commit shas are stored as 20 raw bytes, commit messages as one UTF-8 buffer with an offset per build, and
+the descriptive metrics (e.g. the GraalVM version) as codes into tables that hold every distinct value once. All
+metrics types share these arrays, while the data frames of data_prep repeat the formatted date, sha, and message of
+every build in each of them.
+
+Builds are read one by one while the history is filled, so no commit, reference, or parsed record outlives its row.
+libgit2 neither caches the commits and trees nor keeps more than a few MB of the pack file mapped meanwhile, as each of
+them is read only once. Long histories may be decoded by several processes (see decoding.py), and builds whose metrics
+are missing or malformed keep their rows with NaN, listed in the DecodeReport of the history.
+'''
+
+NUMERIC_COLUMNS = [column for family in NUMERIC_METRICS.values() for column, _, _ in family]
+TEXT_COLUMNS = [column for family in TEXT_METRICS.values() for column, _ in family]
+DATE_FORMAT = '%d.%m.%y, %H:%M'
+
+# Object limits of libgit2's cache, restored after loading
+CACHED_OBJECT_LIMITS = {pygit2.GIT_OBJECT_COMMIT: 4096, pygit2.GIT_OBJECT_TREE: 4096}
+# Size of the pack file windows libgit2 maps while loading, and how much of them stays mapped
+LOAD_WINDOW_SIZE = 1024 * 1024
+LOAD_MAPPED_LIMIT = 4 * 1024 * 1024
+
+class BuildHistory:
+    '''The builds of a branch in chronological order. Positions index all arrays.'''
+
+    def __init__(self, count):
+        self.times = np.zeros(count, dtype=np.int64)
+        self.offsets = np.zeros(count, dtype=np.int16)
+        self._sha_buffer = bytearray(20 * count)
+        self.shas = np.frombuffer(self._sha_buffer, dtype=np.uint8).reshape(count, 20)
+        self.message_data = bytearray()
+        self.message_offsets = np.zeros(count + 1, dtype=np.int64)
+        # Fortran order keeps every column contiguous
+        self.values = np.full((count, len(NUMERIC_COLUMNS)), np.nan, order="F")
+        self.text_codes = np.full((count, len(TEXT_COLUMNS)), -1, dtype=np.int32)
+        self.text_values = [[] for _ in TEXT_COLUMNS]
+        self._columns = {column: index for index, column in enumerate(NUMERIC_COLUMNS)}
+        self.report = DecodeReport()
+
+    @classmethod
+    def from_builds(cls, count, builds, report=None):
+        '''Creates the history of count builds from (commit sha, author time, author offset, message, numeric values,
+        descriptive values) tuples as yielded by decoding.decode_builds, oldest first. Numeric values are unscaled in the
+        order of NUMERIC_COLUMNS and NaN where missing, descriptive values in the order of TEXT_COLUMNS and None where
+        missing. builds may be a generator so that every build is released once its row is filled.'''
+
+        history = cls(count)
+        if report is not None:
+            history.report = report
+        text_codes = [{} for _ in TEXT_COLUMNS]
+        sha_buffer = history._sha_buffer
+        message_data = history.message_data
+
+        row = -1
+        for row, (sha, author_time, author_offset, message, values, texts) in enumerate(builds):
+            history.times[row] = author_time
+            history.offsets[row] = author_offset
+            sha_buffer[20 * row:20 * row + 20] = bytes.fromhex(sha)
+            message_data += message.encode()
+            history.message_offsets[row + 1] = len(message_data)
+            history.values[row] = values
+            for index, value in enumerate(texts):
+                if value is not None:
+                    history.text_codes[row, index] = intern_string(value, text_codes[index], history.text_values[index])
+        if row + 1 != count:
+            raise ValueError("Expected {} builds but got {}".format(count, row + 1))
+
+        for index, (_, _, scale) in enumerate(column for family in NUMERIC_METRICS.values() for column in family):
+            if scale != 1:
+                history.values[:, index] *= scale
+        return history
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        '''Returns the approximate memory of the arrays and string tables in bytes.'''
+
+        strings = sum(len(str(value)) + 49 for values in self.text_values for value in values)
+        return (self.times.nbytes + self.offsets.nbytes + self.shas.nbytes + len(self.message_data) + self.message_offsets.nbytes
+                + self.values.nbytes + self.text_codes.nbytes + strings)
+
+    def column(self, name):
+        '''Returns the values of a numeric column of records.NUMERIC_METRICS as contiguous array, without copying.'''
+
+        return self.values[:, self._columns[name]]
+
+    def frame_column(self, metrics_type, index, column):
+        '''Returns the values of a column of the data frame(s) of a metrics type, e.g. ("analysis_results", 1, "Reachable").'''
+
+        if metrics_type == "image_details" and column == "Other":
+            return self.column("Image Size") - self.column("Code Area Size") - self.column("Image Heap Size")
+        if metrics_type == "analysis_results":
+            return self.column(ANALYSIS_RESULTS_ASPECTS[index] + " " + column)
+        return self.column(column)
+
+    def text_column(self, name, positions=None):
+        '''Returns the values of a descriptive column of records.TEXT_METRICS as object array, None where missing.'''
+
+        index = TEXT_COLUMNS.index(name)
+        table = np.array(self.text_values[index] + [None], dtype=object)
+        codes = self.text_codes[:, index] if positions is None else self.text_codes[positions, index]
+        return table[codes]
+
+    def datetimes(self, positions=None):
+        '''Returns the commit times in the author's time zone as datetime64[s] array.'''
+
+        times = self.times if positions is None else self.times[positions]
+        offsets = self.offsets if positions is None else self.offsets[positions]
+        return (times + offsets.astype(np.int64) * 60).astype("datetime64[s]")
+
+    def commit_dates(self, positions=None):
+        '''Returns the formatted commit dates as list of strings, like data_prep.format_commit_date.'''
+
+        import pandas as pd
+
+        return list(pd.DatetimeIndex(self.datetimes(positions)).strftime(DATE_FORMAT))
+
+    def commit_shas(self, positions=None):
+        shas = self.shas if positions is None else self.shas[positions]
+        return [row.tobytes().hex() for row in shas]
+
+    def commit_messages(self, positions=None):
+        positions = range(len(self)) if positions is None else positions
+        return [self.commit_message(position) for position in positions]
+
+    def commit_sha(self, position):
+        return self.shas[position].tobytes().hex()
+
+    def commit_date(self, position):
+        return self.commit_dates([position])[0]
+
+    def commit_message(self, position):
+        return self.message_data[self.message_offsets[position]:self.message_offsets[position + 1]].decode()
+
+    def columns(self):
+        '''Returns a dict of column -> array of all numeric and descriptive metrics, like data_prep.extract_columns.'''
+
+        columns = {column: self.values[:, index] for index, column in enumerate(NUMERIC_COLUMNS)}
+        columns.update({column: self.text_column(column) for column in TEXT_COLUMNS})
+        return columns
+
+    def frame(self, metrics_type):
+        '''Returns the data frame(s) of one metrics type, as created by data_prep.create_data_frames.'''
+
+        create = {"image_details": create_image_details_data_frame, "analysis_results": create_analysis_results_data_frames,
+                  "resource_usage": create_resources_data_frame, "general_info": create_general_info_data_frame}[metrics_type]
+        return create(self.columns(), self.commit_dates(), self.commit_shas(), self.commit_messages())
+
+    def to_frames(self):
+        '''Returns the data frames of all metrics types, as created by data_prep.create_data_frames.'''
+
+        return create_data_frames(self.columns(), self.commit_dates(), self.commit_shas(), self.commit_messages())
+
+def intern_string(value, codes, table):
+    '''Returns the code of value in table, appending it if it is new.'''
+
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(table)
+        table.append(value)
+    return code
+
+@contextmanager
+def reading_once():
+    '''Disables libgit2's cache of commits and trees, which would otherwise keep up to 256 MB of objects that a full
+    history scan reads only once, and limits the mapped windows of pack files. Both settings are global and restored
+    afterwards.'''
+
+    settings = pygit2.settings
+    window_size, mapped_limit = settings.mwindow_size, settings.mwindow_mapped_limit
+    for object_type in CACHED_OBJECT_LIMITS:
+        settings.cache_object_limit(object_type, 0)
+    settings.mwindow_size, settings.mwindow_mapped_limit = LOAD_WINDOW_SIZE, LOAD_MAPPED_LIMIT
+    try:
+        yield
+    finally:
+        for object_type, limit in CACHED_OBJECT_LIMITS.items():
+            settings.cache_object_limit(object_type, limit)
+        settings.mwindow_size, settings.mwindow_mapped_limit = window_size, mapped_limit
+
+def load_history(repo_path, n, branch_name, cache=None, repo=None, metrics_index=None, warehouse=None, jobs=1):
+    '''Returns the BuildHistory of the newest n builds of a branch, from the repository or a warehouse. Arguments are the
+    same as for data_prep.load_data_frames, long histories are decoded by up to jobs processes.'''
+
+    if warehouse is not None:
+        with profiling.stage("query warehouse"):
+            builds = warehouse.last_builds(branch_name, n)
+        if not builds and branch_name not in warehouse.branches():
+            raise ValueError(f"Branch " + branch_name + " not found in the warehouse, run ingest.py first.")
+        report = DecodeReport()
+
+        def rows():
+            for build in builds:
+                values, texts, problem = decode_record(build["record"])
+                report.add(build["commit_sha"], problem)
+                yield build["commit_sha"], build["author_time"], build["author_offset"], build["message"], values, texts
+
+        with profiling.stage("extract columns"):
+            return BuildHistory.from_builds(len(builds), rows(), report)
+
+    if repo is None:
+        repo = pygit2.Repository(repo_path)
+    branch = repo.branches.get(branch_name)
+    if branch is None:
+        raise ValueError(f"Branch " + branch_name + " not found.")
+    # Only whether a commit has a build is needed, so a set of shas does instead of the names of the refs
+    if metrics_index is None:
+        metrics_index = metrics_commit_shas(repo)
+
+    with reading_once():
+        with profiling.stage("find builds"):
+            build_ids = find_build_commits(repo, branch, n, metrics_index, cache)
+        metrics_index = None
+        return read_history(repo, build_ids, cache, jobs)
+
+def read_history(repo, build_ids, cache=None, jobs=1):
+    '''Returns the BuildHistory of the given builds, newest first as returned by data_prep.find_build_commits, decoded
+    by up to jobs processes. Call it within reading_once() when the builds are many.'''
+
+    count = len(build_ids)
+    report = DecodeReport()
+    # Records are decoded while their rows are filled, oldest first
+    with profiling.stage("decode"):
+        history = BuildHistory.from_builds(count, decode_builds(repo, build_ids[::-1], cache, jobs, report), report)
+    profiling.count("ref_lookups", count)
+    return history
@@ -0,0 +1,38 @@
+import argparse
+import time
+from warehouse import Warehouse, default_warehouse_path, ingest
+
+'''
+Loads all graalvm-metrics of a repository into its local metrics warehouse, see warehouse.py.
+Fetch graalvm-metrics refs first: git fetch origin 'refs/graalvm-metrics/*:refs/graalvm-metrics/*'
+
+Usage: python3 ingest.py [repo_path] [branch ...]
+
+Example: python3 ingest.py .
+            -> ingests the builds of all local branches into .git/graalvm-metrics.sqlite
+Example: python3 ingest.py . main release --warehouse metrics.sqlite
+            -> ingests the builds of main and release into metrics.sqlite
+            -> python3 main.py . main 15 image_details --warehouse metrics.sqlite plots from it
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest native image build metrics of a local repository into a queryable warehouse.")
+    parser.add_argument("repo_path", help="Path to your GitHub repository")
+    parser.add_argument("branches", nargs="*", help="Names of the branches to ingest (default is all local branches)")
+    parser.add_argument("--warehouse", help="Path of the warehouse (default is graalvm-metrics.sqlite in the .git directory)")
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    path = args.warehouse or default_warehouse_path(args.repo_path)
+
+    start = time.perf_counter()
+    with Warehouse(path) as warehouse:
+        new_builds, memberships, unreadable = ingest(args.repo_path, warehouse, args.branches)
+    print("Ingested {} new builds ({} branch memberships) into {} in {:.2f}s".format(new_builds, memberships, path, time.perf_counter() - start))
+    if unreadable:
+        print("Left out {} builds whose metrics could not be read".format(unreadable))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import argparse
-from data_prep import load_data
-from plot import plot_data
+import os
+import sys
+import profiling
+from metrics_cache import MetricsCache, DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES
+from defaults import METRICS_TYPES, LARGE_HISTORY_BUILDS, DEFAULT_MAX_POINTS, DEFAULT_WATCH_INTERVAL, ROLLUP_PERIODS, PARALLEL_DECODE_BUILDS
 
 '''
 Fetch graalvm-metrics refs: git fetch origin 'refs/graalvm-metrics/*:refs/graalvm-metrics/*'
@@ -10,40 +13,187 @@ Usage: python3 main.py [repo_path] [branch] [amount of builds] [metrics type]
 Example: python3 main.py . main 15 analysis_results
             -> show graph
             -> creates analysis_results_{time}.html file
+Example: python3 main.py . main 15 image_details --headless --image svg
+            -> creates image_details_{time}.html next to a shared plotly.min.js, and image_details_{time}.svg
 Example: python3 main.py . test_branch 40 image_details  
             -> show graph
             -> creates image_details_{time}.html file
+Example: python3 main.py . main 1000 image_details --cache-size 64
+            -> reuses the metrics decoded by earlier runs, bounded to 64 MB on disk
+Example: python3 main.py . main 50000 image_details --headless --max-points 1000
+            -> plots the history with WebGL traces of at most 1000 points each
+Example: python3 main.py . main 200 image_details --headless --regressions regressions.json --fail-on-regression
+            -> marks regressions in the graph, writes them to regressions.json, and exits with code 3 if there are any
+Example: python3 main.py . main 200 image_details --no-plot --regressions regressions.json
+            -> only writes regressions.json, without loading plotly
+Example: python3 main.py . main 20000 resource_usage --headless --rollup week
+            -> plots the median, range, and 95th percentile of every metric per week, reusing the weeks of earlier runs
+Example: python3 main.py . main 20000 image_details --rollup tag --release-tags 'v*'
+            -> plots the same statistics per release, delimited by the tags starting with v
+Example: python3 main.py . main 100000 image_details --headless --decode-jobs 8
+            -> decodes the metrics of the builds in 8 processes and reports builds with incomplete, without, or with malformed metrics
+Example: python3 main.py . main 200 image_details --watch
+            -> keeps output/image_details_main.html up to date while new builds land, until interrupted
+Example: python3 main.py . main 1000 image_details --headless --profile --profile-format chrome
+            -> additionally writes the time, counters, and peak memory of every stage to output/profile_image_details_{time}.trace.json
+Example: python3 main.py --batch nightly.json --jobs 4
+            -> creates the reports of all jobs in nightly.json (see batch.py) under output/{repository}
 '''
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Visualize local native image build data from last n GitHub commits using setup-graalvm action.")
-    parser.add_argument("repo_path", help="Path to your GitHub repository")
-    parser.add_argument("branch", help="Name of the branch")
-    parser.add_argument("n", help="Last n commits")
-    parser.add_argument("metrics_type", help="Type of metrics from the report to be visulized. Either 'image_details', 'analysis_results', or 'resource_usage'")
+    parser.add_argument("repo_path", nargs="?", help="Path to your GitHub repository")
+    parser.add_argument("branch", nargs="?", help="Name of the branch")
+    parser.add_argument("n", nargs="?", help="Last n commits")
+    parser.add_argument("metrics_type", nargs="?", help="Type of metrics from the report to be visulized. Either 'image_details', 'analysis_results', or 'resource_usage'")
+    parser.add_argument("--warehouse", help="Query the builds from a metrics warehouse created by ingest.py instead of scanning the repository")
+    parser.add_argument("--headless", action="store_true", help="Do not open the graph in a browser and let all reports of the output directory share one plotly.min.js")
+    parser.add_argument("--image", choices=["png", "svg"], help="Additionally export the graph as static image (requires the kaleido package)")
+    parser.add_argument("--large-history", action="store_true", default=None, help="Plot downsampled WebGL traces, the default for more than {} builds".format(LARGE_HISTORY_BUILDS))
+    parser.add_argument("--max-points", type=int, default=DEFAULT_MAX_POINTS, help="Maximum number of points per trace in large history mode (default is {})".format(DEFAULT_MAX_POINTS))
+    parser.add_argument("--rollup", choices=ROLLUP_PERIODS, help="Plot the minimum, median, maximum, and 95th percentile of every metric per day, week, or release tag instead of every build. auto uses days, or weeks if there would be more than --max-points days")
+    parser.add_argument("--release-tags", default="*", metavar="PATTERN", help="Glob pattern of the tags delimiting releases for --rollup tag (default is all tags)")
+    parser.add_argument("--regressions", metavar="REPORT", help="Detect regressions of image size, reachable methods, GC time and peak RSS, mark them in the graph, and write them as JSON report")
+    parser.add_argument("--regression-window", type=int, default=30, help="Number of previous builds forming the baseline of a build (default is 30)")
+    parser.add_argument("--regression-threshold", type=float, default=6.0, help="Robust standard deviations above the baseline that count as regression (default is 6)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with code 3 if a regression was detected")
+    parser.add_argument("--no-plot", action="store_true", help="Only detect regressions, do not create the graph")
+    parser.add_argument("--watch", action="store_true", help="Keep running and update the report whenever new builds of the branch land")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_WATCH_INTERVAL, help="Seconds between two checks for new builds in watch mode (default is {})".format(DEFAULT_WATCH_INTERVAL))
+    parser.add_argument("--batch", metavar="MANIFEST", help="Create the reports of all jobs in a JSON manifest instead, see batch.py for its format")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of processes creating reports in batch mode (default is the number of CPUs)")
+    parser.add_argument("--decode-jobs", type=int, default=os.cpu_count(), help="Number of processes decoding the metrics of {} or more builds (default is the number of CPUs)".format(PARALLEL_DECODE_BUILDS))
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Path of the decoded metrics cache (default is " + DEFAULT_CACHE_PATH + ")")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 1e6, help="Maximum size of the metrics cache in MB (default is {:.0f})".format(DEFAULT_MAX_BYTES / 1e6))
+    parser.add_argument("--no-cache", action="store_true", help="Decode every metrics blob again instead of using the cache")
+    parser.add_argument("--profile", nargs="?", const="", metavar="PATH", help="Record the time, counters, and peak memory of every stage and write them to PATH (default is output/profile_{metrics type}_{time}.json)")
+    parser.add_argument("--profile-format", choices=profiling.TRACE_FORMATS, default="json", help="Write the profile as JSON or as Chrome trace events for chrome://tracing (default is json)")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.batch is None and args.metrics_type is None:
+        parser.error("repo_path, branch, n, and metrics_type are required unless --batch is given")
+    if args.no_plot and args.regressions is None and not args.fail_on_regression:
+        parser.error("--no-plot requires --regressions or --fail-on-regression")
+    if args.watch and (args.batch is not None or args.warehouse is not None):
+        parser.error("--watch reads the repository directly and cannot be combined with --batch or --warehouse")
+    if args.rollup is not None and (args.watch or args.batch is not None or args.no_plot or args.regressions is not None or args.fail_on_regression):
+        parser.error("--rollup only plots and cannot be combined with --watch, --batch, --no-plot, or regression detection")
+    if args.profile is not None and args.batch is not None:
+        parser.error("--profile records a single report and cannot be combined with --batch")
+    return args
 
 def main():
+    # Heavy libraries are only imported on the paths that need them, so that --help and invalid arguments return at once
     args = parse_args()
+    if args.profile is not None:
+        profiling.start()
+        try:
+            run(args)
+        finally:
+            profiler = profiling.stop()
+            path = args.profile or profiling.default_path("output", str(args.metrics_type), args.profile_format)
+            profiler.write(path, args.profile_format)
+            print(profiler.summary())
+            print("Profile written to " + path)
+    else:
+        run(args)
+
+def run(args):
+    '''Creates the report(s) requested by the parsed arguments.'''
+
+    if args.batch is not None:
+        from batch import run_batch
+        cache_path = ":memory:" if args.no_cache else args.cache
+        results = run_batch(args.batch, "output", max(1, args.jobs), cache_path, int(args.cache_size * 1e6), args.image)
+        if any("error" in result for result in results):
+            sys.exit(1)
+        return
     
     repo_path = args.repo_path
     branch = args.branch
     n = args.n 
     metrics_type = args.metrics_type
 
-    if metrics_type not in ["image_details", "analysis_results", "resource_usage"]:
+    if metrics_type not in METRICS_TYPES:
         print("Metrics type unknown. Valid options are 'image_details', 'analysis_results', or 'resource_usage'")
         exit()
 
+    if args.watch:
+        with profiling.stage("imports"):
+            from watch import Watcher
+        # Watch mode resumes the branch scan from the cache, so it needs one even if only in memory
+        with MetricsCache(":memory:" if args.no_cache else args.cache, int(args.cache_size * 1e6)) as cache:
+            watcher = Watcher(repo_path, branch, int(n), metrics_type, cache, large_history=args.large_history, max_points=args.max_points,
+                              regressions_path=args.regressions, regression_window=args.regression_window,
+                              regression_threshold=args.regression_threshold, image_format=args.image)
+            watcher.run(args.watch_interval)
+        return
+
+    if args.rollup is not None:
+        plot_rollup(args)
+        return
+
+    with profiling.stage("imports"):
+        from history import load_history
+        from warehouse import Warehouse
+
+    cache = None if args.no_cache or args.warehouse else MetricsCache(args.cache, int(args.cache_size * 1e6))
+    warehouse = Warehouse(args.warehouse) if args.warehouse else None
     try:  
         n = int(n)  
-        build_data = load_data(repo_path, n, branch, metrics_type)
-        plot_data(build_data, branch, metrics_type)         
+        history = load_history(repo_path, n, branch, cache, warehouse=warehouse, jobs=args.decode_jobs)
+        print(history.report.summary())
+        regressions = None
+        if args.regressions is not None or args.fail_on_regression:
+            from regressions import find_regressions, write_report, print_regressions
+            with profiling.stage("regressions"):
+                regressions = find_regressions(history, args.regression_window, args.regression_threshold)
+            print_regressions(regressions)
+            if args.regressions is not None:
+                write_report(args.regressions, regressions, len(history), branch)
+        if not args.no_plot:
+            with profiling.stage("plot"):
+                from plot import plot_data
+                plot_data(history, branch, metrics_type, headless=args.headless, image_format=args.image,
+                          large_history=args.large_history, max_points=args.max_points, regressions=regressions)
 
     except Exception as e: 
         print("The following exception returned: ", e)
         raise
 
+    finally:
+        if cache is not None:
+            cache.close()
+            print(cache.summary())
+        if warehouse is not None:
+            warehouse.close()
+
+    if args.fail_on_regression and regressions:
+        print("Detected {} regressions".format(len(regressions)))
+        sys.exit(3)
+
+def plot_rollup(args):
+    '''Creates the report of a branch from its rollup, see rollups.py.'''
+
+    with profiling.stage("imports"):
+        from rollups import load_rollup
+        from warehouse import Warehouse
+
+    cache = None if args.no_cache or args.warehouse else MetricsCache(args.cache, int(args.cache_size * 1e6))
+    warehouse = Warehouse(args.warehouse) if args.warehouse else None
+    try:
+        rollup = load_rollup(args.repo_path, int(args.n), args.branch, args.rollup, cache, args.release_tags, args.max_points, warehouse=warehouse,
+                             jobs=args.decode_jobs)
+        print("Rolled up {} builds into {} buckets ({} unchanged since the last run)".format(rollup.builds, len(rollup), rollup.reused))
+        with profiling.stage("plot"):
+            from plot import plot_data
+            plot_data(rollup, args.branch, args.metrics_type, headless=args.headless, image_format=args.image)
+    finally:
+        if cache is not None:
+            cache.close()
+            print(cache.summary())
+        if warehouse is not None:
+            warehouse.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
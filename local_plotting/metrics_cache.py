@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+'''
+Persistent cache of decoded graalvm-metrics blobs.
+
+A refs/graalvm-metrics/<sha> blob never changes once it has been written, so its parsed record can be stored under
+the blob sha (and the commit sha it belongs to) and reused by every later run. The cache is a single SQLite file whose
+total size is bounded by evicting the least recently used records. New records are buffered in memory and written in one
+short transaction by flush(), so that several processes can share the same file. The scans of branches and their
+rollups (see rollups.py) are kept next to the records, so that later runs only visit and aggregate what is new, together
+with the metrics refs of every repository, so that refs added since a scan can be told apart.
+'''
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "build-tracking", "metrics.sqlite")
+DEFAULT_MAX_BYTES = 256 * 1000000
+
+class MetricsCache:
+    '''Content-addressed store of parsed metrics records with size-bounded LRU eviction. Safe to share between threads.'''
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._touched = set()
+        self._pending_blobs = {}
+        self._pending_commits = {}
+        self._pending_scans = {}
+        self._pending_rollups = {}
+        self._pending_refs = []
+        self._removed_refs = []
+        self._refs = {}
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS blobs (
+                blob_sha TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                raw_size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+            CREATE TABLE IF NOT EXISTS commits (
+                commit_sha TEXT PRIMARY KEY,
+                blob_sha TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS scans (
+                repo_path TEXT NOT NULL,
+                branch TEXT NOT NULL,
+                scan TEXT NOT NULL,
+                PRIMARY KEY (repo_path, branch)
+            );
+            CREATE TABLE IF NOT EXISTS rollups (
+                repo_path TEXT NOT NULL,
+                branch TEXT NOT NULL,
+                period TEXT NOT NULL,
+                rollup TEXT NOT NULL,
+                PRIMARY KEY (repo_path, branch, period)
+            );
+            CREATE TABLE IF NOT EXISTS metrics_refs (
+                repo_path TEXT NOT NULL,
+                commit_sha TEXT NOT NULL,
+                generation INTEGER NOT NULL,
+                PRIMARY KEY (repo_path, commit_sha)
+            );
+        ''')
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _lookup(self, column, sha):
+        with self._lock:
+            blob_sha = sha if column == "blob_sha" else self._pending_commits.get(sha)
+            if blob_sha in self._pending_blobs:
+                record, raw_size = self._pending_blobs[blob_sha]
+            else:
+                if column == "blob_sha":
+                    query = "SELECT blob_sha, record, raw_size FROM blobs WHERE blob_sha = ?"
+                else:
+                    query = "SELECT b.blob_sha, b.record, b.raw_size FROM commits c JOIN blobs b ON b.blob_sha = c.blob_sha WHERE c.commit_sha = ?"
+                row = self._db.execute(query, (sha,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                blob_sha, record, raw_size = row
+                self._touched.add(blob_sha)
+            self.hits += 1
+            self.bytes_saved += raw_size
+        return json.loads(record)
+
+    def get_by_blob(self, blob_sha):
+        '''Returns the parsed record of a metrics blob, or None if it is not cached.'''
+
+        return self._lookup("blob_sha", str(blob_sha))
+
+    def get_by_commit(self, commit_sha):
+        '''Returns the parsed record of the metrics blob written for a commit, or None if it is not cached.'''
+
+        return self._lookup("commit_sha", str(commit_sha))
+
+    def put(self, blob_sha, record, raw_size, commit_sha=None):
+        '''Stores the parsed record of a blob. raw_size is the size of the undecoded blob, used to report bytes saved.'''
+
+        blob_sha = str(blob_sha)
+        with self._lock:
+            self._pending_blobs[blob_sha] = (json.dumps(record, separators=(",", ":")), raw_size)
+            if commit_sha is not None:
+                self._pending_commits[str(commit_sha)] = blob_sha
+
+    def get_scan(self, repo_path, branch):
+        '''Returns the last history scan stored for a branch as a dict with the keys tip, builds (newest first),
+        exhausted, and refs_generation (the generation of the metrics refs it saw, see sync_refs), or None if the branch
+        was never scanned.'''
+
+        key = (os.path.abspath(repo_path), branch)
+        with self._lock:
+            if key in self._pending_scans:
+                return json.loads(self._pending_scans[key])
+            row = self._db.execute("SELECT scan FROM scans WHERE repo_path = ? AND branch = ?", key).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_scan(self, repo_path, branch, tip, builds, exhausted, refs_generation):
+        '''Stores the result of a history scan so that the next run only has to visit commits added after tip.'''
+
+        scan = {"tip": tip, "builds": builds, "exhausted": exhausted, "refs_generation": refs_generation}
+        with self._lock:
+            self._pending_scans[(os.path.abspath(repo_path), branch)] = json.dumps(scan, separators=(",", ":"))
+
+    def sync_refs(self, repo_path, shas):
+        '''Records the commit shas that have a metrics ref in a repository now. Returns the current generation of the refs
+        and a dict of commit sha -> generation in which its ref was first recorded. Every sync that finds new refs starts
+        a generation, refs that were removed are forgotten and count as new if they reappear.'''
+
+        repo_path = os.path.abspath(repo_path)
+        with self._lock:
+            if repo_path not in self._refs:
+                self._refs[repo_path] = dict(self._db.execute("SELECT commit_sha, generation FROM metrics_refs WHERE repo_path = ?", (repo_path,)))
+            generations = self._refs[repo_path]
+            generation = max(generations.values(), default=0)
+            added = [sha for sha in shas if sha not in generations]
+            removed = [sha for sha in generations if sha not in shas]
+            for sha in removed:
+                del generations[sha]
+            self._removed_refs += [(repo_path, sha) for sha in removed]
+            if added:
+                generation += 1
+                generations.update(dict.fromkeys(added, generation))
+                self._pending_refs += [(repo_path, sha, generation) for sha in added]
+        return generation, generations
+
+    def get_rollup(self, repo_path, branch, period):
+        '''Returns the rollup of a branch stored by put_rollup, or None.'''
+
+        key = (os.path.abspath(repo_path), branch, period)
+        with self._lock:
+            if key in self._pending_rollups:
+                return json.loads(self._pending_rollups[key])
+            row = self._db.execute("SELECT rollup FROM rollups WHERE repo_path = ? AND branch = ? AND period = ?", key).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_rollup(self, repo_path, branch, period, rollup):
+        '''Stores the rollup of a branch as returned by Rollup.to_json, replacing the previous one.'''
+
+        with self._lock:
+            self._pending_rollups[(os.path.abspath(repo_path), branch, period)] = json.dumps(rollup, separators=(",", ":"))
+
+    def flush(self):
+        '''Writes the access times of this run's hits, evicts records beyond max_bytes, and commits. Returns the number evicted.'''
+
+        with self._lock:
+            now = time.time()
+            self._db.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                                 [(sha, record, raw_size, now) for sha, (record, raw_size) in self._pending_blobs.items()])
+            self._db.executemany("INSERT OR REPLACE INTO commits VALUES (?, ?)", self._pending_commits.items())
+            self._db.executemany("INSERT OR REPLACE INTO scans VALUES (?, ?, ?)", [key + (scan,) for key, scan in self._pending_scans.items()])
+            self._db.executemany("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?)", [key + (rollup,) for key, rollup in self._pending_rollups.items()])
+            self._db.executemany("DELETE FROM metrics_refs WHERE repo_path = ? AND commit_sha = ?", self._removed_refs)
+            self._db.executemany("INSERT OR IGNORE INTO metrics_refs VALUES (?, ?, ?)", self._pending_refs)
+            self._db.executemany("UPDATE blobs SET last_used = ? WHERE blob_sha = ?", [(now, sha) for sha in self._touched])
+            self._pending_blobs.clear()
+            self._pending_commits.clear()
+            self._pending_scans.clear()
+            self._pending_rollups.clear()
+            self._removed_refs.clear()
+            self._pending_refs.clear()
+            self._touched.clear()
+            total = self._db.execute("SELECT COALESCE(SUM(LENGTH(record)), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                self._db.commit()
+                return 0
+            victims = []
+            for blob_sha, size in self._db.execute("SELECT blob_sha, LENGTH(record) FROM blobs ORDER BY last_used"):
+                if total <= self.max_bytes:
+                    break
+                victims.append((blob_sha,))
+                total -= size
+            self._db.executemany("DELETE FROM blobs WHERE blob_sha = ?", victims)
+            self._db.execute("DELETE FROM commits WHERE blob_sha NOT IN (SELECT blob_sha FROM blobs)")
+            self._db.commit()
+            return len(victims)
+
+    def summary(self):
+        '''Returns a one-line report of the cache efficiency of this run.'''
+
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        return "Metrics cache: {} hits, {} misses ({:.0f}% hit rate), {:.2f} MB not re-read".format(self.hits, self.misses, rate, self.bytes_saved / 1e6)
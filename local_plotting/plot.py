@@ -1,14 +1,43 @@
+import os
+import time
 from datetime import datetime
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 import plotly.subplots as sp
+import profiling
+from downsample import downsample
+from history import BuildHistory
+from rollups import Rollup
+from regressions import WATCHED_METRICS
+from defaults import LARGE_HISTORY_BUILDS, DEFAULT_MAX_POINTS
 
-def plot_data(build_data, branch, metrics_type):
-    '''Creates plotly graph as html file. Requires the build data as pandas data frames as well as user's arguments.'''
-    # Get current date and time
-    current_datetime = datetime.now().strftime('%Y%m%d_%H%M%S')
+def plot_data(build_data, branch, metrics_type, show=True, output_dir="output", headless=False, image_format=None,
+              large_history=None, max_points=DEFAULT_MAX_POINTS, regressions=None, file_name=None):
+    '''Creates plotly graph as html file and returns its path. Requires the build data as pandas data frames as well as user's arguments.
+    In headless mode the graph is not shown and the html file references one plotly.min.js shared by the output directory
+    instead of embedding it. image_format ('png' or 'svg') additionally exports a static image. large_history plots
+    downsampled WebGL traces of at most max_points points each, by default for more than LARGE_HISTORY_BUILDS builds.
+    regressions found by regressions.find_regressions are marked in the graph. file_name replaces the default
+    timestamped name of the html file. build_data may also be a BuildHistory, whose arrays a large history is plotted
+    from directly, or a Rollup of a long history, which is plotted per bucket.'''
+
+    start = time.perf_counter()
+    if isinstance(build_data, Rollup):
+        return save_figure(plot_rollup(build_data, branch, metrics_type), branch, metrics_type, show and not headless,
+                           output_dir, headless, image_format, start, file_name)
+
+    builds = len(build_data[0] if isinstance(build_data, list) else build_data)
+    if large_history is None:
+        large_history = builds > LARGE_HISTORY_BUILDS
+    if isinstance(build_data, BuildHistory) and not large_history:
+        build_data = build_data.frame(metrics_type)
 
     # Distinguish between different metrics types to be plotted
-    if metrics_type == "image_details":
+    if large_history:
+        fig = plot_large_history(build_data, branch, metrics_type, max_points)
+
+    elif metrics_type == "image_details":
 
         fig = go.Figure()
 
@@ -26,14 +55,9 @@ def plot_data(build_data, branch, metrics_type):
         fig.update_traces(hovertemplate='<b>Commit Message:</b> %{text[0]}<br><b>Commit Sha:</b> %{text[1]}<br><b>Commit Time:</b> %{x}<br><b>Other (MB):</b> %{y}')
         
         # Customize layout
-        y_range = [-1, max(build_data["Image Size"]) + 1] 
+        y_range = axis_range(build_data["Image Size"], -1, 1)
         fig.update_layout(title='Native Image Size History of Branch: ' + '\'' + branch +'\'', xaxis_title='Commit Dates', yaxis_title='Size in MB', yaxis=dict(range=y_range))
 
-        # Show the interactive plot and save to html
-        fig.show()
-        fig.write_html("output/image_details_" + branch + "_{}.html".format(current_datetime))
-        print("Successfully created 'image_details_" + branch + "_{}.html' under local_plotting/output".format(current_datetime))
-
     elif metrics_type == "analysis_results":
 
         # Create subplot grid with 2 rows and 2 columns
@@ -46,17 +70,13 @@ def plot_data(build_data, branch, metrics_type):
         create_analysis_results_subplot(fig, 3, build_data)
 
         # Update y-axis range for each subplot
-        fig.update_yaxes(range=[-300, max(build_data[0]["Total"]) + 500], row=1, col=1)
-        fig.update_yaxes(range=[-3000, max(build_data[1]["Total"]) + 5000], row=1, col=2)
-        fig.update_yaxes(range=[-300, max(build_data[2]["Total"]) + 500], row=2, col=1)
-        fig.update_yaxes(range=[-300, max(build_data[3]["Total"]) + 500], row=2, col=2)
+        fig.update_yaxes(range=axis_range(build_data[0]["Total"], -300, 500), row=1, col=1)
+        fig.update_yaxes(range=axis_range(build_data[1]["Total"], -3000, 5000), row=1, col=2)
+        fig.update_yaxes(range=axis_range(build_data[2]["Total"], -300, 500), row=2, col=1)
+        fig.update_yaxes(range=axis_range(build_data[3]["Total"], -300, 500), row=2, col=2)
 
         # Update layout 
         fig.update_layout(title_text='Build Analysis Results of Branch: ' + '\'' + branch +'\'', yaxis_title='Amount')
-        fig.show()
-        fig.write_html("output/analysis_results_" + branch + "_{}.html".format(current_datetime))
-  
-        print("Successfully created 'analysis_results_" + branch + "_{}.html' under local_plotting/output".format(current_datetime))
 
     elif metrics_type == "resource_usage":
         # Create subplot grid with 2 rows and 2 columns
@@ -82,17 +102,202 @@ def plot_data(build_data, branch, metrics_type):
         fig.update_traces(hovertemplate='<b>Commit Message:</b> %{text[0]}<br><b>Commit Sha:</b> %{text[1]}<br><b>Commit Time:</b> %{x}<br><b>CPU Load:</b> %{y}<br><b>Total Cores:</b> %{text[2]}', row=2, col=2)
 
         # Update y-axis range for each subplot
-        fig.update_yaxes(range=[-0.5, max(build_data["GC Time"]) + 1], title_text="GC Time (s)", row=1, col=1)
-        fig.update_yaxes(range=[-30, max(build_data["GC Count"]) + 100],title_text="GC Count", row=1, col=2)
-        fig.update_yaxes(range=[-100, max(build_data["Peak RSS"]) + 100],title_text="Peak RSS (MB)", row=2, col=1)
-        fig.update_yaxes(range=[-0.5, max(build_data["CPU Load"]) + 1],title_text="CPU Load", row=2, col=2)
+        fig.update_yaxes(range=axis_range(build_data["GC Time"], -0.5, 1), title_text="GC Time (s)", row=1, col=1)
+        fig.update_yaxes(range=axis_range(build_data["GC Count"], -30, 100),title_text="GC Count", row=1, col=2)
+        fig.update_yaxes(range=axis_range(build_data["Peak RSS"], -100, 100),title_text="Peak RSS (MB)", row=2, col=1)
+        fig.update_yaxes(range=axis_range(build_data["CPU Load"], -0.5, 1),title_text="CPU Load", row=2, col=2)
         
         # Update layout 
         fig.update_layout(title_text='Resource Usage of Branch: ' + '\'' + branch +'\'', showlegend=False)
+
+    if regressions:
+        annotate_regressions(fig, build_data, metrics_type, regressions, large_history)
+
+    # Show the interactive plot and save to html
+    return save_figure(fig, branch, metrics_type, show and not headless, output_dir, headless, image_format, start, file_name)
+
+def axis_range(column, low, margin):
+    '''Returns the y axis range from low to the largest value of the column plus margin, ignoring builds without the
+    metric (NaN). Returns None, i.e. autorange, if no build has the metric.'''
+
+    top = pd.Series(column, dtype=float).max()
+    return None if pd.isna(top) else [low, top + margin]
+
+# Subplots of the large history mode as (title, index of the data frame or None, [(column, unit)])
+LARGE_HISTORY_LAYOUTS = {
+    "image_details": [("Native Image Size History", None, [("Image Size", "MB"), ("Code Area Size", "MB"), ("Image Heap Size", "MB"), ("Other", "MB")])],
+    "analysis_results": [(title, index, [("Total", ""), ("Reflection", ""), ("JNI", ""), ("Reachable", "")])
+                         for index, title in enumerate(["Types", "Methods", "Classes", "Fields"])],
+    "resource_usage": [("GC Time", None, [("GC Time", "s")]), ("GC Count", None, [("GC Count", "")]),
+                       ("Peak RSS", None, [("Peak RSS", "MB")]), ("CPU Load", None, [("CPU Load", "")])],
+}
+
+def plot_large_history(build_data, branch, metrics_type, max_points):
+    '''Creates the figure of a long history from WebGL traces, each downsampled to at most max_points points that keep
+    its shape and largest jumps. Commit messages are stored once per subplot in an invisible hover trace instead of
+    once per trace and point.'''
+
+    layout = LARGE_HISTORY_LAYOUTS[metrics_type]
+    colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728']
+    if len(layout) == 1:
+        fig = go.Figure()
+        positions = [(None, None)]
+    else:
+        fig = sp.make_subplots(rows=2, cols=2, subplot_titles=[title for title, _, _ in layout])
+        positions = [(1, 1), (1, 2), (2, 1), (2, 2)]
+
+    history = build_data if isinstance(build_data, BuildHistory) else None
+    for (title, index, series), (row, col) in zip(layout, positions):
+        frame = build_data[index] if index is not None and history is None else build_data
+        if history is not None:
+            dates = history.datetimes()
+        else:
+            dates = pd.to_datetime(frame["Commit Date"], format='%d.%m.%y, %H:%M').to_numpy()
+        x = dates.astype("datetime64[s]").astype(np.float64)
+        shown = []
+        for color_index, (column, unit) in enumerate(series):
+            if history is not None:
+                y = history.frame_column(metrics_type, index, column)
+            else:
+                y = frame[column].to_numpy(dtype=np.float64)
+            selected = downsample(x, y, max_points)
+            shown.append(selected)
+            fig.add_trace(go.Scattergl(x=dates[selected], y=y[selected], mode='lines+markers', name=column,
+                                       marker=dict(size=3, color=colors[color_index]), line=dict(width=1, color=colors[color_index]),
+                                       showlegend=len(series) > 1 and (index or 0) == 0,
+                                       hovertemplate=column + ': %{y:.2f} ' + unit + '<extra></extra>'), row=row, col=col)
+
+        # One hover label per commit that is shown in any trace of this subplot
+        selected = np.unique(np.concatenate(shown))
+        if history is not None:
+            messages, shas = history.commit_messages(selected), history.commit_shas(selected)
+        else:
+            messages = frame["Commit Message"].to_numpy()[selected]
+            shas = frame["Commit Sha"].to_numpy()[selected]
+        hover = [sha[:10] + " " + message.split("\n", 1)[0][:80] for sha, message in zip(shas, messages)]
+        fig.add_trace(go.Scattergl(x=dates[selected], y=np.zeros(len(selected)), mode='markers', marker=dict(opacity=0),
+                                   showlegend=False, text=hover, hovertemplate='%{text}<extra></extra>'), row=row, col=col)
+
+    fig.update_layout(title_text=metrics_type.replace("_", " ").title() + ' of Branch: ' + '\'' + branch + '\' (' + str(len(dates)) + ' builds)',
+                      hovermode='x unified')
+    return fig
+
+def plot_rollup(rollup, branch, metrics_type):
+    '''Creates the figure of a long history from its rollup: per bucket the median of every metric as line, the range
+    from minimum to maximum as band around it, and the 95th percentile as dotted line. Days and weeks are placed on a
+    time axis, releases are placed side by side.'''
+
+    layout = LARGE_HISTORY_LAYOUTS[metrics_type]
+    colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728']
+    if len(layout) == 1:
+        fig = go.Figure()
+        positions = [(None, None)]
+    else:
+        fig = sp.make_subplots(rows=2, cols=2, subplot_titles=[title for title, _, _ in layout])
+        positions = [(1, 1), (1, 2), (2, 1), (2, 2)]
+
+    x = rollup.labels if rollup.period == "tag" else rollup.starts()
+    for (title, index, series), (row, col) in zip(layout, positions):
+        for color_index, (column, unit) in enumerate(series):
+            stats = rollup.column_statistics(metrics_type, index, column)
+            color = colors[color_index]
+            band = 'rgba({}, {}, {}, 0.15)'.format(int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16))
+            showlegend = len(series) > 1 and (index or 0) == 0
+            # The band is filled from the minimum up to the maximum trace added before it
+            fig.add_trace(go.Scatter(x=x, y=stats[:, 2], mode='lines', line=dict(width=0), legendgroup=column,
+                                     showlegend=False, hoverinfo='skip'), row=row, col=col)
+            fig.add_trace(go.Scatter(x=x, y=stats[:, 0], mode='lines', line=dict(width=0), fill='tonexty', fillcolor=band,
+                                     legendgroup=column, showlegend=False, hoverinfo='skip'), row=row, col=col)
+            fig.add_trace(go.Scatter(x=x, y=stats[:, 3], mode='lines', line=dict(width=1, dash='dot', color=color),
+                                     legendgroup=column, showlegend=False, hoverinfo='skip'), row=row, col=col)
+            fig.add_trace(go.Scatter(x=x, y=stats[:, 1], mode='lines+markers', name=column, legendgroup=column,
+                                     marker=dict(size=4, color=color), line=dict(width=1, color=color), showlegend=showlegend,
+                                     customdata=np.column_stack((stats.astype(object), rollup.counts.astype(object), np.array(rollup.labels, dtype=object))),
+                                     hovertemplate='<b>%{customdata[5]}</b> (%{customdata[4]} builds)<br>' + column + ' median %{y:.2f} ' + unit +
+                                                   ', min %{customdata[0]:.2f}, p95 %{customdata[3]:.2f}, max %{customdata[2]:.2f}<extra></extra>'),
+                          row=row, col=col)
+
+    periods = {"day": "daily", "week": "weekly", "tag": "release"}
+    fig.update_layout(title_text=metrics_type.replace("_", " ").title() + ' of Branch: ' + '\'' + branch + '\' (' + str(rollup.builds) +
+                                 ' builds in ' + str(len(rollup)) + ' ' + periods[rollup.period] + ' buckets, median with min to max range and p95)')
+    return fig
+
+def annotate_regressions(fig, build_data, metrics_type, regressions, large_history):
+    '''Marks the regressions of the plotted metrics type with red crosses on the series they were found in.'''
+
+    layout = LARGE_HISTORY_LAYOUTS[metrics_type]
+    positions = [(None, None)] if len(layout) == 1 else [(1, 1), (1, 2), (2, 1), (2, 2)]
+    subplots = {(index, column): position for (_, index, series), position in zip(layout, positions) for column, _ in series}
+    columns = {metric: (index, column) for watched_type, index, column, metric in WATCHED_METRICS if watched_type == metrics_type}
+
+    for (index, column), (row, col) in subplots.items():
+        found = [regression for regression in regressions if columns.get(regression["metric"]) == (index, column)]
+        if not found:
+            continue
+        builds = [regression["build"] for regression in found]
+        if isinstance(build_data, BuildHistory):
+            x = build_data.datetimes(builds)
+        else:
+            frame = build_data[index] if index is not None else build_data
+            x = frame["Commit Date"].iloc[builds]
+            if large_history:
+                x = pd.to_datetime(x, format='%d.%m.%y, %H:%M')
+        fig.add_trace(go.Scatter(x=x, y=[regression["value"] for regression in found], mode='markers', name='Regression',
+                                 marker=dict(symbol='x', size=12, color='red'), showlegend=False,
+                                 text=["+{:.1f}% {}".format(regression["change_percent"], regression["metric"]) for regression in found],
+                                 hovertemplate='<b>Regression:</b> %{text}<extra></extra>'), row=row, col=col)
+
+def plot_comparison(base_series, branch_series, base, metric, show=True, output_dir="output", headless=False, image_format=None):
+    '''Overlays one metric of several branches on the history of their base and saves the figure like plot_data.
+    Each series is a tuple of commit times (epoch seconds), values, and commit shas. A branch series starts with the
+    build at its merge base, so that its line branches off the base line.'''
+
+    start = time.perf_counter()
+    fig = go.Figure()
+    times, values, shas = base_series
+    fig.add_trace(go.Scatter(x=pd.to_datetime(times, unit='s'), y=values, mode='lines+markers', name=base,
+                             line=dict(color='black', width=2), text=[sha[:10] for sha in shas],
+                             hovertemplate='<b>' + base + '</b> %{text}<br>%{x}<br>' + metric + ': %{y:.2f}<extra></extra>'))
+    for branch, (times, values, shas) in branch_series.items():
+        fig.add_trace(go.Scatter(x=pd.to_datetime(times, unit='s'), y=values, mode='lines+markers', name=branch,
+                                 line=dict(width=1), text=[sha[:10] for sha in shas],
+                                 hovertemplate='<b>' + branch + '</b> %{text}<br>%{x}<br>' + metric + ': %{y:.2f}<extra></extra>'))
+
+    fig.update_layout(title_text=metric + ' of ' + str(len(branch_series)) + ' Branches Compared with ' + '\'' + base + '\'',
+                      xaxis_title='Commit Dates', yaxis_title=metric)
+    return save_figure(fig, base, "comparison", show and not headless, output_dir, headless, image_format, start)
+
+def save_figure(fig, branch, metrics_type, show, output_dir, headless=False, image_format=None, start=None, file_name=None):
+    '''Optionally shows the figure and writes it to {metrics_type}_{branch}_{time}.html (or file_name) in output_dir.
+    Prints the generation time and size of the report. Returns the path of the file.'''
+
+    if file_name is None:
+        # Get current date and time
+        current_datetime = datetime.now().strftime('%Y%m%d_%H%M%S')
+        file_name = metrics_type + "_" + branch.replace("/", "_") + "_{}.html".format(current_datetime)
+    path = os.path.join(output_dir, file_name)
+    if start is None:
+        start = time.perf_counter()
+
+    if show:
         fig.show()
-        fig.write_html("output/resource_usage_" + branch + "_{}.html".format(current_datetime))
+    os.makedirs(output_dir, exist_ok=True)
+    with profiling.stage("write report"):
+        # plotly copies plotly.min.js into the output directory only if it is not there yet
+        fig.write_html(path, include_plotlyjs="directory" if headless else True)
+        size = os.path.getsize(path)
+
+        if image_format is not None:
+            image_path = os.path.splitext(path)[0] + "." + image_format
+            try:
+                fig.write_image(image_path, format=image_format, width=1600, height=900)
+                size += os.path.getsize(image_path)
+            except Exception as e:
+                print("Could not export a static " + image_format + " image, it requires the kaleido package: ", e)
+    profiling.count("report_bytes", size)
 
-        print("Successfully created 'resource_usage_" + branch + "_{}.html' under local_plotting/output".format(current_datetime))
+    print("Successfully created '" + file_name + "' under " + output_dir + " ({:.2f} MB in {:.2f}s)".format(size / 1e6, time.perf_counter() - start))
+    return path
 
 def create_analysis_results_subplot(fig, index, build_data):
     '''Create a sub plot showing the development of one native image build's analysis results aspect.'''
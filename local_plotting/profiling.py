@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+'''
+Optional profiling of a run: wall time and peak memory of its stages, and counters such as HTTP requests, ref lookups,
+blobs decoded, and bytes read.
+
+The pipeline marks its stages with stage(name) and its work with count(name, amount). Unless start() was called, both
+return at once without recording anything, so the instrumentation can stay in hot paths. The profile is written as JSON
+or as Chrome trace events, which chrome://tracing and https://ui.perfetto.dev display as a timeline.
+
+Example:
+    profiling.start()
+    with profiling.stage("decode"):
+        profiling.count("blobs_decoded")
+    profiling.stop().write("profile.json")
+'''
+
+TRACE_FORMATS = ["json", "chrome"]
+
+_active = None
+_NO_STAGE = nullcontext()
+
+def peak_rss_mb():
+    '''Returns the peak resident set size of this process in MB, or None where the platform does not report it.'''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+class Profiler:
+    '''Records stages and counters of one run. Counters may be increased from any thread.'''
+
+    def __init__(self):
+        from datetime import datetime, timezone
+
+        self.started_at = datetime.now(timezone.utc)
+        self.counters = {}
+        self.stages = []
+        self.total_secs = None
+        self._start = time.perf_counter()
+        self._depth = threading.local()
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name):
+        '''Records the wall time, the counters increased, and the peak RSS at the end of the enclosed code. Stages may
+        be nested, their depth is recorded per thread.'''
+
+        depth = getattr(self._depth, "value", 0)
+        self._depth.value = depth + 1
+        with self._lock:
+            before = dict(self.counters)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._depth.value = depth
+            with self._lock:
+                counters = {name: value - before.get(name, 0) for name, value in self.counters.items() if value != before.get(name, 0)}
+                self.stages.append({"name": name, "start_secs": start - self._start, "secs": end - start, "depth": depth,
+                                    "thread": threading.get_ident(), "counters": counters, "peak_rss_mb": peak_rss_mb()})
+
+    def finish(self):
+        if self.total_secs is None:
+            self.total_secs = time.perf_counter() - self._start
+        return self
+
+    def to_json(self):
+        return {"command": sys.argv, "started_at": self.started_at.isoformat(), "total_secs": self.total_secs,
+                "peak_rss_mb": peak_rss_mb(), "counters": dict(self.counters),
+                "stages": sorted(self.stages, key=lambda stage: stage["start_secs"])}
+
+    def to_chrome_trace(self):
+        '''Returns the profile as Chrome trace events: one complete event per stage with its counters as arguments, and
+        the final counters as counter event at the end of the run.'''
+
+        pid = os.getpid()
+        events = [{"name": stage["name"], "cat": "stage", "ph": "X", "pid": pid, "tid": stage["thread"],
+                   "ts": stage["start_secs"] * 1e6, "dur": stage["secs"] * 1e6,
+                   "args": dict(stage["counters"], peak_rss_mb=stage["peak_rss_mb"])} for stage in self.stages]
+        events.append({"name": "counters", "ph": "C", "pid": pid, "tid": threading.get_ident(),
+                       "ts": (self.total_secs or 0) * 1e6, "args": dict(self.counters)})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"command": " ".join(sys.argv), "started_at": self.started_at.isoformat()}}
+
+    def write(self, path, trace_format="json"):
+        self.finish()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as profile_file:
+            json.dump(self.to_chrome_trace() if trace_format == "chrome" else self.to_json(), profile_file, indent=2)
+
+    def summary(self):
+        '''Returns the stages and counters as printable table.'''
+
+        self.finish()
+        lines = ["Profile of {:.2f}s, peak RSS {:.0f} MB".format(self.total_secs, peak_rss_mb() or 0)]
+        for stage in sorted(self.stages, key=lambda stage: stage["start_secs"]):
+            lines.append("  {:<28} {:8.3f}s  peak RSS {:6.0f} MB".format("  " * stage["depth"] + stage["name"], stage["secs"], stage["peak_rss_mb"] or 0))
+        if self.counters:
+            lines.append("  " + ", ".join("{} {}".format(name, value) for name, value in sorted(self.counters.items())))
+        return "\n".join(lines)
+
+def start():
+    '''Activates a new profiler for this process and returns it.'''
+
+    global _active
+    _active = Profiler()
+    return _active
+
+def stop():
+    '''Deactivates the profiler and returns it, or None if none was active.'''
+
+    global _active
+    profiler, _active = _active, None
+    return profiler.finish() if profiler is not None else None
+
+def stage(name):
+    return _NO_STAGE if _active is None else _active.stage(name)
+
+def count(name, amount=1):
+    if _active is not None:
+        _active.count(name, amount)
+
+def default_path(output_dir, name, trace_format="json"):
+    '''Returns the path of a new profile next to the reports in output_dir.'''
+
+    from datetime import datetime
+
+    suffix = ".trace.json" if trace_format == "chrome" else ".json"
+    return os.path.join(output_dir, "profile_" + name + "_" + datetime.now().strftime('%Y%m%d_%H%M%S') + suffix)
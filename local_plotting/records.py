@@ -0,0 +1,143 @@
+import profiling
+
+'''
+The known metrics of a graalvm-metrics record and the validation of parsed records, shared by the local tools and
+RemoteBuildTracking.py. Kept free of pygit2, NumPy, and pandas so that the remote script does not load them to decode
+the records it fetched.
+
+A record that is not a JSON object, or that has metrics of the wrong type, is malformed. A record that lacks families
+or metrics, e.g. a truncated report or one written before a metric was added, is incomplete. Builds whose metrics
+cannot be read at all are skipped. DecodeReport counts them and keeps the problem of every build.
+'''
+
+ANALYSIS_RESULTS_ASPECTS = ["types", "methods", "classes", "fields"]
+# Errors listed by DecodeReport.summary, all of them are kept
+LISTED_ERRORS = 5
+NAN = float("nan")
+
+# Numeric metrics as (column, path in the metrics record, scale). Sizes are converted from bytes to MB.
+NUMERIC_METRICS = {
+    "image_details": [
+        ("Image Size", ("image_details", "total_bytes"), 1e-6),
+        ("Code Area Size", ("image_details", "code_area", "bytes"), 1e-6),
+        ("Image Heap Size", ("image_details", "image_heap", "bytes"), 1e-6),
+    ],
+    "analysis_results": [
+        (aspect + " " + column, ("analysis_results", aspect, key), 1)
+        for aspect in ANALYSIS_RESULTS_ASPECTS
+        for column, key in [("Total", "total"), ("Reflection", "reflection"), ("JNI", "jni"), ("Reachable", "reachable")]
+    ],
+    "resource_usage": [
+        ("GC Time", ("resource_usage", "garbage_collection", "total_secs"), 1),
+        ("GC Count", ("resource_usage", "garbage_collection", "count"), 1),
+        ("Peak RSS", ("resource_usage", "memory", "peak_rss_bytes"), 1e-6),
+        ("CPU Load", ("resource_usage", "cpu", "load"), 1),
+        ("Total Cores", ("resource_usage", "cpu", "total_cores"), 1),
+    ],
+}
+
+# Descriptive metrics as (column, path in the metrics record)
+TEXT_METRICS = {
+    "general_info": [
+        ("Name", ("general_info", "name")),
+        ("Java Version", ("general_info", "java_version")),
+        ("Vendor Version", ("general_info", "vendor_version")),
+        ("GraalVM Version", ("general_info", "graalvm_version")),
+        ("Garbage Collector", ("general_info", "garbage_collector")),
+        ("C Compiler", ("general_info", "c_compiler")),
+    ],
+}
+
+NUMERIC_PATHS = [path for family in NUMERIC_METRICS.values() for _, path, _ in family]
+TEXT_PATHS = [path for family in TEXT_METRICS.values() for _, path in family]
+
+def find_metric(record, path, problems, missing):
+    '''Returns the value at path in a parsed metrics record, or None if it is missing. A part of the path that is not
+    an object is added to problems, the first part that is absent (or null) to missing.'''
+
+    value = record
+    for depth, key in enumerate(path):
+        if not isinstance(value, dict):
+            if value is not None:
+                problems[".".join(path[:depth])] = "is not an object"
+            return None
+        value = value.get(key)
+        if value is None:
+            missing[".".join(path[:depth + 1])] = True
+            return None
+    return value
+
+def record_values(record):
+    '''Validates a parsed metrics record against the known metric families. Returns its numeric metrics in the order
+    of NUMERIC_METRICS (unscaled, NaN where missing), its descriptive metrics in the order of TEXT_METRICS (None where
+    missing), a description of every metric of the wrong type, which is treated as missing, and the names of the parts
+    that the record lacks: a whole family such as resource_usage, an object such as image_details.image_heap, or a
+    single metric.'''
+
+    if not isinstance(record, dict):
+        return [NAN] * len(NUMERIC_PATHS), [None] * len(TEXT_PATHS), ["the metrics are not a JSON object"], []
+    problems = {}
+    missing = {}
+    values = []
+    for path in NUMERIC_PATHS:
+        value = find_metric(record, path, problems, missing)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            problems[".".join(path)] = "is not a number"
+            value = None
+        values.append(NAN if value is None else value)
+    texts = []
+    for path in TEXT_PATHS:
+        value = find_metric(record, path, problems, missing)
+        if isinstance(value, (dict, list)):
+            problems[".".join(path)] = "is not a single value"
+            value = None
+        texts.append(value)
+    return values, texts, [name + " " + problem for name, problem in problems.items()], list(missing)
+
+class DecodeReport:
+    '''Numbers of builds decoded completely, incomplete, skipped, and malformed, and the problem of every build that
+    was not decoded completely as (commit sha, "incomplete", "skipped", or "malformed", description).'''
+
+    def __init__(self):
+        self.decoded = 0
+        self.incomplete = 0
+        self.skipped = 0
+        self.malformed = 0
+        self.errors = []
+
+    def add(self, sha, problem):
+        '''Counts one build with its problem as returned by decode_record, or None.'''
+
+        if problem is None:
+            self.decoded += 1
+            return
+        kind, description = problem
+        setattr(self, kind, getattr(self, kind) + 1)
+        self.errors.append((sha, kind, description))
+        profiling.count("builds_" + kind)
+
+    def summary(self):
+        '''Returns the counts and the first errors as printable text.'''
+
+        lines = ["Decoded {} builds, {} incomplete, skipped {} without metrics, {} malformed".format(
+            self.decoded, self.incomplete, self.skipped, self.malformed)]
+        lines += ["  {} {}: {}".format(sha[:10], kind, description) for sha, kind, description in self.errors[:LISTED_ERRORS]]
+        if len(self.errors) > LISTED_ERRORS:
+            lines.append("  ... and {} more".format(len(self.errors) - LISTED_ERRORS))
+        return "\n".join(lines)
+
+def not_json(error):
+    '''Returns the problem of a blob that could not be parsed as JSON (or UTF-8).'''
+
+    return ("malformed", "the metrics are not JSON: " + str(error))
+
+def decode_record(record, problem=None):
+    '''Returns the numeric and descriptive values of a record (see record_values) and its problem, combined
+    with the problem of reading it. Metrics of the wrong type make a record malformed, missing ones incomplete.'''
+
+    values, texts, problems, missing = record_values(record)
+    if problem is None and problems:
+        problem = ("malformed", ", ".join(problems))
+    elif problem is None and missing:
+        problem = ("incomplete", "missing " + ", ".join(missing))
+    return values, texts, problem
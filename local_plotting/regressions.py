@@ -0,0 +1,83 @@
+import json
+import numpy as np
+import pandas as pd
+
+'''
+Regression detection over the data frames of data_prep.load_data_frames or a history.BuildHistory.
+
+Every build is compared with the rolling median of the builds before it. A build is a regression when its value lies
+more than `threshold` robust standard deviations (1.4826 * median absolute deviation of the same window) above that
+baseline and increased by at least `min_change` relative to it.
+'''
+
+# Watched metrics as (metrics type, index of the data frame or None, column, name in the report)
+WATCHED_METRICS = [
+    ("image_details", None, "Image Size", "total_bytes"),
+    ("image_details", None, "Code Area Size", "code_area"),
+    ("image_details", None, "Image Heap Size", "image_heap"),
+    ("analysis_results", 1, "Reachable", "reachable_methods"),
+    ("resource_usage", None, "GC Time", "gc_time"),
+    ("resource_usage", None, "Peak RSS", "peak_rss"),
+]
+
+def detect_jumps(values, window=30, threshold=6.0, min_change=0.01):
+    '''Returns the positions of values that jumped above the rolling baseline of the previous window values, together
+    with the baselines and robust z-scores of all values. Missing values are never flagged and do not enter baselines.'''
+
+    series = pd.Series(values, dtype=np.float64)
+    min_periods = max(3, window // 4)
+    baseline = series.rolling(window, min_periods=min_periods).median().shift(1)
+    deviation = (series - baseline).abs().rolling(window, min_periods=min_periods).median().shift(1) * 1.4826
+    # A perfectly flat history has no deviation, fall back to the relative change then
+    scale = deviation.where(deviation > 0, baseline.abs() * min_change)
+    score = (series - baseline) / scale
+    relative = (series - baseline) / baseline.abs()
+    flagged = ((score > threshold) & (relative >= min_change)).to_numpy(copy=True)
+    # Builds after a jump stay above the baseline until it catches up, only the first one of them is the regression
+    flagged[1:] = flagged[1:] & ~flagged[:-1]
+    return np.flatnonzero(flagged), baseline.to_numpy(), score.to_numpy()
+
+def find_regressions(frames, window=30, threshold=6.0, min_change=0.01):
+    '''Returns the regressions of all watched metrics in the data frames of all metrics types (or a BuildHistory),
+    ordered by build.'''
+
+    from history import BuildHistory
+
+    regressions = []
+    for metrics_type, index, column, metric in WATCHED_METRICS:
+        if isinstance(frames, BuildHistory):
+            values = frames.frame_column(metrics_type, index, column)
+            describe = lambda position: (frames.commit_sha(position), frames.commit_date(position), frames.commit_message(position))
+        else:
+            frame = frames[metrics_type][index] if index is not None else frames[metrics_type]
+            values = frame[column].to_numpy(dtype=np.float64)
+            describe = lambda position: (frame["Commit Sha"].iloc[position], frame["Commit Date"].iloc[position], frame["Commit Message"].iloc[position])
+        positions, baseline, score = detect_jumps(values, window, threshold, min_change)
+        for position in positions:
+            commit_sha, commit_date, commit_message = describe(position)
+            regressions.append({
+                "build": int(position),
+                "commit_sha": commit_sha,
+                "commit_date": commit_date,
+                "commit_message": commit_message.split("\n", 1)[0],
+                "metrics_type": metrics_type,
+                "metric": metric,
+                "value": float(values[position]),
+                "baseline": float(baseline[position]),
+                "change_percent": float(100 * (values[position] - baseline[position]) / abs(baseline[position])),
+                "score": float(score[position]),
+            })
+    regressions.sort(key=lambda regression: (regression["build"], regression["metric"]))
+    return regressions
+
+def write_report(path, regressions, builds, branch):
+    '''Writes the regressions as JSON report for CI.'''
+
+    with open(path, "w") as report_file:
+        json.dump({"branch": branch, "builds": builds, "regressions": regressions}, report_file, indent=2)
+
+def print_regressions(regressions):
+    for regression in regressions:
+        print("Regression in {} at {} ({}): {:.2f} -> {:.2f} (+{:.1f}%)".format(
+            regression["metric"], regression["commit_sha"][:10], regression["commit_date"],
+            regression["baseline"], regression["value"], regression["change_percent"]))
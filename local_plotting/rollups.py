@@ -0,0 +1,249 @@
+import fnmatch
+import numpy as np
+import pygit2
+import profiling
+from data_prep import NUMERIC_METRICS, ANALYSIS_RESULTS_ASPECTS, metrics_commit_shas, find_build_commits
+from history import NUMERIC_COLUMNS, load_history, read_history, reading_once
+
+'''
+Rollups of long build histories: the builds of a branch grouped into days, weeks, or releases, with the minimum,
+median, maximum, and 95th percentile of every numeric metric per bucket. A year of builds becomes a few hundred points
+at most, which are plotted as fast as a short history.
+
+Days and weeks (starting on Monday) are taken in the time zone of each commit's author. A release bucket holds the
+builds committed after the previous release tag up to the commit of its tag, builds after the newest tag form an
+open bucket. The statistics of all buckets are computed at once per column by sorting the values within their buckets.
+
+With a cache, every bucket is stored with its number of builds and a fingerprint of their shas. The next run only
+decodes the builds of buckets that changed, usually the newest day or week that new builds landed in.
+'''
+
+STATISTICS = ["min", "median", "max", "p95"]
+QUANTILES = [0, 0.5, 1, 0.95]
+# Numeric columns of the history and the derived 'Other' part of the image size
+ROLLUP_COLUMNS = NUMERIC_COLUMNS + ["Other"]
+# Key of the bucket of the builds after the newest release tag
+UNRELEASED = np.iinfo(np.int64).max
+DAY_SECONDS = 24 * 60 * 60
+
+class Rollup:
+    '''Statistics of the builds of a branch per bucket, oldest bucket first. stats has the shape (buckets, columns of
+    ROLLUP_COLUMNS, STATISTICS).'''
+
+    def __init__(self, period, keys, labels, counts, fingerprints, stats, reused=0):
+        self.period = period
+        self.keys = keys
+        self.labels = labels
+        self.counts = counts
+        self.fingerprints = fingerprints
+        self.stats = stats
+        # Number of buckets taken over from the cache
+        self.reused = reused
+
+    @classmethod
+    def from_history(cls, history, period, tags=None):
+        '''Rolls up all builds of a BuildHistory.'''
+
+        row_keys = bucket_keys(history.times, history.offsets, period, tags)
+        order, starts = group_rows(row_keys)
+        keys = row_keys[order[starts]]
+        return cls(period, keys, bucket_labels(keys, period, tags), np.diff(np.append(starts, len(row_keys))),
+                   fingerprints(history.shas, order, starts), history_statistics(history, order, starts))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def builds(self):
+        return int(self.counts.sum())
+
+    def column_statistics(self, metrics_type, index, column):
+        '''Returns the statistics of a column of the data frame(s) of a metrics type per bucket, like
+        BuildHistory.frame_column, as array of shape (buckets, STATISTICS).'''
+
+        if metrics_type == "analysis_results":
+            column = ANALYSIS_RESULTS_ASPECTS[index] + " " + column
+        return self.stats[:, ROLLUP_COLUMNS.index(column), :]
+
+    def starts(self):
+        '''Returns the local start time of every day or week bucket as datetime64[s] array.'''
+
+        return self.keys.astype("datetime64[s]")
+
+    def to_json(self):
+        return {"metrics": column_signature(), "period": self.period,
+                "buckets": [{"key": int(key), "count": int(count), "fingerprint": int(fingerprint), "stats": stats.tolist()}
+                            for key, count, fingerprint, stats in zip(self.keys, self.counts, self.fingerprints, self.stats)]}
+
+def column_signature():
+    '''Returns the columns of the rollups with their paths and scales, stored ones are only reused if they match.'''
+
+    return [[column, list(path), scale] for family in NUMERIC_METRICS.values() for column, path, scale in family]
+
+def fingerprints(shas, order, starts):
+    '''Returns the XOR of the first 8 bytes of the shas of every bucket, which identifies its builds, from an array of
+    raw shas of shape (count, 20).'''
+
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    prefixes = np.ascontiguousarray(shas[:, :8]).view(np.uint64).ravel()
+    return np.bitwise_xor.reduceat(prefixes[order], starts)
+
+def release_tags(repo, pattern="*"):
+    '''Returns the author times (epoch seconds) of the commits of all tags matching the glob pattern and the names of
+    the tags at each of them, oldest first.'''
+
+    tags = {}
+    for name in repo.references:
+        if not name.startswith("refs/tags/") or not fnmatch.fnmatch(name[len("refs/tags/"):], pattern):
+            continue
+        try:
+            commit = repo.references[name].peel(pygit2.Commit)
+        except (pygit2.InvalidSpecError, ValueError):
+            # Tags of trees or blobs do not mark a release
+            continue
+        tags.setdefault(commit.author.time, []).append(name[len("refs/tags/"):])
+    times = sorted(tags)
+    return np.array(times, dtype=np.int64), [", ".join(sorted(tags[time])) for time in times]
+
+def choose_period(times, offsets, max_buckets):
+    '''Returns "day" if the builds span at most max_buckets days, otherwise "week".'''
+
+    if len(times) == 0:
+        return "day"
+    local = times + offsets.astype(np.int64) * 60
+    return "day" if (local.max() - local.min()) // DAY_SECONDS < max_buckets else "week"
+
+def bucket_keys(times, offsets, period, tags=None):
+    '''Returns the bucket of every build: the local start of its day or week in epoch seconds, or the author time of
+    the commit of the release tag it belongs to (UNRELEASED after the newest one). tags is returned by release_tags.'''
+
+    if period == "tag":
+        tag_times, _ = tags
+        # Builds are in the order of the history, the running maximum keeps an out of order author time in its release
+        position = np.searchsorted(tag_times, np.maximum.accumulate(times)) if len(times) else np.zeros(0, dtype=np.int64)
+        return np.append(tag_times, UNRELEASED)[position]
+    days = (times + offsets.astype(np.int64) * 60) // DAY_SECONDS
+    if period == "week":
+        # 1 January 1970 was a Thursday
+        days = (days + 3) // 7 * 7 - 3
+    return days * DAY_SECONDS
+
+def bucket_labels(keys, period, tags=None):
+    '''Returns the names of buckets: the date of a day, the ISO week, or the name(s) of the release tag.'''
+
+    from datetime import datetime, timezone
+
+    if period == "tag":
+        tag_times, names = tags
+        names = dict(zip(tag_times.tolist(), names))
+        return [names.get(key, "unreleased") for key in keys.tolist()]
+    dates = [datetime.fromtimestamp(key, timezone.utc) for key in keys.tolist()]
+    return [date.strftime("%G-W%V") if period == "week" else date.strftime("%Y-%m-%d") for date in dates]
+
+def group_rows(keys):
+    '''Returns the order of the rows sorted by bucket and the position where each bucket starts in that order.'''
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))) if len(keys) else np.zeros(0, dtype=np.int64)
+    return order, starts
+
+def group_statistics(values, order, starts):
+    '''Returns the QUANTILES of values per bucket as array of shape (buckets, STATISTICS), interpolated linearly like
+    numpy.quantile. NaN values are ignored, buckets without values get NaN.'''
+
+    count = len(values)
+    groups = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, count)))
+    grouped = values[order]
+    # Sorting by value within each bucket moves NaN to its end
+    grouped = grouped[np.lexsort((grouped, groups))]
+    valid = np.add.reduceat(~np.isnan(grouped), starts) if count else np.zeros(0, dtype=np.int64)
+    result = np.full((len(starts), len(QUANTILES)), np.nan)
+    present = valid > 0
+    first, valid = starts[present], valid[present]
+    for index, quantile in enumerate(QUANTILES):
+        position = (valid - 1) * quantile
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        below, above = grouped[first + lower], grouped[first + upper]
+        result[present, index] = below + (above - below) * (position - lower)
+    return result
+
+def history_statistics(history, order, starts):
+    '''Returns the statistics of all ROLLUP_COLUMNS of a BuildHistory, whose rows are grouped by order and starts.'''
+
+    stats = np.empty((len(starts), len(ROLLUP_COLUMNS), len(STATISTICS)))
+    for index, column in enumerate(ROLLUP_COLUMNS):
+        values = history.frame_column("image_details", None, column) if column == "Other" else history.column(column)
+        stats[:, index, :] = group_statistics(values, order, starts)
+    return stats
+
+def load_rollup(repo_path, n, branch_name, period, cache=None, tag_pattern="*", max_buckets=None, repo=None, metrics_index=None, warehouse=None, jobs=1):
+    '''Returns the Rollup of the newest n builds of a branch. period is one of defaults.ROLLUP_PERIODS, auto chooses
+    days unless the builds span more than max_buckets days. Other arguments are the same as for history.load_history.
+    With a cache, only the builds of buckets that changed since the last rollup of the branch are decoded.'''
+
+    if repo is None and (warehouse is None or period == "tag"):
+        repo = pygit2.Repository(repo_path)
+    tags = release_tags(repo, tag_pattern) if period == "tag" else None
+
+    if warehouse is not None:
+        history = load_history(repo_path, n, branch_name, warehouse=warehouse)
+        if period == "auto":
+            period = choose_period(history.times, history.offsets, max_buckets)
+        with profiling.stage("rollup"):
+            return Rollup.from_history(history, period, tags)
+
+    branch = repo.branches.get(branch_name)
+    if branch is None:
+        raise ValueError(f"Branch " + branch_name + " not found.")
+    if metrics_index is None:
+        metrics_index = metrics_commit_shas(repo)
+
+    with reading_once():
+        with profiling.stage("find builds"):
+            build_ids = find_build_commits(repo, branch, n, metrics_index, cache)
+        metrics_index = None
+        build_ids.reverse()
+
+        with profiling.stage("commit times"):
+            times = np.empty(len(build_ids), dtype=np.int64)
+            offsets = np.empty(len(build_ids), dtype=np.int16)
+            for row, sha in enumerate(build_ids):
+                author = repo[sha].author
+                times[row], offsets[row] = author.time, author.offset
+        if period == "auto":
+            period = choose_period(times, offsets, max_buckets)
+
+        with profiling.stage("rollup"):
+            row_keys = bucket_keys(times, offsets, period, tags)
+            order, starts = group_rows(row_keys)
+            keys = row_keys[order[starts]]
+            counts = np.diff(np.append(starts, len(row_keys)))
+            shas = np.frombuffer(bytes.fromhex("".join(build_ids)), dtype=np.uint8).reshape(len(build_ids), 20)
+            identities = fingerprints(shas, order, starts)
+
+            stats = np.full((len(starts), len(ROLLUP_COLUMNS), len(STATISTICS)), np.nan)
+            stored = cache.get_rollup(repo.path, branch_name, period) if cache is not None else None
+            reused = np.zeros(len(starts), dtype=bool)
+            if stored is not None and stored["metrics"] == column_signature():
+                known = {(bucket["key"], bucket["count"], bucket["fingerprint"]): bucket["stats"] for bucket in stored["buckets"]}
+                for bucket, identity in enumerate(zip(keys.tolist(), counts.tolist(), identities.tolist())):
+                    if identity in known:
+                        stats[bucket] = known[identity]
+                        reused[bucket] = True
+
+        # Only the builds of buckets that are not in the cache are decoded
+        missing = np.sort(order[np.repeat(~reused, counts)])
+        if len(missing):
+            history = read_history(repo, [build_ids[row] for row in missing[::-1]], cache, jobs)
+            with profiling.stage("rollup"):
+                missing_order, missing_starts = group_rows(row_keys[missing])
+                stats[~reused] = history_statistics(history, missing_order, missing_starts)
+    profiling.count("buckets_reused", int(reused.sum()))
+
+    rollup = Rollup(period, keys, bucket_labels(keys, period, tags), counts, identities, stats, int(reused.sum()))
+    if cache is not None:
+        cache.put_rollup(repo.path, branch_name, period, rollup.to_json())
+    return rollup
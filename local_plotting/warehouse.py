@@ -0,0 +1,195 @@
+import json
+import os
+import sqlite3
+import time
+
+'''
+Local metrics warehouse: every graalvm-metrics blob of a repository together with its commit metadata and the
+branches containing it, in one SQLite file. "Last n builds of a branch" and time range queries are index lookups on
+(branch, commit_time) instead of history walks.
+
+Ingestion is incremental and resumable: builds already in the warehouse are not decoded again, builds are committed in
+batches, and the tip of every branch is only stored once the branch was ingested completely. The metrics refs are
+remembered with the ingestion that first saw them, so that only refs added since a branch was last ingested are checked
+for builds of commits older than its stored tip. Builds whose metrics
+cannot be read or parsed are left out and tried again by the next ingestion, metrics of the wrong type are stored as
+they are and reported when the builds are loaded (see decoding.py).
+'''
+
+def default_warehouse_path(repo_path):
+    '''Returns the default location of a repository's warehouse inside its .git directory.'''
+
+    import pygit2
+    return os.path.join(pygit2.Repository(repo_path).path, "graalvm-metrics.sqlite")
+
+class Warehouse:
+    '''SQLite store of the builds of one repository.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS builds (
+                commit_sha TEXT PRIMARY KEY,
+                blob_sha TEXT NOT NULL,
+                commit_time INTEGER NOT NULL,
+                author_time INTEGER NOT NULL,
+                author_offset INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                record TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS branch_builds (
+                branch TEXT NOT NULL,
+                commit_sha TEXT NOT NULL,
+                commit_time INTEGER NOT NULL,
+                PRIMARY KEY (branch, commit_sha)
+            );
+            CREATE INDEX IF NOT EXISTS branch_builds_time ON branch_builds (branch, commit_time);
+            CREATE TABLE IF NOT EXISTS branches (
+                branch TEXT PRIMARY KEY,
+                tip TEXT NOT NULL,
+                ingested_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS metrics_refs (
+                commit_sha TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL
+            );
+        ''')
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def known_builds(self):
+        return {row[0] for row in self._db.execute("SELECT commit_sha FROM builds")}
+
+    def branch_tip(self, branch):
+        row = self._db.execute("SELECT tip FROM branches WHERE branch = ?", (branch,)).fetchone()
+        return row[0] if row is not None else None
+
+    def branch_ingested_at(self, branch):
+        row = self._db.execute("SELECT ingested_at FROM branches WHERE branch = ?", (branch,)).fetchone()
+        return row[0] if row is not None else None
+
+    def seen_refs(self):
+        '''Returns a dict of commit sha -> start time of the ingestion that first saw its metrics ref.'''
+
+        return dict(self._db.execute("SELECT commit_sha, first_seen FROM metrics_refs"))
+
+    def add_seen_refs(self, shas, first_seen):
+        self._db.executemany("INSERT OR IGNORE INTO metrics_refs VALUES (?, ?)", [(sha, first_seen) for sha in shas])
+
+    def add_build(self, commit, blob_sha, record):
+        self._db.execute("INSERT OR IGNORE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (str(commit.id), str(blob_sha), commit.commit_time, commit.author.time, commit.author.offset,
+                          commit.message.strip(), json.dumps(record, separators=(",", ":"))))
+
+    def add_membership(self, branch, commit):
+        self._db.execute("INSERT OR IGNORE INTO branch_builds VALUES (?, ?, ?)", (branch, str(commit.id), commit.commit_time))
+
+    def reset_branch(self, branch):
+        self._db.execute("DELETE FROM branch_builds WHERE branch = ?", (branch,))
+        self._db.execute("DELETE FROM branches WHERE branch = ?", (branch,))
+
+    def set_branch_tip(self, branch, tip, ingested_at=None):
+        self._db.execute("INSERT OR REPLACE INTO branches VALUES (?, ?, ?)", (branch, str(tip), ingested_at if ingested_at is not None else time.time()))
+        self._db.commit()
+
+    def commit(self):
+        self._db.commit()
+
+    def last_builds(self, branch, n, since=None, until=None):
+        '''Returns the newest n builds of a branch, optionally within [since, until) as epoch seconds of the commit time,
+        in chronological order. Each build is a dict with commit_sha, author_time, author_offset, message, and record.'''
+
+        rows = self._db.execute('''
+            SELECT b.commit_sha, b.author_time, b.author_offset, b.message, b.record
+            FROM branch_builds m JOIN builds b ON b.commit_sha = m.commit_sha
+            WHERE m.branch = ? AND m.commit_time >= ? AND m.commit_time < ?
+            ORDER BY m.commit_time DESC LIMIT ?''',
+            (branch, since if since is not None else -2 ** 62, until if until is not None else 2 ** 62, n)).fetchall()
+        rows.reverse()
+        return [{"commit_sha": sha, "author_time": author_time, "author_offset": offset, "message": message, "record": json.loads(record)}
+                for sha, author_time, offset, message, record in rows]
+
+    def branches(self):
+        return [row[0] for row in self._db.execute("SELECT branch FROM branches ORDER BY branch")]
+
+def ingest(repo_path, warehouse, branch_names=None, batch_size=1000):
+    '''Loads the builds of the given branches (all local branches by default) that are not in the warehouse yet.
+    Returns the number of new builds, the number of new branch memberships, and the number of builds left out because
+    their metrics could not be read.'''
+
+    # Only ingestion needs git, querying a warehouse does not load pygit2 and pandas
+    import pygit2
+    from data_prep import index_metrics_refs, is_ancestor, get_record, MissingMetrics
+
+    started = time.time()
+    repo = pygit2.Repository(repo_path)
+    metrics_index = index_metrics_refs(repo)
+    known = warehouse.known_builds()
+    seen = warehouse.seen_refs()
+    new_builds = 0
+    new_memberships = 0
+    unreadable = set()
+
+    def add(branch_name, commit):
+        nonlocal new_builds, new_memberships
+        sha = str(commit.id)
+        if sha in unreadable:
+            return
+        if sha not in known:
+            metrics_ref = repo.references[metrics_index[sha]]
+            try:
+                record = get_record(metrics_ref)
+            except (MissingMetrics, ValueError):
+                unreadable.add(sha)
+                return
+            warehouse.add_build(commit, metrics_ref.resolve().peel()[0].id, record)
+            known.add(sha)
+            new_builds += 1
+            if new_builds % batch_size == 0:
+                warehouse.commit()
+        warehouse.add_membership(branch_name, commit)
+        new_memberships += 1
+
+    for branch_name in branch_names or list(repo.branches.local):
+        branch = repo.branches.get(branch_name)
+        if branch is None:
+            raise ValueError(f"Branch " + branch_name + " not found.")
+        tip = branch.target
+        old_tip = warehouse.branch_tip(branch_name)
+        if old_tip is not None and not is_ancestor(repo, old_tip, tip):
+            # Force-pushed, the old memberships may no longer be valid
+            warehouse.reset_branch(branch_name)
+            old_tip = None
+
+        walker = repo.walk(tip, pygit2.GIT_SORT_TIME)
+        if old_tip is not None:
+            walker.hide(old_tip)
+        visited = set()
+        for commit in walker:
+            if str(commit.id) in metrics_index:
+                visited.add(str(commit.id))
+                add(branch_name, commit)
+
+        if old_tip is not None:
+            # Builds that finished after the last ingestion of the branch may belong to commits older than its tip.
+            # Refs seen by earlier ingestions of the branch were checked then, e.g. those of builds on no local branch
+            since = warehouse.branch_ingested_at(branch_name)
+            for sha in metrics_index:
+                if sha not in visited and seen.get(sha, started) > since and is_ancestor(repo, sha, old_tip):
+                    add(branch_name, repo[sha])
+
+        warehouse.set_branch_tip(branch_name, tip, started)
+
+    # Unreadable builds are not marked as seen, so that the next ingestion tries them again
+    warehouse.add_seen_refs((sha for sha in metrics_index if sha not in seen and sha not in unreadable), started)
+    warehouse.commit()
+    return new_builds, new_memberships, len(unreadable)
@@ -0,0 +1,155 @@
+import os
+import time
+
+import pandas as pd
+import pygit2
+import profiling
+from data_prep import index_metrics_refs, find_build_commits, format_commit_date, extract_columns, create_data_frames
+from decoding import DecodeReport, read_record, decode_record
+from plot import plot_data
+from regressions import find_regressions, write_report, print_regressions
+from defaults import DEFAULT_WATCH_INTERVAL
+
+'''
+Watch mode of main.py: keeps the repository, the metrics cache, and the data frames of one branch in memory and
+updates the report whenever new builds land.
+
+The graalvm-metrics refs are polled through the modification times of .git/refs/graalvm-metrics and .git/packed-refs
+together with the tip of the branch, so an idle poll costs three stat calls and one ref lookup. When something changed,
+the scan of the branch is resumed from its previous tip, only the records of new builds are decoded and appended, and
+the report is only rendered again if the builds of the branch changed. The report is always written to the same file.
+'''
+
+# Reports that take longer than this from the new ref to the written file are logged as slow
+LATENCY_BUDGET = 1.0
+
+class Watcher:
+    '''Incrementally updated data frames and report of the newest n builds of one branch.'''
+
+    def __init__(self, repo_path, branch_name, n, metrics_type, cache, output_dir="output", large_history=None,
+                 max_points=None, regressions_path=None, regression_window=30, regression_threshold=6.0, image_format=None):
+        self.repo = pygit2.Repository(repo_path)
+        self.branch_name = branch_name
+        self.n = n
+        self.metrics_type = metrics_type
+        self.cache = cache
+        self.output_dir = output_dir
+        self.file_name = metrics_type + "_" + branch_name.replace("/", "_") + ".html"
+        self.plot_options = {"large_history": large_history, "image_format": image_format}
+        if max_points is not None:
+            self.plot_options["max_points"] = max_points
+        self.regressions_path = regressions_path
+        self.regression_window = regression_window
+        self.regression_threshold = regression_threshold
+        self.metrics_index = {}
+        self.builds = []
+        self.frames = None
+        self.signature = None
+
+    def poll_signature(self):
+        '''Returns a cheap fingerprint of the metrics refs and the branch tip that changes whenever a build lands.'''
+
+        def stat(path):
+            try:
+                result = os.stat(path)
+                return result.st_mtime_ns, result.st_size
+            except FileNotFoundError:
+                return None
+
+        branch = self.repo.branches.get(self.branch_name)
+        return (stat(os.path.join(self.repo.path, "refs", "graalvm-metrics")), stat(os.path.join(self.repo.path, "packed-refs")),
+                str(branch.target) if branch is not None else None)
+
+    def ref_appeared_at(self, shas):
+        '''Returns the time the newest of the given metrics refs was written, from its loose ref file or packed-refs.'''
+
+        times = []
+        for sha in shas:
+            for path in (os.path.join(self.repo.path, "refs", "graalvm-metrics", sha), os.path.join(self.repo.path, "packed-refs")):
+                if os.path.exists(path):
+                    times.append(os.path.getmtime(path))
+                    break
+        return max(times) if times else time.time()
+
+    def update(self):
+        '''Appends the builds that landed since the last update and renders the report again if the branch changed.
+        Returns the path of the report, or None if nothing had to be rendered.'''
+
+        start = time.perf_counter()
+        branch = self.repo.branches.get(self.branch_name)
+        if branch is None:
+            raise ValueError(f"Branch " + self.branch_name + " not found.")
+        previous_refs = self.metrics_index
+        self.metrics_index = index_metrics_refs(self.repo)
+        builds = find_build_commits(self.repo, branch, self.n, self.metrics_index, self.cache)
+        builds.reverse()
+        if builds == self.builds:
+            return None
+
+        loaded = set(self.builds)
+        new_builds = [sha for sha in builds if sha not in loaded]
+        new_frames = self.load_rows(new_builds)
+        if self.frames is None:
+            self.frames = new_frames
+        else:
+            self.frames = {metrics_type: merge_rows(frame, new_frames[metrics_type], builds) for metrics_type, frame in self.frames.items()}
+        self.builds = builds
+        self.cache.flush()
+
+        regressions = None
+        if self.regressions_path is not None:
+            regressions = find_regressions(self.frames, self.regression_window, self.regression_threshold)
+            print_regressions([regression for regression in regressions if regression["commit_sha"] in new_builds])
+            write_report(self.regressions_path, regressions, len(builds), self.branch_name)
+
+        path = plot_data(self.frames[self.metrics_type], self.branch_name, self.metrics_type, show=False, output_dir=self.output_dir,
+                         headless=True, regressions=regressions, file_name=self.file_name, **self.plot_options)
+
+        if previous_refs:
+            new_refs = [sha for sha in new_builds if sha not in previous_refs]
+            latency = time.time() - self.ref_appeared_at(new_refs) if new_refs else None
+            print("Added {} builds in {:.2f}s{}".format(len(new_builds), time.perf_counter() - start,
+                  "" if latency is None else ", {:.2f}s after the new ref appeared".format(latency)))
+            if latency is not None and latency > LATENCY_BUDGET:
+                print("Report update took longer than {:.1f}s".format(LATENCY_BUDGET))
+        return path
+
+    def load_rows(self, shas):
+        '''Returns the data frames of the given builds, decoding only their records. Builds without or with malformed
+        metrics keep their rows with NaN and are listed.'''
+
+        commits = [self.repo[sha] for sha in shas]
+        records = []
+        report = DecodeReport()
+        for sha in shas:
+            record, problem = read_record(self.repo, sha, self.cache)
+            report.add(sha, decode_record(record, problem)[2])
+            records.append(record)
+        if report.errors:
+            print(report.summary())
+        return create_data_frames(extract_columns(records),
+                                  [format_commit_date(commit.author.time, commit.author.offset) for commit in commits],
+                                  list(shas), [commit.message.strip() for commit in commits])
+
+    def run(self, interval=DEFAULT_WATCH_INTERVAL):
+        '''Polls for new builds until interrupted.'''
+
+        print("Watching " + self.branch_name + " of " + (self.repo.workdir or self.repo.path).rstrip("/"))
+        try:
+            while True:
+                signature = self.poll_signature()
+                if signature != self.signature:
+                    self.signature = signature
+                    with profiling.stage("update"):
+                        self.update()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+def merge_rows(frame, new_rows, builds):
+    '''Returns the rows of frame and new_rows (a data frame or list of data frames) for the given builds in their order.'''
+
+    if isinstance(frame, list):
+        return [merge_rows(old, new, builds) for old, new in zip(frame, new_rows)]
+    merged = pd.concat([frame, new_rows], ignore_index=True)
+    return merged.set_index("Commit Sha", drop=False).loc[builds].reset_index(drop=True)
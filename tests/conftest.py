@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "local_plotting"))
+# After local_plotting, whose modules share names with some benchmarks
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+@pytest.fixture
+def repo_path(tmp_path):
+    '''A synthetic repository (see benchmarks/synthetic.py) with a build for each of its 30 commits on main.'''
+
+    from synthetic import make_repo
+
+    path = str(tmp_path / "repo")
+    make_repo(path, 30, missing_rate=0, branches=2)
+    return path
+
+def replace_metrics(repo, sha, data):
+    '''Points the graalvm-metrics ref of a commit at a tree with a blob of the given bytes or JSON-serializable record.'''
+
+    import pygit2
+
+    if not isinstance(data, bytes):
+        data = json.dumps(data).encode()
+    tree = repo.TreeBuilder()
+    tree.insert("metrics.json", repo.create_blob(data), pygit2.GIT_FILEMODE_BLOB)
+    repo.references.create("refs/graalvm-metrics/" + sha, tree.write(), force=True)
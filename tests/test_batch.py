@@ -0,0 +1,18 @@
+import json
+
+import pygit2
+
+from batch import run_batch
+
+def test_overlapping_branches_share_decoded_builds(repo_path, tmp_path):
+    repo = pygit2.Repository(repo_path)
+    main = repo[repo.branches["main"].target]
+    # Two branches that share all but their newest build
+    repo.branches.local.create("release", repo[main.parent_ids[0]])
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([{"repo": repo_path, "branches": ["main", "release"], "n": 20, "metrics_types": ["image_details"]}]))
+
+    results = run_batch(str(manifest), str(tmp_path / "output"), 2, str(tmp_path / "metrics.sqlite"), 10 ** 8)
+    assert sorted(result["branch"] for result in results) == ["main", "release"]
+    # The builds of both branches were decoded once before the jobs, which find all of them in the cache
+    assert all("error" not in result and (result["hits"], result["misses"]) == (20, 0) for result in results)
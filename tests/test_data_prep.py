@@ -0,0 +1,57 @@
+import pygit2
+
+import data_prep
+from conftest import replace_metrics
+from data_prep import find_build_commits, metrics_commit_shas
+from metrics_cache import MetricsCache
+
+def count_full_scans(monkeypatch):
+    full_scans = []
+    scan_builds = data_prep.scan_builds
+
+    def counting_scan_builds(repo, tip, n, metrics_index, hide=None):
+        if hide is None:
+            full_scans.append(tip)
+        return scan_builds(repo, tip, n, metrics_index, hide)
+
+    monkeypatch.setattr(data_prep, "scan_builds", counting_scan_builds)
+    return full_scans
+
+def test_resumed_scan_stores_only_the_requested_builds(repo_path):
+    repo = pygit2.Repository(repo_path)
+    branch = repo.branches["main"]
+    cache = MetricsCache(":memory:")
+    expected = find_build_commits(repo, branch, 10, metrics_commit_shas(repo), cache)
+
+    scan = cache.get_scan(repo.path, "main")
+    assert scan["builds"] == expected and not scan["exhausted"]
+    assert "refs" not in scan and scan["refs_generation"] == 1
+    assert find_build_commits(repo, branch, 10, metrics_commit_shas(repo), cache) == expected
+
+def test_late_build_inside_the_scanned_history_is_found(repo_path):
+    repo = pygit2.Repository(repo_path)
+    branch = repo.branches["main"]
+    cache = MetricsCache(":memory:")
+    late = str(repo[branch.target].parent_ids[0])
+    repo.references.delete("refs/graalvm-metrics/" + late)
+    builds = find_build_commits(repo, branch, 5, metrics_commit_shas(repo), cache)
+    assert late not in builds
+
+    replace_metrics(repo, late, {"image_details": {}})
+    builds = find_build_commits(repo, branch, 5, metrics_commit_shas(repo), cache)
+    assert builds[1] == late and len(builds) == 5
+    assert cache.get_scan(repo.path, "main")["refs_generation"] == 2
+
+def test_build_on_another_branch_does_not_rescan(repo_path, monkeypatch):
+    repo = pygit2.Repository(repo_path)
+    branch = repo.branches["main"]
+    cache = MetricsCache(":memory:")
+    expected = find_build_commits(repo, branch, 10, metrics_commit_shas(repo), cache)
+
+    feature = repo.branches["feature/0"]
+    signature = pygit2.Signature("Build Bot", "bot@example.com")
+    commit = repo.create_commit(feature.name, signature, signature, "Feature", repo[feature.target].tree.id, [feature.target])
+    replace_metrics(repo, str(commit), {"image_details": {}})
+    full_scans = count_full_scans(monkeypatch)
+    assert find_build_commits(repo, branch, 10, metrics_commit_shas(repo), cache) == expected
+    assert full_scans == []
@@ -0,0 +1,29 @@
+import json
+
+import numpy as np
+import pygit2
+
+from conftest import replace_metrics
+from history import load_history
+
+def test_partial_blobs_are_reported_as_incomplete(repo_path):
+    repo = pygit2.Repository(repo_path)
+    tip = repo[repo.branches["main"].target]
+    without_heap, without_usage = str(tip.id), str(tip.parent_ids[0])
+    record = json.loads(repo.references["refs/graalvm-metrics/" + without_heap].peel(pygit2.Tree)[0].data)
+    del record["image_details"]["image_heap"]
+    replace_metrics(repo, without_heap, record)
+    record = json.loads(repo.references["refs/graalvm-metrics/" + without_usage].peel(pygit2.Tree)[0].data)
+    del record["resource_usage"]
+    replace_metrics(repo, without_usage, record)
+
+    history = load_history(repo_path, 10, "main")
+    report = history.report
+    assert (report.decoded, report.incomplete, report.skipped, report.malformed) == (8, 2, 0, 0)
+    problems = {sha: (kind, description) for sha, kind, description in report.errors}
+    assert problems[without_heap] == ("incomplete", "missing image_details.image_heap")
+    assert problems[without_usage] == ("incomplete", "missing resource_usage")
+    # The rows stay in place with NaN for the missing parts only
+    assert len(history) == 10
+    assert np.isnan(history.column("Image Heap Size")[-1]) and not np.isnan(history.column("Image Size")[-1])
+    assert np.isnan(history.column("Peak RSS")[-2]) and not np.isnan(history.column("Peak RSS")[-1])
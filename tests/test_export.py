@@ -0,0 +1,33 @@
+import csv
+import io
+
+import pygit2
+import pytest
+
+from conftest import replace_metrics
+from export import export
+
+def test_malformed_newest_build_keeps_metric_columns(repo_path):
+    repo = pygit2.Repository(repo_path)
+    tip = str(repo.branches["main"].target)
+    replace_metrics(repo, tip, b"{broken")
+
+    output = io.StringIO()
+    assert export(repo_path, "main", output, "csv", n=5) == 5
+    rows = list(csv.DictReader(io.StringIO(output.getvalue())))
+    assert "image_details.total_bytes" in rows[0] and "general_info.graalvm_version" in rows[0]
+    assert rows[0]["commit_sha"] == tip and rows[0]["image_details.total_bytes"] == ""
+    assert all(float(row["image_details.total_bytes"]) > 0 for row in rows[1:])
+
+def test_malformed_newest_build_in_arrow(repo_path, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    repo = pygit2.Repository(repo_path)
+    replace_metrics(repo, str(repo.branches["main"].target), [1, 2])
+
+    path = tmp_path / "main.arrow"
+    with open(path, "wb") as output:
+        export(repo_path, "main", output, "arrow", n=5)
+    table = pa.ipc.open_stream(pa.OSFile(str(path))).read_all()
+    sizes = table.column("image_details.total_bytes").to_pylist()
+    assert table.schema.field("image_details.total_bytes").type == pa.float64()
+    assert sizes[0] is None and all(size > 0 for size in sizes[1:])
@@ -0,0 +1,24 @@
+import pygit2
+import pytest
+
+import plot
+from conftest import replace_metrics
+from history import load_history
+
+@pytest.mark.parametrize("metrics_type", ["image_details", "analysis_results", "resource_usage"])
+def test_malformed_oldest_build_keeps_axis_ranges(repo_path, monkeypatch, metrics_type):
+    repo = pygit2.Repository(repo_path)
+    walker = repo.walk(repo.branches["main"].target, pygit2.GIT_SORT_TIME)
+    oldest = [str(commit.id) for _, commit in zip(range(10), walker)][-1]
+    replace_metrics(repo, oldest, b"{broken")
+
+    history = load_history(repo_path, 10, "main")
+    assert history.report.malformed == 1
+    monkeypatch.setattr(plot, "save_figure", lambda fig, *args: fig)
+    fig = plot.plot_data(history, "main", metrics_type, show=False, headless=True)
+    ranges = [fig.layout[axis].range for axis in fig.layout if axis.startswith("yaxis")]
+    assert ranges and all(axis_range is not None and axis_range[1] > 0 for axis_range in ranges)
+
+def test_metric_without_any_value_is_autoranged():
+    assert plot.axis_range([float("nan")] * 3, -1, 1) is None
+    assert plot.axis_range([float("nan"), 2.0], -1, 1) == [-1, 3.0]
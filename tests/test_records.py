@@ -0,0 +1,20 @@
+import json
+import math
+import os
+import sys
+
+from records import DecodeReport, decode_record
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RemoteBuildTracking as remote
+
+def test_remote_sizes_share_the_validation_of_local_records():
+    record = {"image_details": {"total_bytes": 5e6, "code_area": {"bytes": "2e6"}}}
+    sizes, problem = remote.parse_image_data(record)
+    assert sizes[0] == 5 and math.isnan(sizes[1]) and math.isnan(sizes[2])
+    assert problem == decode_record(record)[2] and problem[0] == "malformed"
+
+    report = DecodeReport()
+    for sha, content in [("a" * 40, json.dumps(record)), ("b" * 40, "{broken"), ("c" * 40, json.dumps({"image_details": {}}))]:
+        report.add(sha, remote.decode_image_data(content)[2])
+    assert (report.decoded, report.incomplete, report.skipped, report.malformed) == (0, 1, 0, 2)
@@ -0,0 +1,21 @@
+import pygit2
+import pytest
+
+from synthetic import make_repo
+
+def test_refuses_a_repository_it_did_not_generate(tmp_path):
+    path = str(tmp_path / "real")
+    repo = pygit2.init_repository(path)
+    signature = pygit2.Signature("Developer", "dev@example.com")
+    tip = repo.create_commit("refs/heads/main", signature, signature, "Real work", repo.TreeBuilder().write(), [])
+
+    with pytest.raises(ValueError, match="not generated by synthetic.py"):
+        make_repo(path, 10)
+    assert repo.branches["main"].target == tip
+    assert not [name for name in repo.references if name.startswith("refs/graalvm-metrics/")]
+
+def test_reuses_and_regenerates_its_own_repositories(tmp_path):
+    path = str(tmp_path / "synthetic")
+    assert make_repo(path, 10, missing_rate=0) == 10
+    assert make_repo(path, 10, missing_rate=0) == 10
+    assert make_repo(path, 12, missing_rate=0) == 12
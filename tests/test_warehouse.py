@@ -0,0 +1,43 @@
+import pygit2
+
+import data_prep
+from conftest import replace_metrics
+from warehouse import Warehouse, ingest
+
+def count_ancestry_checks(monkeypatch):
+    calls = []
+    is_ancestor = data_prep.is_ancestor
+    monkeypatch.setattr(data_prep, "is_ancestor", lambda *args: calls.append(args) or is_ancestor(*args))
+    return calls
+
+def test_late_build_of_an_ingested_commit_is_added(repo_path, tmp_path):
+    repo = pygit2.Repository(repo_path)
+    late = str(repo[repo.branches["main"].target].parent_ids[0])
+    repo.references.delete("refs/graalvm-metrics/" + late)
+
+    with Warehouse(str(tmp_path / "warehouse.sqlite")) as warehouse:
+        ingest(repo_path, warehouse, ["main"])
+        assert late not in warehouse.known_builds()
+        replace_metrics(repo, late, {"image_details": {"total_bytes": 1}})
+        assert ingest(repo_path, warehouse, ["main"]) == (1, 1, 0)
+        assert late in [build["commit_sha"] for build in warehouse.last_builds("main", 2)]
+
+def test_builds_on_no_branch_are_checked_once(repo_path, tmp_path, monkeypatch):
+    repo = pygit2.Repository(repo_path)
+    tip = repo.branches["main"].target
+    with Warehouse(str(tmp_path / "warehouse.sqlite")) as warehouse:
+        ingest(repo_path, warehouse)
+        # Builds of pull requests whose commits are not on any local branch
+        signature = pygit2.Signature("Build Bot", "bot@example.com")
+        pull_requests = set()
+        for i in range(3):
+            commit = repo.create_commit(None, signature, signature, "PR {}".format(i), repo[tip].tree.id, [tip])
+            replace_metrics(repo, str(commit), {"image_details": {"total_bytes": 1}})
+            pull_requests.add(str(commit))
+
+        calls = count_ancestry_checks(monkeypatch)
+        assert ingest(repo_path, warehouse) == (0, 0, 0)
+        assert sum(str(args[1]) in pull_requests for args in calls) == 3 * len(warehouse.branches())
+        calls.clear()
+        assert ingest(repo_path, warehouse) == (0, 0, 0)
+        assert not any(str(args[1]) in pull_requests for args in calls)